@@ -0,0 +1,279 @@
+"""
+MARC Crucible is released under "The MIT License (MIT)"
+
+Copyright © 2023 Joseph Alway
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the “Software”), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished
+to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# Benchmarks for MARC Crucible, run against a synthetic MARC record file.
+# The synthetic file is generated from a seed, so the same settings always give the same file, byte for byte.
+# Results are compared with stored baselines, so a change that slows loading, searching or saving shows up as a number.
+#
+# Usage: python MARCCrucible-Benchmark.py [--records 10000] [--save-baselines] ...
+# Run with --help to see every setting.
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+MARC_CRUCIBLE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MARC_CRUCIBLE_FILE = os.path.join(MARC_CRUCIBLE_DIRECTORY, 'MARCCrucible-CommandLineTool.py')
+DEFAULT_BASELINES_FILE = os.path.join(MARC_CRUCIBLE_DIRECTORY, 'MARCCrucible-Benchmark-Baselines.json')
+
+# Words for the synthetic records, most common first. Words are picked with Zipf-like weights, so searches for words
+# near the top of the list match many records, and searches for words near the bottom match few.
+SYNTHETIC_WORDS = ['the', 'of', 'and', 'a', 'in', 'history', 'to', 'for', 'on', 'with', 'new', 'studies', 'world',
+                   'life', 'art', 'guide', 'american', 'war', 'science', 'poems', 'introduction', 'england', 'social',
+                   'letters', 'literature', 'catalog', 'music', 'theory', 'church', 'essays', 'collected', 'selected',
+                   'philosophy', 'children', 'river', 'water', 'education', 'economic', 'medieval', 'reader', 'garden',
+                   'journey', 'mountains', 'concatenate', 'catalogue', 'cathedral', 'handbook', 'abstracts', 'memoirs',
+                   'dictionary']
+# Words with diacritics, as UTF-8 text and as MARC-8 bytes (MARC-8 puts the combining mark before the letter).
+SYNTHETIC_WORDS_WITH_DIACRITICS = [('café', b'caf\xe2e'), ('Über', b'\xe8Uber'), ('éclair', b'\xe2eclair'),
+                                   ('Français', b'Fran\xf0cais'), ('Müller', b'M\xe8uller'), ('à', b'\xe1a'),
+                                   ('Málaga', b'M\xe2alaga'), ('Göttingen', b'G\xe8ottingen')]
+SYNTHETIC_NAMES = ['Smith', 'Jones', 'Garcia', 'Brown', 'Miller', 'Davis', 'Wilson', 'Moore', 'Taylor', 'Anderson',
+                   'Thomas', 'Jackson', 'White', 'Harris', 'Martin', 'Thompson', 'Robinson', 'Clark', 'Lewis', 'Lee']
+SYNTHETIC_PLACES = ['New York', 'London', 'Chicago', 'Boston', 'Paris', 'Berlin', 'Toronto', 'Oxford']
+
+
+def build_raw_marc_record(leader_09, fields):
+    # Build one record in ISO 2709 (MARC) form. leader_09 is b' ' for MARC-8 and b'a' for UTF-8.
+    # fields is a list of (tag, data) for control fields, and (tag, indicators, [(code, data), ...]) for the rest.
+    directory = b''
+    field_data = b''
+    for field in fields:
+        if len(field) == 2:
+            data = field[1] + b'\x1e'
+        else:
+            data = field[1] + b''.join(b'\x1f' + code + subfield_data for code, subfield_data in field[2]) + b'\x1e'
+        directory += field[0] + b'%04d%05d' % (len(data), len(field_data))
+        field_data += data
+    base_address = 24 + len(directory) + 1
+    record_length = base_address + len(field_data) + 1
+    leader = b'%05dnam %s22%05d a 4500' % (record_length, leader_09, base_address)
+    return leader + directory + b'\x1e' + field_data + b'\x1d'
+
+
+def synthetic_text(random_generator, word_count, marc8, word_weights):
+    # word_count words, now and then one with diacritics, as MARC-8 or UTF-8 bytes.
+    words = []
+    for word in random_generator.choices(SYNTHETIC_WORDS, word_weights, k=word_count):
+        if random_generator.random() < 0.03:
+            word_text, word_marc8 = random_generator.choice(SYNTHETIC_WORDS_WITH_DIACRITICS)
+            words.append(word_marc8 if marc8 else word_text.encode('utf-8'))
+        else:
+            words.append(word.encode('ascii'))
+    return b' '.join(words)
+
+
+def generate_synthetic_marc_file(marc_file_to_save, record_count=10000, fields_per_record=12, marc8_share=0.3,
+                                 long_note_share=0.1, long_note_words=300, seed=1):
+    # Write record_count synthetic records to marc_file_to_save.
+    # Each record has roughly fields_per_record fields. marc8_share of the records are MARC-8, the rest UTF-8.
+    # long_note_share of the records get a 520 summary note of long_note_words words.
+    random_generator = random.Random(seed)
+    word_weights = [1 / (rank + 1) for rank in range(len(SYNTHETIC_WORDS))]
+    with open(str(marc_file_to_save), 'wb') as fh:
+        for record_number in range(record_count):
+            marc8 = random_generator.random() < marc8_share
+            year = random_generator.randint(1900, 2023)
+            name = random_generator.choice(SYNTHETIC_NAMES).encode('ascii') + b', ' + \
+                random_generator.choice(SYNTHETIC_NAMES)[0].encode('ascii') + b'.'
+            fields = [(b'001', b'syn%09d' % record_number),
+                      (b'005', b'20230101120000.0'),
+                      (b'008', b'230101s%d    xxu           000 0 %s d' % (year, random_generator.choice(
+                          [b'eng', b'eng', b'eng', b'ger', b'fre', b'spa']))),
+                      (b'020', b'  ', [(b'a', b'978%010d' % random_generator.randint(0, 9999999999))]),
+                      (b'100', b'1 ', [(b'a', name)]),
+                      (b'245', b'10', [(b'a', synthetic_text(random_generator, random_generator.randint(2, 8), marc8,
+                                                             word_weights) + b' /'),
+                                       (b'c', b'by ' + name)]),
+                      (b'264', b' 1', [(b'a', random_generator.choice(SYNTHETIC_PLACES).encode('ascii') + b' :'),
+                                       (b'b', random_generator.choice(SYNTHETIC_NAMES).encode('ascii') + b' Press,'),
+                                       (b'c', b'%d.' % year)]),
+                      (b'300', b'  ', [(b'a', b'%d pages ;' % random_generator.randint(20, 900)),
+                                       (b'c', b'24 cm.')])]
+            for extra_field_number in range(max(0, fields_per_record - len(fields) +
+                                                random_generator.randint(-2, 2))):
+                field_choice = random_generator.random()
+                if field_choice < 0.5:
+                    fields.append((b'650', b' 0', [(b'a', synthetic_text(random_generator, 2, marc8, word_weights)),
+                                                   (b'x', b'History.')]))
+                elif field_choice < 0.8:
+                    fields.append((b'500', b'  ', [(b'a', synthetic_text(random_generator,
+                                                                         random_generator.randint(5, 20), marc8,
+                                                                         word_weights) + b'.')]))
+                else:
+                    fields.append((b'700', b'1 ', [(b'a', random_generator.choice(SYNTHETIC_NAMES).encode('ascii') +
+                                                    b', ' + random_generator.choice(SYNTHETIC_NAMES).encode('ascii'))]))
+            if random_generator.random() < long_note_share:
+                fields.append((b'520', b'  ', [(b'a', synthetic_text(random_generator, long_note_words, marc8,
+                                                                     word_weights) + b'.')]))
+            # Fields are kept in tag order, as they would be in a catalog.
+            fields.sort(key=lambda field: field[0])
+            fh.write(build_raw_marc_record(b' ' if marc8 else b'a', fields))
+
+
+def load_marc_crucible():
+    # Import MARCCrucible-CommandLineTool.py as a module. The file name has dashes, so it can't be imported by name.
+    module_spec = importlib.util.spec_from_file_location('marc_crucible', MARC_CRUCIBLE_FILE)
+    marc_crucible = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(marc_crucible)
+    return marc_crucible
+
+
+def time_benchmark(benchmark_function, repeat):
+    # Run benchmark_function repeat times. Returns the fastest and the median time in seconds.
+    # Matching data the searches print is sent to devnull, so the terminal doesn't change the times.
+    run_times = []
+    with open(os.devnull, 'w') as devnull:
+        for run_number in range(repeat):
+            with contextlib.redirect_stdout(devnull):
+                start_time = time.perf_counter()
+                benchmark_function()
+                end_time = time.perf_counter()
+            run_times.append(end_time - start_time)
+    return min(run_times), statistics.median(run_times)
+
+
+def marc_crucible_benchmarks(marc_crucible, marc_file, work_directory):
+    # The benchmarks, as (name, function to time). The records searched and saved are loaded once, up front.
+    records_loaded, field_inventory = marc_crucible.read_marc_file(marc_file, 'records')
+    matching_record_positions = marc_crucible.search_loaded_record_positions(
+        records_loaded, [['245', 'a']], ['history'], False, match_report=marc_crucible.MatchReport(0))
+    marc_file_to_save = os.path.join(work_directory, 'benchmark_save.mrc')
+
+    def load_compact():
+        compact_records, compact_field_inventory = marc_crucible.read_marc_file(marc_file, 'compact')
+        compact_records.close()
+
+    return [
+        ('load_records (records)', lambda: marc_crucible.read_marc_file(marc_file, 'records')),
+        ('load_records (compact)', load_compact),
+        ('search_loaded_records (substring, 245a)', lambda: marc_crucible.search_loaded_records(
+            records_loaded, [['245', 'a']], ['history'], False)),
+        ('search_loaded_records (substring, all fields)', lambda: marc_crucible.search_loaded_records(
+            records_loaded, [['', '']], ['dictionary'], False)),
+        ('search_loaded_records (whole word, 650a)', lambda: marc_crucible.search_loaded_records(
+            records_loaded, [['650', 'a']], ['catalog'], True)),
+        ('search_loaded_records (whole word, all fields)', lambda: marc_crucible.search_loaded_records(
+            records_loaded, [['', '']], ['Göttingen'], True)),
+        ('reg_ex_search_loaded_records (245a)', lambda: marc_crucible.reg_ex_search_loaded_records(
+            records_loaded, [['245', 'a']], [r'\b(?:memoirs|letters) of\b'])),
+        ('reg_ex_search_loaded_records (all fields)', lambda: marc_crucible.reg_ex_search_loaded_records(
+            records_loaded, [['', '']], [r'[Cc]atalog(?:ue)?s?\b'])),
+        ('list_used_fields_and_subfields', lambda: marc_crucible.list_used_fields_and_subfields(records_loaded)),
+        # save_matches_to_file() asks for the file name, so the save itself is timed.
+        ('save_matches_to_file', lambda: marc_crucible.save_record_positions(
+            records_loaded, matching_record_positions, marc_file_to_save)),
+    ]
+
+
+def read_baselines(baselines_file):
+    try:
+        with open(baselines_file, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark MARC Crucible on a synthetic MARC record file.')
+    argument_parser.add_argument('--records', type=int, default=10000, help='Records in the synthetic file.')
+    argument_parser.add_argument('--fields', type=int, default=12, help='Average fields per record.')
+    argument_parser.add_argument('--marc8-share', type=float, default=0.3, help='Share of MARC-8 records, 0 to 1.')
+    argument_parser.add_argument('--long-note-share', type=float, default=0.1,
+                                 help='Share of records with a long 520 note, 0 to 1.')
+    argument_parser.add_argument('--long-note-words', type=int, default=300, help='Words in a long 520 note.')
+    argument_parser.add_argument('--seed', type=int, default=1, help='Seed for the synthetic file.')
+    argument_parser.add_argument('--repeat', type=int, default=5, help='Runs of each benchmark.')
+    argument_parser.add_argument('--only', default='', help='Only run benchmarks with this text in their name.')
+    argument_parser.add_argument('--work-directory', default=os.path.join(tempfile.gettempdir(),
+                                                                          'marc_crucible_benchmark'),
+                                 help='Where synthetic files are kept between runs.')
+    argument_parser.add_argument('--baselines', default=DEFAULT_BASELINES_FILE, help='Baselines JSON file.')
+    argument_parser.add_argument('--save-baselines', action='store_true', help='Save the results as the baselines.')
+    argument_parser.add_argument('--tolerance', type=float, default=0.10,
+                                 help='Slowdown over the baseline reported as a regression, e.g. 0.10 for 10%%.')
+    arguments = argument_parser.parse_args()
+
+    corpus_settings = {'records': arguments.records, 'fields': arguments.fields,
+                       'marc8_share': arguments.marc8_share, 'long_note_share': arguments.long_note_share,
+                       'long_note_words': arguments.long_note_words, 'seed': arguments.seed}
+    os.makedirs(arguments.work_directory, exist_ok=True)
+    marc_file = os.path.join(arguments.work_directory, 'synthetic_' + '_'.join(
+        str(corpus_settings[setting]) for setting in sorted(corpus_settings)) + '.mrc')
+    if not os.path.exists(marc_file):
+        print('Generating ' + marc_file)
+        generate_synthetic_marc_file(marc_file + '.tmp', arguments.records, arguments.fields, arguments.marc8_share,
+                                     arguments.long_note_share, arguments.long_note_words, arguments.seed)
+        os.replace(marc_file + '.tmp', marc_file)
+    print('Synthetic file: ' + marc_file + ' (' + str(os.path.getsize(marc_file)) + ' bytes)')
+
+    marc_crucible = load_marc_crucible()
+    baselines = read_baselines(arguments.baselines)
+    if baselines is not None and baselines.get('corpus') != corpus_settings:
+        print('Baselines in ' + arguments.baselines + ' are for other synthetic file settings. Not comparing.')
+        baselines = None
+    baseline_results = {} if baselines is None else baselines.get('results', {})
+
+    results = {}
+    regressions = []
+    print('Benchmark'.ljust(48) + 'Fastest'.rjust(10) + 'Median'.rjust(10) + 'Baseline'.rjust(10) + 'Change'.rjust(9))
+    for benchmark_name, benchmark_function in marc_crucible_benchmarks(marc_crucible, marc_file,
+                                                                       arguments.work_directory):
+        if arguments.only not in benchmark_name:
+            continue
+        fastest_time, median_time = time_benchmark(benchmark_function, arguments.repeat)
+        results[benchmark_name] = {'fastest': round(fastest_time, 6), 'median': round(median_time, 6)}
+        result_line = benchmark_name.ljust(48) + format(fastest_time, '.4f').rjust(10) + \
+            format(median_time, '.4f').rjust(10)
+        # Runs are compared on their fastest time, as it's the least affected by whatever else the computer is doing.
+        if benchmark_name in baseline_results:
+            baseline_time = baseline_results[benchmark_name]['fastest']
+            change = (fastest_time - baseline_time) / baseline_time if baseline_time else 0.0
+            result_line += format(baseline_time, '.4f').rjust(10) + format(change, '+.1%').rjust(9)
+            if change > arguments.tolerance:
+                result_line += '  SLOWER'
+                regressions.append(benchmark_name)
+        print(result_line)
+
+    if arguments.save_baselines:
+        # Baselines already saved for benchmarks that weren't run are kept.
+        baseline_results.update(results)
+        with open(arguments.baselines, 'w', encoding='utf-8') as fh:
+            json.dump({'corpus': corpus_settings,
+                       'saved': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': baseline_results}, fh, indent=2)
+        print('Baselines saved to ' + arguments.baselines)
+    if regressions:
+        print(str(len(regressions)) + ' benchmark(s) more than ' + format(arguments.tolerance, '.0%') +
+              ' slower than the baseline.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,59 +23,175 @@ import datetime
 import sys
 import os
 import re
+import io
+import contextlib
+import multiprocessing
+import concurrent.futures
+import mmap
+import array
+import struct
+import marshal
+import csv
+import collections
+import bisect
+import random
+import gzip
+import bz2
+import lzma
+import zlib
+import hashlib
+import tempfile
+import unicodedata
+import threading
+import queue
+import json
+import xml.etree.ElementTree
+import time
+import cProfile
+import pstats
+import tracemalloc
+import asyncio
+import http.client
+import urllib.parse
+import argparse
 
 
-def load_records():
-    # Load records from MARC record file.
+def user_entry_marc_file_to_load():
+    # Get name of MARC record file to load. A directory or a pattern, e.g. exports/*.mrc.gz, loads all its MARC record
+    # files as one file. See marc_input_files().
+    marc_file_to_load = ''
+    file_load_name_not_acceptable = True
+    while file_load_name_not_acceptable:
+        print('File extension must be \".mrc\" or \".raw\". Extension .mrc assumed, if valid extension not given.')
+        print('MARCXML (.xml) and MARC-in-JSON lines (.jsonl or .json) are converted as they are read.')
+        print('Files compressed with gzip, bzip2 or xz (.mrc.gz, .mrc.bz2, .mrc.xz) are read as they are. '
+              'A directory or a pattern such as parts/*.mrc.gz reads all its MARC files as one file.')
+        print('Enter the address of a MARC Crucible server, e.g. http://127.0.0.1:8765, to use the file it has loaded.')
+        print('Enter \":q\" to quit.')
+        marc_file_to_load = input('MARC record(s) file path: ')
+        if marc_file_to_load.lower() == ':q':
+            sys.exit()
+        else:
+            try:
+                if marc_query_server_url(marc_file_to_load):
+                    file_load_name_not_acceptable = False
+                elif os.path.isdir(marc_file_to_load) or glob.has_magic(marc_file_to_load):
+                    if marc_input_files(marc_file_to_load):
+                        file_load_name_not_acceptable = False
+                    else:
+                        print('ERROR: No MARC files found. Files must have .mrc, .raw, .xml, .jsonl or .json '
+                              'extensions, or .mrc.gz, .mrc.bz2, or .mrc.xz for compressed files.')
+                elif not marc_file_extension_acceptable(marc_file_to_load):
+                    marc_file_to_load += '.mrc'
+                    if os.path.isfile(marc_file_to_load):
+                        file_load_name_not_acceptable = False
+                    else:
+                        print('ERROR: Invalid Filename. Does the file exist? '
+                              'Does the file have a .mrc or .raw extension?')
+                elif os.path.isfile(marc_file_to_load):
+                    file_load_name_not_acceptable = False
+                else:
+                    print('ERROR: Invalid Filename. Does the file exist?')
+            except OSError:
+                print('ERROR: Invalid Filename. Does the file exist?')
+    return marc_file_to_load
+
+
+def read_marc_file(marc_file_to_load, record_load_mode='records', run_metrics=None):
+    # Load records from a MARC record file, without asking for anything or printing anything. Returns the records and
+    # the FieldInventory of the records.
+    # record_load_mode 'records' parses every record with pymarc.MARCReader into a MarcRecordList, and takes the
+    # inventory while loading.
+    # 'index' and 'index_001' memory-map the file and only index where each record is. See MarcRecordStore.
+    # 'compact' reads the file into memory and indexes every record and field. See CompactMarcRecordStore.
+    # The inventory is None for a record store, so it's only taken when it's needed.
+    # Raises OSError, if the file can't be read, and ValueError, if an empty file is loaded into a record store.
+    # The records and bytes loaded are added to run_metrics, and the fields and subfields, if the inventory is taken.
+    # Compressed files, directories and patterns are read with open_marc_input(). They can't be memory-mapped, so
+    # 'index' and 'index_001' load them like 'compact'.
+    # A server address connects to a MARC Crucible server, which has the file loaded. See MarcQueryClient.
+    if marc_query_server_url(marc_file_to_load):
+        return MarcQueryClient(marc_file_to_load), None
+    if record_load_mode in ('index', 'index_001') and not marc_input_is_plain_file(marc_file_to_load):
+        record_load_mode = 'compact'
+    if record_load_mode == 'records':
+        field_inventory = FieldInventory()
+        list_of_record_objects = MarcRecordList(marc_file_to_load)
+        with open_marc_input(marc_file_to_load) as fh:
+            # Normal reading of good data:
+            # reader = pym.MARCReader(fh)
+            #
+            # Added to_unicode=False, force_utf8=False, hide_utf8_warnings=False, and utf8_handling='strict'
+            # (This keeps the MARCReader module from choking on bad data.
+            # It also reports when a warning is encountered.)
+            reader = pymarc.MARCReader(fh, to_unicode=False, force_utf8=False, hide_utf8_warnings=True,
+                                       utf8_handling='strict')
+            record_offset = 0
+            for marc_record in reader:
+                # MARCReader reads each record in one piece, so the file position is where the next record starts.
+                record_end = fh.tell()
+                list_of_record_objects.append_record(marc_record, record_offset, record_end - record_offset)
+                record_offset = record_end
+                field_inventory.add_record(marc_record)
+        bytes_loaded = record_offset
+    elif record_load_mode == 'compact':
+        field_inventory = None
+        list_of_record_objects = CompactMarcRecordStore(marc_file_to_load)
+        bytes_loaded = len(list_of_record_objects.buffer)
+    else:
+        field_inventory = None
+        list_of_record_objects = MarcRecordStore(marc_file_to_load, record_load_mode == 'index_001')
+        bytes_loaded = len(list_of_record_objects.buffer)
+    if run_metrics is not None:
+        run_metrics.records += len(list_of_record_objects)
+        run_metrics.bytes += bytes_loaded
+        if field_inventory is not None:
+            run_metrics.fields_visited += sum(field_inventory.field_occurrences.values())
+            run_metrics.subfields_visited += sum(field_inventory.subfield_occurrences.values())
+    return list_of_record_objects, field_inventory
+
+
+def load_records(record_load_mode='records', metrics_file=None, profile_mode=None, use_session_cache=False):
+    # Load records from MARC record file. Returns the records, the name of the file they were loaded from, the
+    # FieldInventory of the records, and the SessionCache the records were loaded from. See read_marc_file().
+    # With use_session_cache, records are loaded from the session saved for the file, if there is one. The session
+    # cache is None, if the records were read from the file.
     list_of_record_objects = []
+    field_inventory = None
+    session_cache = None
     file_loading = True
     while file_loading:
         # Get name of MARC record file to load.
-        marc_file_to_load = ''
-        file_load_name_not_acceptable = True
-        while file_load_name_not_acceptable:
-            print('File extension must be \".mrc\" or \".raw\". Extension .mrc assumed, if valid extension not given.')
-            print('Enter \":q\" to quit.')
-            marc_file_to_load = input('MARC record(s) file path: ')
-            if marc_file_to_load.lower() == ':q':
-                sys.exit()
-            else:
-                try:
-                    if marc_file_to_load[-4:].lower() != '.mrc' and marc_file_to_load[-4:].lower() != '.raw':
-                        marc_file_to_load += '.mrc'
-                        if glob.glob(marc_file_to_load):
-                            file_load_name_not_acceptable = False
-                        else:
-                            print('ERROR: Invalid Filename. Does the file exist? '
-                                  'Does the file have a .mrc or .raw extension?')
-                    elif glob.glob(marc_file_to_load) and ((marc_file_to_load[-4:].lower() == '.mrc')
-                                                           or (marc_file_to_load[-4:].lower() == '.raw')):
-                        file_load_name_not_acceptable = False
-                    elif glob.glob(marc_file_to_load):
-                        print('ERROR: Invalid Filename. File must have .mrc or .raw extension. '
-                              'Must provide valid MARC file.')
-                    else:
-                        print('ERROR: Invalid Filename. Does the file exist?')
-                except OSError:
-                    print('ERROR: Invalid Filename. Does the file exist?')
+        marc_file_to_load = user_entry_marc_file_to_load()
         # Load MARC file.
+        run_metrics = start_run_metrics('load', metrics_file, profile_mode)
         load_start_time = datetime.datetime.now()
         try:
-            with open(str(marc_file_to_load), 'rb') as fh:
-                # Normal reading of good data:
-                # reader = pym.MARCReader(fh)
-                #
-                # Added to_unicode=False, force_utf8=False, hide_utf8_warnings=False, and utf8_handling='strict'
-                # (This keeps the MARCReader module from choking on bad data.
-                # It also reports when a warning is encountered.)
-                reader = pymarc.MARCReader(fh, to_unicode=False, force_utf8=False, hide_utf8_warnings=True,
-                                           utf8_handling='strict')
-                for marc_record in reader:
-                    list_of_record_objects.append(marc_record)
-        except (FileNotFoundError, OSError):
+            if use_session_cache and record_load_mode == 'records':
+                session_cache = SessionCache.open(marc_file_to_load)
+            if session_cache is not None:
+                list_of_record_objects = session_cache.records_loaded
+                field_inventory = session_cache.field_inventory
+                if run_metrics is not None:
+                    run_metrics.records += len(list_of_record_objects)
+            else:
+                list_of_record_objects, field_inventory = read_marc_file(marc_file_to_load, record_load_mode,
+                                                                         run_metrics)
+        except (FileNotFoundError, OSError, ValueError):
+            # ValueError is raised when memory-mapping an empty file.
             marc_file_to_load = ''
             list_of_record_objects = [None]
+            field_inventory = None
         load_end_time = datetime.datetime.now()
+        if run_metrics is not None:
+            run_metrics.details.update({'marc_file': str(marc_file_to_load), 'load_mode': record_load_mode,
+                                        'session_cache': session_cache is not None})
+        finish_run_metrics(run_metrics, metrics_file)
+        if session_cache is not None:
+            print('Resumed the session saved in ' + session_cache_file_name(marc_file_to_load) + ': '
+                  + str(len(session_cache.result_sets)) + ' result set(s).')
+        if record_load_mode in ('index', 'index_001') and isinstance(list_of_record_objects, CompactMarcRecordStore):
+            print('Compressed files, directories and patterns can\'t be memory-mapped. Loaded in Compact load mode.')
 
         # Print to screen, the time it took to load the record file.
         load_time = str(format((load_end_time - load_start_time).total_seconds(), '.2f'))
@@ -84,7 +200,7 @@ def load_records():
             print('ERROR: No records loaded. Does the file exist? Is it a valid MARC file?')
         else:
             file_loading = False
-    return list_of_record_objects
+    return list_of_record_objects, marc_file_to_load, field_inventory, session_cache
 
 
 def clear_screen():
@@ -118,6 +234,13 @@ def main_menu():
               '[7]:List Fields and Subfields in Record Set\n'
               '[8]:Save Matching Records\n'
               '[9]:Settings\n'
+              '[A]:Stream Search to File (Without Loading)\n'
+              '[B]:Stream RegEx Search to File (Without Loading)\n'
+              '[C]:View Record by Number or Control Number (001)\n'
+              '[D]:Batch Search to Files (Without Loading)\n'
+              '[E]:Combine or Refine Search Results (AND, OR, NOT)\n'
+              '[F]:Fixed Field Search (e.g. LDR/06 = \'a\' AND 008/35-37 = \'ger\')\n'
+              '[G]:Find Duplicate Records by 020, 035, 010 or Title (Without Loading)\n'
               '[0]:Quit')
         if error_message:
             print(error_message)
@@ -125,9 +248,9 @@ def main_menu():
         else:
             pass
         try:
-            selected_menu_number = input('Enter Selection: ')
+            selected_menu_number = input('Enter Selection: ').lower()
             if len(selected_menu_number) == 1:
-                if selected_menu_number in '1234567890':
+                if selected_menu_number in '1234567890abcdefg':
                     invalid_entry = False
                 else:
                     clear_screen()
@@ -138,6 +261,30 @@ def main_menu():
     return selected_menu_number
 
 
+def parse_field_subfield(field_subfield_string):
+    # Search field and/or subfield, e.g. 245a, 245, a, or ldr. Blank searches all fields and subfields.
+    # Returns None, if field_subfield_string isn't a valid search field and/or subfield.
+    if field_subfield_string.isnumeric() and len(field_subfield_string) == 3:
+        field_to_search = field_subfield_string
+        subfield_to_search = ''
+    elif field_subfield_string.isalpha() and field_subfield_string.lower() == 'ldr':
+        field_to_search = 'ldr'
+        subfield_to_search = ''
+    elif field_subfield_string.isalnum() and len(field_subfield_string) == 4 \
+            and field_subfield_string[:-1].isnumeric() and field_subfield_string[-1:].isalpha():
+        field_to_search = field_subfield_string[:-1]
+        subfield_to_search = field_subfield_string[-1:]
+    elif field_subfield_string == '':
+        field_to_search = ''
+        subfield_to_search = ''
+    elif field_subfield_string.isalpha() and len(field_subfield_string) == 1:
+        field_to_search = ''
+        subfield_to_search = field_subfield_string
+    else:
+        return None
+    return [(str(field_to_search), str(subfield_to_search))]
+
+
 def user_entry_field_subfield():
     # Search Field(s)
     field_subfield_list = []
@@ -148,38 +295,12 @@ def user_entry_field_subfield():
         field_subfield_string = input('Search Field+Subfield: ')
         if field_subfield_string.lower() == ':q':
             sys.exit()
-        elif field_subfield_string.isnumeric() and len(field_subfield_string) == 3:
-            field_to_search = field_subfield_string
-            subfield_to_search = ''
-            field_subfield_list = [(str(field_to_search), str(subfield_to_search))]
-            field_subfield_to_search_not_acceptable = False
-        elif field_subfield_string.isalpha() and field_subfield_string.lower() == 'ldr':
-            field_to_search = 'ldr'
-            subfield_to_search = ''
-            field_subfield_list = [(str(field_to_search), str(subfield_to_search))]
-            field_subfield_to_search_not_acceptable = False
-        elif field_subfield_string.isalnum() and len(field_subfield_string) == 4 \
-                and field_subfield_string[:-1].isnumeric() and field_subfield_string[-1:].isalpha():
-            field_to_search = field_subfield_string[:-1]
-            subfield_to_search = field_subfield_string[-1:]
-            field_subfield_list = [(str(field_to_search), str(subfield_to_search))]
-            field_subfield_to_search_not_acceptable = False
-        elif field_subfield_string == '':
-            field_to_search = ''
-            subfield_to_search = ''
-            field_subfield_list = [(str(field_to_search), str(subfield_to_search))]
-            field_subfield_to_search_not_acceptable = False
-        elif field_subfield_string.isalpha() and len(field_subfield_string) == 1:
-            field_to_search = ''
-            subfield_to_search = field_subfield_string
-            field_subfield_list = [(str(field_to_search), str(subfield_to_search))]
-            field_subfield_to_search_not_acceptable = False
         else:
-            field_to_search = ''
-            subfield_to_search = ''
-            field_subfield_list = [(str(field_to_search), str(subfield_to_search))]
+            field_subfield_list = parse_field_subfield(field_subfield_string)
             field_subfield_to_search_not_acceptable = False
-            print('WARNING: Searching All Fields and All Subfields of All Records. This may take a long time.')
+            if field_subfield_list is None:
+                field_subfield_list = [('', '')]
+                print('WARNING: Searching All Fields and All Subfields of All Records. This may take a long time.')
     return field_subfield_list
 
 
@@ -188,10 +309,15 @@ def user_entry_search_term_or_terms():
     search_term_not_acceptable = True
     while search_term_not_acceptable:
         print('Enter Search Term. Example: ')
+        print('Enter \":f\" to load a list of search terms from a file.')
         print('Enter \":q\" to quit.')
         search_term_string = input('Enter Search Term: ')
         if search_term_string.lower() == ':q':
             sys.exit()
+        elif search_term_string.lower() == ':f':
+            search_term_list = user_entry_search_term_file()
+            if search_term_list:
+                search_term_not_acceptable = False
         elif 0 < len(search_term_string) < 256:
             search_term_list.append(search_term_string)
             search_term_not_acceptable = False
@@ -200,11 +326,53 @@ def user_entry_search_term_or_terms():
     return search_term_list
 
 
+def read_search_term_file(search_term_file):
+    # One search term per line. Blank lines, repeated search terms and search terms of 256 characters or more are
+    # skipped.
+    search_term_list = []
+    search_terms_read = set()
+    with open(search_term_file, 'r', encoding='utf-8-sig') as fh:
+        for line in fh:
+            search_term_string = line.strip()
+            if 0 < len(search_term_string) < 256 and search_term_string not in search_terms_read:
+                search_terms_read.add(search_term_string)
+                search_term_list.append(search_term_string)
+    return search_term_list
+
+
+def user_entry_search_term_file():
+    # Get name of a text file of search terms, one per line. Returns an empty list to go back to the search term.
+    search_term_list = []
+    search_term_file_not_acceptable = True
+    while search_term_file_not_acceptable:
+        print('Text file with one search term per line. **RegEx Search uses the first search term.**')
+        print('Enter \":b\" to go back.')
+        print('Enter \":q\" to quit.')
+        search_term_file = input('Search term(s) file path: ')
+        if search_term_file.lower() == ':q':
+            sys.exit()
+        elif search_term_file.lower() == ':b':
+            search_term_file_not_acceptable = False
+        else:
+            try:
+                search_term_list = read_search_term_file(search_term_file)
+                if search_term_list:
+                    print(str(len(search_term_list)) + ' search term(s) loaded.')
+                    search_term_file_not_acceptable = False
+                else:
+                    print('ERROR: No search terms in file.')
+            except (OSError, UnicodeDecodeError):
+                print('ERROR: Invalid Filename. Does the file exist? Is it a UTF-8 text file?')
+    return search_term_list
+
+
 def user_entry_settings():
     whole_word_search_boolean = False
     whole_word_search_setting_not_acceptable = True
     while whole_word_search_setting_not_acceptable:
         print('Do you want to search by Whole Word? **Not Used in RegEx Search.**')
+        print('Search terms with spaces match as a phrase of whole words, e.g. \"new york\" matches \"new york city\" '
+              'but not \"new yorker\".')
         print('Enter \":q\" to quit.')
         whole_word_search_string = input('Search by Whole Word (Y/N): ')
         if whole_word_search_string.lower() == ':q':
@@ -223,440 +391,4217 @@ def user_entry_settings():
     return whole_word_search_boolean
 
 
-def search_loaded_records(records_to_search, field_subfield_to_search, search_term_or_terms, search_by_whole_word):
-    records_to_save = []
-    search_field = ''
-    search_subfield = ''
-    for pair in field_subfield_to_search:
-        search_field = pair[0]
-        search_subfield = pair[1]
-    for record in records_to_search:
-        record_saved = False
-        if search_field.lower() == 'ldr':
-            try:
-                leader_data = str(record.leader)
-            except OSError:
-                leader_data = ''
-            for search_term in search_term_or_terms:
-                if (str(search_term) in leader_data) and (record_saved is False):
-                    records_to_save.append(record)
-                    # Don't need to note the record is saved as we are moving on to the next record already.
-                    # record_saved = True
-        else:
-            for field in record:
-                # All fields have tag, except leader. The leader isn't listed in record.fields.
-                if hasattr(field, 'tag') and (record_saved is False):
-                    if ((str(field.tag) == str(search_field)) or (search_field == '')) \
-                            and ((int(field.tag) < 10) and (search_subfield == '')):
-                        # print(search_field)
-                        # Handle field search for 001-009 fields.
-                        try:
-                            field_data = str(field.data.decode('utf-8'))
-                        except UnicodeDecodeError:
-                            field_data = str(pymarc.marc8_to_unicode(field.data))
-                        for search_term in search_term_or_terms:
-                            if str(search_term) in field_data and record_saved is False:
-                                records_to_save.append(record)
-                                record_saved = True
-                    elif ((str(field.tag) == str(search_field)) or (search_field == '')) \
-                            and (int(field.tag) < 10) and (search_subfield != ''):
-                        # Skip 001-009, if a subfield is specified. Don't want this caught in the next elif.
-                        # print('ERROR: field 001 to 010 shouldn\'t have a subfield specified.')
-                        pass
-                    elif str(field.tag) == str(search_field):
-                        # print(search_field, field.tag)
-                        # Handle field search for 010 to 999 where the field matches the given search field.
-                        for subfield in field:
-                            if (((str(search_subfield) in str(subfield[0])) or (search_subfield == ''))
-                                    and (record_saved is False)):
-                                try:
-                                    subfield_data = str(subfield[1].decode('utf-8'))
-                                except UnicodeDecodeError:
-                                    subfield_data = str(pymarc.marc8_to_unicode(subfield[1]))
-                                for search_term in search_term_or_terms:
-                                    if search_by_whole_word is True:
-                                        for word in subfield_data.split():
-                                            if search_term.isalpha():
-                                                bad_characters = '?!\"\':|,.0123456789()\\`~<>/=+-_*&^%$#@'
-                                            elif search_term.isalnum():
-                                                bad_characters = '?!\"\':|,.()\\`~<>/=+-_*&^%$#@'
-                                            else:
-                                                bad_characters = ''
-                                            search_word = ''
-                                            if word.isalnum():
-                                                search_word = word
-                                            else:
-                                                for char in word:
-                                                    if char in bad_characters:
-                                                        char = ' '
-                                                    search_word = search_word + char
-                                            for word2 in search_word.split(' '):
-                                                if (str(search_term) == word2) and (record_saved is False):
-                                                    # print(search_word, field.tag, subfield[0])
-                                                    print(subfield_data)
-                                                    records_to_save.append(record)
-                                                    record_saved = True
-                                                else:
-                                                    break
-                                    else:
-                                        if (str(search_term) in subfield_data) and (record_saved is False):
-                                            print(subfield_data)
-                                            records_to_save.append(record)
-                                            record_saved = True
-                            else:
-                                # Don't save the record.
-                                pass
-                    elif search_field == '':
-                        # Handle field search for 010 to 999 where the field isn't specified.
-                        for subfield in field:
-                            if (((str(search_subfield) in str(subfield[0])) or (search_subfield == ''))
-                                    and (record_saved is False)):
-                                try:
-                                    subfield_data = str(subfield[1].decode('utf-8'))
-                                except UnicodeDecodeError:
-                                    subfield_data = str(pymarc.marc8_to_unicode(subfield[1]))
-                                for search_term in search_term_or_terms:
-                                    if (search_by_whole_word is True) and (record_saved is False):
-                                        for word in subfield_data.split():
-                                            if record_saved is True:
-                                                break
-                                            elif search_term.isalpha():
-                                                bad_characters = '?!\"\':|,.0123456789()\\`~<>/=+-_*&^%$#@'
-                                            elif search_term.isalnum():
-                                                bad_characters = '?!\"\':|,.()\\`~<>/=+-_*&^%$#@'
-                                            else:
-                                                bad_characters = ''
-                                            search_word = ''
-                                            if word.isalnum():
-                                                search_word = word
-                                            else:
-                                                for char in word:
-                                                    if char in bad_characters:
-                                                        char = ' '
-                                                    search_word = search_word + char
-                                            for word2 in search_word.split(' '):
-                                                if (str(search_term) == word2) and (record_saved is False):
-                                                    # print(search_word, field.tag, subfield[0])
-                                                    print(subfield_data)
-                                                    records_to_save.append(record)
-                                                    record_saved = True
-                                                else:
-                                                    break
-                                    elif record_saved is True:
-                                        # Catch search that is whole word and the record has already been saved.
-                                        break
-                                    else:
-                                        # Don't search by whole word.
-                                        if (str(search_term) in subfield_data) and (record_saved is False):
-                                            print(subfield_data)
-                                            records_to_save.append(record)
-                                            record_saved = True
-                            else:
-                                # Don't save the record.
-                                pass
-    return records_to_save
-
-
-def reg_ex_search_loaded_records(records_to_search, field_subfield_to_search, search_term_or_terms):
-    records_to_save = []
-    search_field = ''
-    search_subfield = ''
-    # Convert list to string for regex search.
-    search_term_or_terms = rf'{search_term_or_terms[0]}'
-    for pair in field_subfield_to_search:
-        search_field = pair[0]
-        search_subfield = pair[1]
-    for record in records_to_search:
-        record_saved = False
-        if search_field.lower() == 'ldr':
-            try:
-                leader_data = str(record.leader)
-            except OSError:
-                leader_data = ''
-            match = re.search(rf'{search_term_or_terms}', leader_data)
-            if match and (record_saved is False):
-                records_to_save.append(record)
-                print(leader_data)
-                # Don't need to note the record is saved as we are moving on to the next record already.
-                # record_saved = True
-        else:
-            for field in record:
-                # All fields have tag, except leader. The leader isn't listed in record.fields.
-                if hasattr(field, 'tag') and (record_saved is False):
-                    if ((str(field.tag) == str(search_field)) or (search_field == '')) \
-                            and ((int(field.tag) < 10) and (search_subfield == '')):
-                        # print(search_field)
-                        # Handle field search for 001-009 fields.
-                        try:
-                            field_data = str(field.data.decode('utf-8'))
-                        except UnicodeDecodeError:
-                            field_data = str(pymarc.marc8_to_unicode(field.data))
-                        match = re.search(rf'{search_term_or_terms}', field_data)
-                        if match and record_saved is False:
-                            records_to_save.append(record)
-                            print(field_data)
-                            record_saved = True
-                    elif ((str(field.tag) == str(search_field)) or (search_field == '')) \
-                            and (int(field.tag) < 10) and (search_subfield != ''):
-                        # Skip 001-009, if a subfield is specified. Don't want this caught in the next elif.
-                        # print('ERROR: field 001 to 010 shouldn\'t have a subfield specified.')
-                        pass
-                    elif str(field.tag) == str(search_field):
-                        # print(search_field, field.tag)
-                        # Handle field search for 010 to 999 where the field matches the given search field.
-                        for subfield in field:
-                            if (((str(search_subfield) in str(subfield[0])) or (search_subfield == ''))
-                                    and (record_saved is False)):
-                                try:
-                                    subfield_data = str(subfield[1].decode('utf-8'))
-                                except UnicodeDecodeError:
-                                    subfield_data = str(pymarc.marc8_to_unicode(subfield[1]))
-                                if search_subfield != '':
-                                    match = re.search(f'{search_term_or_terms}', subfield_data)
-                                    # print(match, search_term_or_terms)
-                                else:
-                                    match = re.search(f'{search_term_or_terms}', str(field))
-                                if match and (record_saved is False):
-                                    if search_subfield != '':
-                                        print(field, subfield_data)
-                                    else:
-                                        print(field, match.group())
-                                    records_to_save.append(record)
-                                    record_saved = True
-                            else:
-                                # Don't save the record.
-                                pass
-                    elif search_field == '':
-                        # Handle field search for 010 to 999 where the field isn't specified.
-                        for subfield in field:
-                            if (((str(search_subfield) in str(subfield[0])) or (search_subfield == ''))
-                                    and (record_saved is False)):
-                                try:
-                                    subfield_data = str(subfield[1].decode('utf-8'))
-                                except UnicodeDecodeError:
-                                    subfield_data = str(pymarc.marc8_to_unicode(subfield[1]))
-                                match = re.search(rf'{search_term_or_terms}', subfield_data)
-                                if match and (record_saved is False):
-                                    print(subfield_data)
-                                    records_to_save.append(record)
-                                    record_saved = True
-                            else:
-                                # Don't save the record.
-                                pass
-    return records_to_save
+def user_entry_search_processes():
+    search_processes = 1
+    search_processes_setting_not_acceptable = True
+    while search_processes_setting_not_acceptable:
+        print('How many processes should Stream Search use? Enter 1 to search without extra processes.')
+        print('This computer has ' + str(os.cpu_count()) + ' processor cores.')
+        print('Enter \":q\" to quit.')
+        search_processes_string = input('Number of Search Processes: ')
+        if search_processes_string.lower() == ':q':
+            sys.exit()
+        elif search_processes_string.isnumeric() and 0 < int(search_processes_string) <= 256:
+            search_processes = int(search_processes_string)
+            search_processes_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter a number from 1 to 256.')
+    return search_processes
 
 
-def list_used_fields_and_subfields(records_to_search):
-    list_of_fields_and_subfields_used = []
-    for record in records_to_search:
-        for field in record:
-            # All fields have tag, except leader. The leader isn't listed in record.fields.
-            if hasattr(field, 'tag'):
-                field_tag = str(field.tag)
-                subfields = []
-                for subfield in field:
-                    if str(subfield[0]):
-                        subfields.append(subfield[0])
-                if subfields:
-                    for subfield in subfields:
-                        field_subfield = field_tag + subfield
-                        if field_subfield in list_of_fields_and_subfields_used:
-                            pass
-                        else:
-                            list_of_fields_and_subfields_used.append(field_subfield)
-                else:
-                    field = field_tag
-                    if field in list_of_fields_and_subfields_used:
-                        pass
-                    else:
-                        list_of_fields_and_subfields_used.append(field)
-    return list_of_fields_and_subfields_used
+def user_entry_load_mode():
+    record_load_mode = 'records'
+    load_mode_setting_not_acceptable = True
+    while load_mode_setting_not_acceptable:
+        print('How should MARC files be loaded?')
+        print('[1]:Parse All Records (pymarc)\n'
+              '[2]:Memory-Map File with Record Index (Fast reload, records parsed when used)\n'
+              '[3]:Memory-Map File with Record and Control Number (001) Index\n'
+              '[4]:Compact (Records kept as MARC bytes in memory, Record, Field and Control Number Index)')
+        print('Enter \":q\" to quit.')
+        load_mode_string = input('Load Mode: ')
+        if load_mode_string.lower() == ':q':
+            sys.exit()
+        elif load_mode_string == '1':
+            record_load_mode = 'records'
+            load_mode_setting_not_acceptable = False
+        elif load_mode_string == '2':
+            record_load_mode = 'index'
+            load_mode_setting_not_acceptable = False
+        elif load_mode_string == '3':
+            record_load_mode = 'index_001'
+            load_mode_setting_not_acceptable = False
+        elif load_mode_string == '4':
+            record_load_mode = 'compact'
+            load_mode_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter 1, 2, 3, or 4.')
+    return record_load_mode
 
 
-def save_matches_to_file(records_matched):
-    # Get name of MARC record file to save.
-    marc_file_to_save = ''
+def user_entry_use_term_index():
+    use_term_index_boolean = False
+    use_term_index_setting_not_acceptable = True
+    while use_term_index_setting_not_acceptable:
+        print('Use a term index for Whole Word searches of subfields? **Not Used in RegEx Search.**')
+        print('The index is built on the first search and saved next to the MARC file for the next time.')
+        print('Enter \":q\" to quit.')
+        use_term_index_string = input('Use Term Index (Y/N): ')
+        if use_term_index_string.lower() == ':q':
+            sys.exit()
+        elif use_term_index_string.lower() in ('y', 'yes'):
+            use_term_index_boolean = True
+            use_term_index_setting_not_acceptable = False
+        elif use_term_index_string.lower() in ('n', 'no'):
+            use_term_index_boolean = False
+            use_term_index_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter Yes or No.')
+    return use_term_index_boolean
+
+
+def user_entry_normalized_search():
+    normalized_search_boolean = False
+    normalized_search_setting_not_acceptable = True
+    while normalized_search_setting_not_acceptable:
+        print('Ignore case, accents and punctuation when searching loaded records? **Not Used in RegEx Search.**')
+        print('e.g. \"les miserables\" matches \"Les Misérables :\". The normalized text of each record is worked '
+              'out on the first normalized search and kept until another file is loaded.')
+        print('Enter \":q\" to quit.')
+        normalized_search_string = input('Normalized Search (Y/N): ')
+        if normalized_search_string.lower() == ':q':
+            sys.exit()
+        elif normalized_search_string.lower() in ('y', 'yes'):
+            normalized_search_boolean = True
+            normalized_search_setting_not_acceptable = False
+        elif normalized_search_string.lower() in ('n', 'no'):
+            normalized_search_boolean = False
+            normalized_search_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter Yes or No.')
+    return normalized_search_boolean
+
+
+def user_entry_use_session_cache():
+    use_session_cache_boolean = False
+    use_session_cache_setting_not_acceptable = True
+    while use_session_cache_setting_not_acceptable:
+        print('Save the session next to the MARC file, and resume it the next time the file is loaded? '
+              '**Records Load Mode Only.**')
+        print('The loaded records and result sets are saved when you quit with [0] or load another file.')
+        print('Enter \":q\" to quit.')
+        use_session_cache_string = input('Use Session Cache (Y/N): ')
+        if use_session_cache_string.lower() == ':q':
+            sys.exit()
+        elif use_session_cache_string.lower() in ('y', 'yes'):
+            use_session_cache_boolean = True
+            use_session_cache_setting_not_acceptable = False
+        elif use_session_cache_string.lower() in ('n', 'no'):
+            use_session_cache_boolean = False
+            use_session_cache_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter Yes or No.')
+    return use_session_cache_boolean
+
+
+def save_session_cache(records_loaded, field_inventory, result_sets):
+    # Save the session of the loaded records, and print to screen where it was saved.
+    session_cache = SessionCache(records_loaded, field_inventory, result_sets)
+    if session_cache.save():
+        print('Session saved to ' + session_cache_file_name(records_loaded.marc_file))
+
+
+def user_entry_match_echo():
+    match_echo_limit = None
+    match_echo_setting_not_acceptable = True
+    while match_echo_setting_not_acceptable:
+        print('How many matches should searches show on screen?')
+        print('Enter \"all\" to show every match, a number to show the first matches and a count of the rest, '
+              'or 0 to only show counts.')
+        print('Enter \":q\" to quit.')
+        match_echo_string = input('Matches to Show: ')
+        if match_echo_string.lower() == ':q':
+            sys.exit()
+        elif match_echo_string.lower() == 'all':
+            match_echo_limit = None
+            match_echo_setting_not_acceptable = False
+        elif match_echo_string.isnumeric():
+            match_echo_limit = int(match_echo_string)
+            match_echo_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter all or a number.')
+    return match_echo_limit
+
+
+def user_entry_match_report():
+    match_report_format = None
+    match_report_setting_not_acceptable = True
+    while match_report_setting_not_acceptable:
+        print('Write a report file listing every match of a search?')
+        print('[1]:No Report File\n'
+              '[2]:CSV Report File\n'
+              '[3]:JSONL Report File (One JSON object per line)')
+        print('Enter \":q\" to quit.')
+        match_report_string = input('Match Report: ')
+        if match_report_string.lower() == ':q':
+            sys.exit()
+        elif match_report_string == '1':
+            match_report_format = None
+            match_report_setting_not_acceptable = False
+        elif match_report_string == '2':
+            match_report_format = 'csv'
+            match_report_setting_not_acceptable = False
+        elif match_report_string == '3':
+            match_report_format = 'jsonl'
+            match_report_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter 1, 2, or 3.')
+    return match_report_format
+
+
+def user_entry_report_file_to_save(match_report_format):
+    # Get name of match report file to save. Returns None to skip the report.
+    report_file_extension = '.' + match_report_format
+    report_file_to_save = None
     file_name_not_acceptable = True
     while file_name_not_acceptable:
-        print('File extension must be \".mrc\" or \".raw\". Extension .mrc assumed, if not supplied.')
-        print('Enter \":q\" to quit or \":s\" to skip saving a file.')
-        marc_file_to_save = input('MARC record(s) file path: ')
-        if marc_file_to_save.lower() == ':q':
-            # Break out of loop, if :q entered. What about main running loop? (Bad form? Just call sys.exit() ?)
-            # running = False
-            # file_name_not_acceptable = False
+        print('Match report file. Extension ' + report_file_extension + ' assumed, if not supplied.')
+        print('Enter \":q\" to quit or \":s\" to skip the report.')
+        report_file_to_save = input('Match report file path: ')
+        if report_file_to_save.lower() == ':q':
             sys.exit()
-        elif marc_file_to_save == ':s':
+        elif report_file_to_save == ':s':
+            report_file_to_save = None
             file_name_not_acceptable = False
+        else:
+            if report_file_to_save[-len(report_file_extension):].lower() != report_file_extension:
+                report_file_to_save += report_file_extension
+            if glob.glob(report_file_to_save):
+                print('ERROR: File Already Exists. Enter a new file name.')
+            else:
+                file_name_not_acceptable = False
+    return report_file_to_save
+
+
+def user_entry_positive_number(prompt):
+    # Get a whole number of 1 or more.
+    number_not_acceptable = True
+    number_string = ''
+    while number_not_acceptable:
+        print('Enter \":q\" to quit.')
+        number_string = input(prompt)
+        if number_string.lower() == ':q':
+            sys.exit()
+        elif number_string.isdigit() and int(number_string) > 0:
+            number_not_acceptable = False
+        else:
+            print('ERROR: Please enter a number of 1 or more.')
+    return int(number_string)
+
+
+def user_entry_search_limits():
+    # Get the limits for searches. Returns None to search every record for every match.
+    search_limits = None
+    search_limits_setting_not_acceptable = True
+    while search_limits_setting_not_acceptable:
+        print('Limit searches? Limits make exploratory searches of large files quicker. '
+              'Saved matches are only the matches found.')
+        print('[1]:No Limits (Search Every Record)\n'
+              '[2]:Stop After a Number of Matches\n'
+              '[3]:Exists (Stop at the First Match)\n'
+              '[4]:Search a Random Sample of Records\n'
+              '[5]:Search an Evenly Spaced Sample of Records')
+        print('Enter \":q\" to quit.')
+        search_limits_string = input('Search Limits: ')
+        if search_limits_string.lower() == ':q':
+            sys.exit()
+        elif search_limits_string == '1':
+            search_limits = None
+            search_limits_setting_not_acceptable = False
+        elif search_limits_string == '2':
+            search_limits = SearchLimits(match_limit=user_entry_positive_number('Matches to stop after: '))
+            search_limits_setting_not_acceptable = False
+        elif search_limits_string == '3':
+            search_limits = SearchLimits(match_limit=1)
+            search_limits_setting_not_acceptable = False
+        elif search_limits_string == '4' or search_limits_string == '5':
+            search_limits = SearchLimits(sample_size=user_entry_positive_number('Records to sample: '),
+                                         sample_mode='random' if search_limits_string == '4' else 'stride')
+            search_limits_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter 1, 2, 3, 4, or 5.')
+    return search_limits
+
+
+def user_entry_result_set_expression(result_sets):
+    # Get a result set expression to combine result sets, or a result set to refine searches with.
+    # Returns ('combine', ResultSet), ('refine', ResultSet or None to search all records), or (None, None) to go back.
+    while True:
+        print('Combine result sets with AND, OR, NOT and parentheses, e.g. \"1 AND NOT 2\" or \"(1 OR 2) AND 3\".')
+        print('Enter \":r\" and a result set number to only search the records in that result set, e.g. \":r 3\". '
+              'Enter \":r\" alone to search all records again.')
+        print('Enter \":q\" to quit or \":s\" to go back.')
+        expression = input('Result sets: ')
+        if expression.lower() == ':q':
+            sys.exit()
+        elif expression.lower() == ':s':
+            return None, None
+        elif expression.lower().startswith(':r'):
+            result_set_number = expression[2:].strip()
+            if not result_set_number:
+                return 'refine', None
+            elif result_set_number.isdigit() and 1 <= int(result_set_number) <= len(result_sets):
+                return 'refine', result_sets[int(result_set_number) - 1]
+            print('ERROR: No result set #' + result_set_number + '.')
         else:
             try:
-                if marc_file_to_save[-4:] != '.mrc':
-                    marc_file_to_save += '.mrc'
-                    if glob.glob(marc_file_to_save):
-                        print('ERROR: File Already Exists. Enter a new file name.')
-                    else:
-                        file_name_not_acceptable = False
-                elif (marc_file_to_save[-4:].lower() == '.mrc') or (marc_file_to_save[-4:].lower() == '.raw'):
-                    if glob.glob(marc_file_to_save):
-                        print('ERROR: File Already Exists. Enter a new file name.')
-                    else:
-                        file_name_not_acceptable = False
-                else:
-                    pass
-            except OSError:
-                pass
-    # Save matching records in new MARC record file. Skip saving, if command :s was entered.
-    if marc_file_to_save == ':s':
-        pass
-    else:
-        save_start_time = datetime.datetime.now()
+                return 'combine', combine_result_sets(expression, result_sets)
+            except ValueError as error:
+                print('ERROR: ' + str(error))
+
+
+def user_entry_fixed_field_query():
+    # Get a fixed field query. Returns None, if skipped. See FixedFieldColumns.query().
+    while True:
+        print('Search the leader and 001-008 by character position, e.g. LDR/06 = \'a\' AND 008/35-37 = \'ger\'.')
+        print('Positions start at 0. Use = or != and a quoted value as long as the positions. '
+              'Combine with AND, OR, NOT and parentheses. Only the first 006 and 007 are searched.')
+        print('Enter \":q\" to quit or \":s\" to go back.')
+        fixed_field_query = input('Fixed Field Query: ')
+        if fixed_field_query.lower() == ':q':
+            sys.exit()
+        elif fixed_field_query.lower() == ':s':
+            return None
         try:
-            with open(str(marc_file_to_save), 'wb') as fh:
-                writer = pymarc.MARCWriter(fh)
-                for matching_record in records_matched:
-                    writer.write(matching_record)
-        except FileNotFoundError:
-            pass
-        save_end_time = datetime.datetime.now()
-        # Print to screen the time it took to save the record file.
-        save_time = str(format((save_end_time - save_start_time).total_seconds(), '.2f'))
-        print('Time to save record(s): ' + save_time + ' seconds')
+            # Checked against no records, so mistakes are found before the columns are built.
+            FixedFieldColumns(0).query(fixed_field_query)
+            return fixed_field_query
+        except ValueError as error:
+            print('ERROR: ' + str(error))
+
+
+def user_entry_match_key_tags():
+    # Get the match keys to find duplicate records by. Returns their tags, e.g. ['020', '245']. See record_match_keys().
+    while True:
+        print('Match keys: ' + ', '.join(DUPLICATE_MATCH_KEYS.values()))
+        print('Enter the tags of the match keys to use, e.g. \"020 035\". Leave blank to use all of them.')
+        print('Enter \":q\" to quit.')
+        match_key_string = input('Match keys: ')
+        if match_key_string.lower() == ':q':
+            sys.exit()
+        match_key_tags = match_key_string.replace(',', ' ').split()
+        if not match_key_tags:
+            return list(DUPLICATE_MATCH_KEYS)
+        elif all(match_key_tag in DUPLICATE_MATCH_KEYS for match_key_tag in match_key_tags):
+            return list(dict.fromkeys(match_key_tags))
+        print('ERROR: Match keys must be ' + ', '.join(DUPLICATE_MATCH_KEYS) + '.')
 
 
-records_loaded = []
-field_subfields_to_search = []
-list_of_search_terms = []
-matches_list = []
-all_fields_and_subfields_used = []
-menu_selection = ''
-whole_word_search = False
-running = True
-# [1]:Load MARC File [2]:Enter Search Field(s) [3]:Enter Search Term(s) [4]:Run Search
-# [5]:Save Matched Records to File [9]:Count Records [0]:Quit
-while running:
-    menu_selection = main_menu()
-    if menu_selection == '1':
-        records_loaded = load_records()
-    elif menu_selection == '2':
-        field_subfields_to_search = user_entry_field_subfield()
-    elif menu_selection == '3':
-        list_of_search_terms = user_entry_search_term_or_terms()
-    elif menu_selection == '4':
-        print('----------------')
-        search_start_time = datetime.datetime.now()
-        matches_list = search_loaded_records(records_loaded, field_subfields_to_search, list_of_search_terms,
-                                             whole_word_search)
-        search_end_time = datetime.datetime.now()
-        # Print to screen number of records matched.
-        count_of_records_matched = len(matches_list)
-        print('----------------')
-        print(str(count_of_records_matched) + ' records matched.')
-        # Print to screen the time it took to search the records.
-        search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
-        print('Time to search record(s): ' + search_time + ' seconds')
-        input('Press Enter to Continue')
-    elif menu_selection == '5':
-        print('----------------')
-        search_start_time = datetime.datetime.now()
-        matches_list = reg_ex_search_loaded_records(records_loaded, field_subfields_to_search, list_of_search_terms)
-        search_end_time = datetime.datetime.now()
-        # Print to screen number of records matched.
-        count_of_records_matched = len(matches_list)
-        print('----------------')
-        print(str(count_of_records_matched) + ' records matched.')
-        # Print to screen the time it took to search the records.
-        search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
-        print('Time to search record(s): ' + search_time + ' seconds')
-        input('Press Enter to Continue')
-    elif menu_selection == '6':
-        count_of_records = len(records_loaded)
-        print('Number of Records Loaded: ', count_of_records)
-        if matches_list:
-            count_of_matched_records = len(matches_list)
-            print('Number of Records Matching Search: ', count_of_matched_records)
-        input('Press Enter to Continue')
-    elif menu_selection == '7':
-        print('----------------')
-        search_start_time = datetime.datetime.now()
-        all_fields_and_subfields_used = list_used_fields_and_subfields(records_loaded)
-        search_end_time = datetime.datetime.now()
-        print('----------------')
-        fields_used = {}
-        for item in all_fields_and_subfields_used:
-            if len(item) == 3:
-                fields_used[f'{item}'] = ''
+def user_entry_marc_inputs_to_check():
+    # Get the MARC record files to find duplicates across. Each one may be a directory or a pattern as well.
+    marc_inputs = []
+    while True:
+        marc_input = user_entry_marc_file_to_load()
+        if marc_query_server_url(marc_input):
+            print('ERROR: Duplicates are found in MARC files, not on a MARC Crucible server.')
+            continue
+        marc_inputs.append(marc_input)
+        print(str(len(marc_inputs)) + ' MARC file(s) to check.')
+        add_marc_input_not_acceptable = True
+        while add_marc_input_not_acceptable:
+            print('Enter \":q\" to quit.')
+            add_marc_input_string = input('Add another MARC file (Y/N): ')
+            if add_marc_input_string.lower() == ':q':
+                sys.exit()
+            elif add_marc_input_string.lower() in ('y', 'yes'):
+                add_marc_input_not_acceptable = False
+            elif add_marc_input_string.lower() in ('n', 'no'):
+                return marc_inputs
             else:
-                if item[:3] in fields_used.keys():
-                    temp_item = fields_used[f'{item[:3]}']
-                    temp_item += item[3:]
-                    temp_sorted = ''.join(sorted(temp_item, key=str.lower))
-                    fields_used[f'{item[:3]}'] = temp_sorted
-                else:
-                    fields_used[f'{item[:3]}'] = f'{item[3:]}'
-        sorted_fields = {}
-        for item in sorted(fields_used):
-            sorted_fields[item] = fields_used[item]
-
-        print('\"Field\",\"Subfields\"')
-        print('\"LDR\",\"\"')
-        for key, value in sorted_fields.items():
-            print('\"' + key + '\",' + '\"' + value + '\"')
-
-        # Print to screen the time it took to search the records.
-        search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
-        print('Time to search record(s): ' + search_time + ' seconds')
-        input('Press Enter to Continue')
-    elif menu_selection == '8':
-        if matches_list:
-            save_matches_to_file(matches_list)
-        else:
-            print('Search returned no matches or You\'ve not run a search, yet.')
-            print('**Steps needed to save matching records.**')
-            print('Load MARC File')
-            print('Enter Search Field(s)')
-            print('Enter Search Term(s)')
-            print('Run Search OR Run RegEx Search')
-            input('Press Enter to Continue')
-    elif menu_selection == '9':
+                print('ERROR: Please enter Yes or No.')
+
+
+def user_entry_duplicates_file_prefix(match_key_tags):
+    # Get the start of the names of the duplicate files, e.g. dups for dups_clusters.csv, dups_020.mrc and so on.
+    while True:
+        print('The clusters are saved to <name>_clusters.csv, and the duplicate records to <name>_<tag>.mrc, '
+              'e.g. dups_clusters.csv and dups_020.mrc for \"dups\".')
+        print('Enter \":q\" to quit.')
+        duplicates_file_prefix = input('Duplicate files name: ')
+        if duplicates_file_prefix.lower() == ':q':
+            sys.exit()
+        elif not duplicates_file_prefix:
+            print('ERROR: Please enter a name.')
+        elif any(glob.glob(duplicates_file) for duplicates_file in
+                 duplicates_file_names(duplicates_file_prefix, match_key_tags).values()):
+            print('ERROR: File Already Exists. Enter a new name.')
+        else:
+            return duplicates_file_prefix
+
+
+def user_entry_metrics_file():
+    # Get name of the metrics file. Returns None to turn metrics off.
+    metrics_file = None
+    file_name_not_acceptable = True
+    while file_name_not_acceptable:
+        print('Metrics of every load, search and save are added to the end of the metrics file, one JSON object per '
+              'line. Extension .jsonl assumed, if not supplied.')
+        print('Enter \":q\" to quit or \":s\" to turn metrics off.')
+        metrics_file = input('Metrics file path: ')
+        if metrics_file.lower() == ':q':
+            sys.exit()
+        elif metrics_file == ':s':
+            metrics_file = None
+            file_name_not_acceptable = False
+        elif metrics_file:
+            if metrics_file[-6:].lower() != '.jsonl':
+                metrics_file += '.jsonl'
+            file_name_not_acceptable = False
+    return metrics_file
+
+
+def user_entry_profile_mode():
+    profile_mode = None
+    profile_setting_not_acceptable = True
+    while profile_setting_not_acceptable:
+        print('Profile loads, searches and saves? Profiling slows them down.')
+        print('[1]:No Profiling\n'
+              '[2]:cProfile (Time spent in each function)\n'
+              '[3]:tracemalloc (Memory allocated by each line)')
+        print('Enter \":q\" to quit.')
+        profile_string = input('Profiling: ')
+        if profile_string.lower() == ':q':
+            sys.exit()
+        elif profile_string == '1':
+            profile_mode = None
+            profile_setting_not_acceptable = False
+        elif profile_string == '2':
+            profile_mode = 'cprofile'
+            profile_setting_not_acceptable = False
+        elif profile_string == '3':
+            profile_mode = 'tracemalloc'
+            profile_setting_not_acceptable = False
+        else:
+            print('ERROR: Please enter 1, 2, or 3.')
+    return profile_mode
+
+
+def open_match_report(match_echo_limit, match_report_format):
+    # MatchReport for the next search, from the match echo and match report settings.
+    # Asks for the report file, if a report format is set.
+    while True:
+        report_file_to_save = None
+        if match_report_format is not None:
+            report_file_to_save = user_entry_report_file_to_save(match_report_format)
         try:
-            print('Menu: Enter the number of a menu item to continue.')
-            print('[1]:About (Display MIT License)\n'
-                  '[2]:Change Whole Word Search Setting\n')
-            setting_selector = input('Enter Selection: ')
-            invalid_setting_entry = True
-            if len(setting_selector) == 1:
-                if setting_selector in '1234567890':
-                    invalid_setting_entry = False
-                else:
-                    clear_screen()
-                    error_message = 'ERROR: Invalid Entry. Enter matching number of menu entry.'
-            if invalid_setting_entry:
+            return MatchReport(match_echo_limit, report_file_to_save, match_report_format)
+        except OSError:
+            print('ERROR: Unable to write the report file.')
+
+
+# Characters the whole word search treats as breaks between words, besides whitespace.
+# Digits are breaks too, when the search term is alphabetic.
+WHOLE_WORD_BREAK_CHARACTERS = '?!\"\':|,.()\\`~<>/=+-_*&^%$#@'
+WHOLE_WORD_ALPHANUMERIC_TABLE = str.maketrans(WHOLE_WORD_BREAK_CHARACTERS, ' ' * len(WHOLE_WORD_BREAK_CHARACTERS))
+WHOLE_WORD_ALPHABETIC_TABLE = str.maketrans(WHOLE_WORD_BREAK_CHARACTERS + '0123456789',
+                                            ' ' * (len(WHOLE_WORD_BREAK_CHARACTERS) + 10))
+
+
+def whole_word_break_characters(search_term):
+    # Alphabetic search terms break words at punctuation and digits, alphanumeric search terms at punctuation.
+    # Other search terms, e.g. with punctuation in them, only break words at whitespace.
+    # Search terms with whitespace in them go by their words, e.g. "new york" is alphabetic.
+    search_term = ''.join(search_term.split())
+    if search_term.isalpha():
+        return WHOLE_WORD_BREAK_CHARACTERS + '0123456789'
+    elif search_term.isalnum():
+        return WHOLE_WORD_BREAK_CHARACTERS
+    else:
+        return ''
+
+
+def search_terms_pattern_source(search_terms):
+    # RegEx source matching any of the search terms. The search terms are merged into a trie first, e.g. "cat", "car"
+    # and "dog" become "(?:ca[rt]|dog)", so the RegEx engine follows one branch per character instead of trying every
+    # search term at every position. Matching time hardly grows with the number of search terms.
+    trie = {}
+    for search_term in search_terms:
+        node = trie
+        for character in search_term:
+            node = node.setdefault(character, {})
+        node[''] = None
+
+    def node_pattern_source(node):
+        # Characters that only end search terms are merged into one character class.
+        branches = []
+        last_characters = []
+        for character in sorted(node):
+            if character == '':
                 pass
+            elif list(node[character]) == ['']:
+                last_characters.append(re.escape(character))
             else:
-                if int(setting_selector) == 1:
-                    print("MARC Crucible is released under \"The MIT License (MIT)\"\n"
-                          "Copyright © 2023 Joseph Alway"
-                          "\n\n"
-                          "Permission is hereby granted, free of charge, to any person obtaining a copy of this software and\n"
-                          "associated documentation files (the \"Software\"), to deal in the Software without restriction,\n"
-                          "including without limitation the rights to use, copy, modify, merge, publish, distribute,\n"
-                          "sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished\n"
-                          "to do so, subject to the following conditions:\n"
-                          "The above copyright notice and this permission notice shall be included in all copies or\n"
-                          "substantial portions of the Software."
-                          "\n\n"
-                          "THE SOFTWARE IS PROVIDED \"AS IS\", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO\n"
-                          "THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS\n"
-                          "OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR\n"
-                          "OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.")
-                    input('Press Enter to Continue')
-                    clear_screen()
-                else:
-                    whole_word_search = user_entry_settings()
-        except KeyError:
-            pass
-    elif menu_selection == '0':
-        running = False
-        sys.exit()
+                branches.append(re.escape(character) + node_pattern_source(node[character]))
+        if len(last_characters) == 1:
+            branches.append(last_characters[0])
+        elif last_characters:
+            branches.append('[' + ''.join(last_characters) + ']')
+        if not branches:
+            return ''
+        elif len(branches) == 1:
+            pattern_source = branches[0]
+        else:
+            pattern_source = '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # A search term ends here, so the rest is optional.
+            if len(branches) == 1 and last_characters:
+                pattern_source += '?'
+            else:
+                pattern_source = '(?:' + pattern_source + ')?'
+        return pattern_source
+
+    return node_pattern_source(trie)
+
+
+def compile_search_terms_pattern(search_terms):
+    # Compiled RegEx matching any of the search terms, for searches with more than one search term.
+    # Bytes search terms are mapped one byte to one character and back.
+    if len(search_terms) < 2:
+        return None
+    elif isinstance(search_terms[0], bytes):
+        return re.compile(search_terms_pattern_source(
+            [search_term.decode('latin-1') for search_term in search_terms]).encode('latin-1'))
     else:
-        pass
+        return re.compile(search_terms_pattern_source(search_terms))
+
+
+def compile_whole_word_patterns(search_term_or_terms):
+    # Compile whole word searches into RegEx patterns. A search term matches where it isn't joined to other
+    # characters, i.e. it starts and ends at the start or end of the text, whitespace, or a break character.
+    # Search terms with whitespace in them match as a phrase of whole words, e.g. "new york" matches "new york city"
+    # but not "new yorker".
+    # Search terms with the same break characters share one pattern.
+    search_terms_by_break_characters = {}
+    for search_term in search_term_or_terms:
+        search_terms_by_break_characters.setdefault(whole_word_break_characters(str(search_term)), []).append(
+            str(search_term))
+    whole_word_patterns = []
+    for break_characters, search_terms in search_terms_by_break_characters.items():
+        word_character = r'[^\s' + re.escape(break_characters) + ']'
+        whole_word_patterns.append(re.compile('(?<!' + word_character + ')(?:' +
+                                              search_terms_pattern_source(search_terms) +
+                                              ')(?!' + word_character + ')'))
+    return whole_word_patterns
+
+
+def compile_whole_word_sets(search_term_or_terms):
+    # Whole word search terms without whitespace in them match a word of the text, once the text is split at
+    # whitespace and the search term's break characters. Lists (table to translate break characters to spaces or None,
+    # set of search terms) for looking words up in sets. Search terms with whitespace are left to
+    # compile_whole_word_patterns().
+    whole_word_tables = {WHOLE_WORD_BREAK_CHARACTERS + '0123456789': WHOLE_WORD_ALPHABETIC_TABLE,
+                         WHOLE_WORD_BREAK_CHARACTERS: WHOLE_WORD_ALPHANUMERIC_TABLE,
+                         '': None}
+    search_terms_by_break_characters = {}
+    for search_term in search_term_or_terms:
+        search_terms_by_break_characters.setdefault(whole_word_break_characters(str(search_term)), set()).add(
+            str(search_term))
+    return [(whole_word_tables[break_characters], frozenset(search_terms))
+            for break_characters, search_terms in search_terms_by_break_characters.items()]
+
+
+class SearchQuery:
+    # A search worked out once from the search field/subfield, search term(s) and whole word setting: the tags to
+    # search, a test for subfield codes, the compiled RegEx, and the raw bytes to pre-filter raw records with.
+    # Every search tests records with record_matches(), so only the matching itself is done for each record.
+    # A normalized search matches normalized search terms against normalized text, so it ignores case, accents and
+    # punctuation. See normalized_match_text().
+    def __init__(self, field_subfield_to_search, search_term_or_terms, search_by_whole_word=False,
+                 reg_ex_search=False, normalized_search=False):
+        search_field = ''
+        search_subfield = ''
+        for pair in field_subfield_to_search:
+            search_field = pair[0]
+            search_subfield = pair[1]
+        self.search_field = str(search_field)
+        self.search_subfield = str(search_subfield)
+        self.search_leader = self.search_field.lower() == 'ldr'
+        # Tags of the fields to search. None searches all fields.
+        self.search_tags = None if self.search_field == '' else frozenset([self.search_field])
+        # 001-009 fields have no subfields. They are skipped, if a subfield is specified.
+        self.search_control_fields = self.search_subfield == ''
+        self.search_by_whole_word = search_by_whole_word is True
+        self.reg_ex_search = reg_ex_search
+        self.normalized_search = normalized_search is True and not reg_ex_search
+        self.search_terms = [str(search_term) for search_term in search_term_or_terms]
+        if reg_ex_search:
+            # RegEx search uses the first search term as the pattern.
+            self.reg_ex = re.compile(rf'{self.search_terms[0]}')
+            self.search_terms_as_bytes = None
+        elif self.normalized_search:
+            # Search terms that are all punctuation would match everything, so they are dropped. Raw records can't be
+            # pre-filtered by normalized search terms.
+            self.reg_ex = None
+            self.search_terms = [normalized_search_term for normalized_search_term in
+                                 (normalized_match_text(search_term) for search_term in self.search_terms)
+                                 if normalized_search_term]
+            self.search_terms_as_bytes = None
+        else:
+            self.reg_ex = None
+            self.search_terms_as_bytes = [search_term.encode('utf-8') for search_term in self.search_terms]
+        # Searches with a list of search terms match them all at once, not one search term at a time.
+        self.search_terms_pattern = None if reg_ex_search else compile_search_terms_pattern(self.search_terms)
+        self.search_terms_as_bytes_pattern = None if self.search_terms_as_bytes is None else \
+            compile_search_terms_pattern(self.search_terms_as_bytes)
+        if self.search_by_whole_word:
+            # Whole word search terms without whitespace are looked up in sets of words. The rest use RegEx patterns.
+            self.whole_word_sets = compile_whole_word_sets(
+                [search_term for search_term in self.search_terms if search_term.split() == [search_term]])
+            self.whole_word_patterns = compile_whole_word_patterns(
+                [search_term for search_term in self.search_terms if search_term.split() != [search_term]])
+        else:
+            self.whole_word_sets = []
+            self.whole_word_patterns = []
+        # Whole word searches that only look at subfields can be answered from a TermIndex.
+        if self.reg_ex_search or not self.search_by_whole_word or self.search_leader or self.normalized_search:
+            self.term_index_can_answer = False
+        elif self.search_field == '':
+            self.term_index_can_answer = self.search_subfield != ''
+        else:
+            self.term_index_can_answer = not (self.search_field.isdigit() and int(self.search_field) < 10)
+        # Search counts. See search_counts().
+        self.records_tested = 0
+        self.fields_visited = 0
+        self.subfields_visited = 0
+        self.pattern_evaluations = 0
+        self.marc8_records = 0
+
+    def subfield_code_matches(self, subfield_code):
+        # True for every subfield, if no subfield is specified.
+        return self.search_subfield in str(subfield_code)
+
+    def text_matches(self, text):
+        if self.reg_ex is not None:
+            return self.reg_ex.search(text) is not None
+        if self.search_terms_pattern is not None:
+            return self.search_terms_pattern.search(text) is not None
+        for search_term in self.search_terms:
+            if search_term in text:
+                return True
+        return False
+
+    def whole_word_matches(self, subfield_data):
+        for whole_word_table, whole_word_set in self.whole_word_sets:
+            words = subfield_data.split() if whole_word_table is None else \
+                subfield_data.translate(whole_word_table).split()
+            if not whole_word_set.isdisjoint(words):
+                return True
+        for whole_word_pattern in self.whole_word_patterns:
+            if whole_word_pattern.search(subfield_data) is not None:
+                return True
+        return False
+
+    def record_match(self, record, decoded_fields=None):
+        # Test one record against the search. Returns None, if the record doesn't match. Otherwise, returns the first
+        # match as (tag, subfield code, matching text, text to show on screen). The text to show on screen is None for
+        # matches that aren't shown. See MatchReport.
+        # decoded_fields is the record's text from decode_record_fields(), if it was decoded already. For normalized
+        # searches, it's the normalized text from DecodedRecordCache.normalized_fields().
+        # The work done is added to the search counts. See search_counts().
+        self.records_tested += 1
+        if self.search_leader:
+            self.pattern_evaluations += 1
+            leader_data = str(record.leader)
+            if self.normalized_search:
+                leader_data = normalized_match_text(leader_data)
+            if self.text_matches(leader_data):
+                return 'LDR', '', leader_data, leader_data if self.reg_ex_search else None
+            return None
+        # Whether the record is MARC-8 is only worked out, if a field has to be decoded.
+        marc8 = None
+        record_match = None
+        # Counted in local variables, which is quicker than adding to the attributes for every field.
+        fields_visited = 0
+        subfields_visited = 0
+        pattern_evaluations = 0
+        for field_position, field in enumerate(record):
+            fields_visited += 1
+            if self.search_tags is not None and field.tag not in self.search_tags:
+                pass
+            elif field.is_control_field():
+                # Handle field search for 001-009 fields.
+                if self.search_control_fields:
+                    if decoded_fields is None:
+                        if marc8 is None:
+                            marc8 = record_is_marc8(record)
+                        field_data = decode_marc_data(field.data, marc8)
+                        if self.normalized_search:
+                            field_data = normalized_match_text(field_data)
+                    else:
+                        field_data = decoded_fields[field_position]
+                    pattern_evaluations += 1
+                    if self.text_matches(field_data):
+                        record_match = str(field.tag), '', field_data, field_data if self.reg_ex_search else None
+                        break
+            elif self.reg_ex_search and self.search_tags is not None and self.search_subfield == '':
+                # RegEx search of a given field without a subfield searches the whole field.
+                for subfield in field:
+                    subfields_visited += 1
+                    pattern_evaluations += 1
+                    match = self.reg_ex.search(str(field))
+                    if match:
+                        record_match = str(field.tag), '', match.group(), str(field) + ' ' + match.group()
+                        break
+                if record_match is not None:
+                    break
+            else:
+                # Handle field search for 010 to 999.
+                for subfield_position, subfield in enumerate(field):
+                    subfields_visited += 1
+                    if self.subfield_code_matches(subfield[0]):
+                        if decoded_fields is None:
+                            if marc8 is None:
+                                marc8 = record_is_marc8(record)
+                            subfield_data = decode_marc_data(subfield[1], marc8)
+                            if self.normalized_search:
+                                subfield_data = normalized_match_text(subfield_data)
+                        else:
+                            subfield_data = decoded_fields[field_position][subfield_position]
+                        pattern_evaluations += 1
+                        if self.search_by_whole_word and not self.reg_ex_search:
+                            subfield_matched = self.whole_word_matches(subfield_data)
+                        else:
+                            subfield_matched = self.text_matches(subfield_data)
+                        if subfield_matched:
+                            if self.reg_ex_search and self.search_tags is not None:
+                                record_match = str(field.tag), str(subfield[0]), subfield_data, \
+                                    str(field) + ' ' + subfield_data
+                            else:
+                                record_match = str(field.tag), str(subfield[0]), subfield_data, subfield_data
+                            break
+                if record_match is not None:
+                    break
+        self.fields_visited += fields_visited
+        self.subfields_visited += subfields_visited
+        self.pattern_evaluations += pattern_evaluations
+        if marc8:
+            self.marc8_records += 1
+        return record_match
+
+    def search_counts(self):
+        # Work done by record_match() so far: records tested, fields and subfields visited, text tested against the
+        # search term(s) or RegEx, and records decoded as MARC-8, as the data didn't decode as UTF-8. See RunMetrics.
+        return {'records_tested': self.records_tested, 'fields_visited': self.fields_visited,
+                'subfields_visited': self.subfields_visited, 'pattern_evaluations': self.pattern_evaluations,
+                'marc8_records': self.marc8_records}
+
+    def record_matches(self, record, decoded_fields=None):
+        # Test one record against the search. Matching data is printed to screen.
+        record_match = self.record_match(record, decoded_fields)
+        if record_match is None:
+            return False
+        if record_match[3] is not None:
+            print(record_match[3])
+        return True
+
+    def raw_record_may_match(self, raw_record, directory_entries=None):
+        # Test a raw record against the search straight from the leader and directory, without building a pymarc
+        # record. Only the byte ranges of the fields being searched are looked at. directory_entries are the record's
+        # directory entries, if a record store has them already. See raw_record_directory().
+        # False means the record can't match. True means it may match and record_matches() has to decide.
+        # RegEx searches only check the field and subfield.
+        if self.search_leader:
+            if self.search_terms_as_bytes is None:
+                return True
+            for search_term in self.search_terms_as_bytes:
+                if search_term in raw_record[:24]:
+                    return True
+            return False
+        if not self.search_subfield.isascii():
+            return True
+        if directory_entries is None:
+            try:
+                directory_entries = raw_record_directory(raw_record)
+            except ValueError:
+                return True
+        search_tag = self.search_field.encode('ascii')
+        subfield_delimiter = ('\x1f' + self.search_subfield).encode('ascii')
+        # Whether the record is MARC-8 is only worked out, if it's needed.
+        marc8 = None
+        for field_tag, field_start, field_end in directory_entries:
+            if search_tag and field_tag != search_tag:
+                continue
+            control_field = field_tag < b'010' and field_tag.isdigit()
+            if control_field and not self.search_control_fields:
+                continue
+            field_data = raw_record[field_start:field_end]
+            if self.search_subfield and not control_field and subfield_delimiter not in field_data:
+                continue
+            if self.search_terms_as_bytes is None:
+                return True
+            if self.search_terms_as_bytes_pattern is not None:
+                if self.search_terms_as_bytes_pattern.search(field_data) is not None:
+                    return True
+            else:
+                for search_term in self.search_terms_as_bytes:
+                    if search_term in field_data:
+                        return True
+            # Field data decoded as UTF-8 holds the search term only when the bytes hold the UTF-8 search term, and
+            # so does printable ASCII decoded as MARC-8. Other data decodes differently, so let it through.
+            if marc8 is None:
+                marc8 = raw_record_is_marc8(raw_record)
+            if marc8:
+                if field_data.translate(None, PRINTABLE_ASCII):
+                    return True
+            elif not field_data.isascii():
+                try:
+                    field_data.decode('utf-8')
+                except UnicodeDecodeError:
+                    return True
+        return False
+
+
+class ResultSet:
+    # The records a search matched, as a bitmap over the loaded records: bit n is set, if the record at position n
+    # matched. 50,000 records take about 6 KB. Result sets combine with & (AND), | (OR) and ~ (NOT), which work on the
+    # whole bitmap at once, and a search can be limited to the records of a result set to refine it.
+    def __init__(self, record_count, record_positions=(), description=''):
+        self.record_count = record_count
+        self.description = description
+        bitmap = bytearray((record_count + 7) // 8)
+        for record_position in record_positions:
+            bitmap[record_position >> 3] |= 1 << (record_position & 7)
+        self.bitmap = int.from_bytes(bitmap, 'little')
+
+    @classmethod
+    def from_bitmap(cls, record_count, bitmap, description):
+        result_set = cls(record_count, (), description)
+        result_set.bitmap = bitmap
+        return result_set
+
+    def __and__(self, other_result_set):
+        return ResultSet.from_bitmap(self.record_count, self.bitmap & other_result_set.bitmap,
+                                     '(' + self.description + ') AND (' + other_result_set.description + ')')
+
+    def __or__(self, other_result_set):
+        return ResultSet.from_bitmap(self.record_count, self.bitmap | other_result_set.bitmap,
+                                     '(' + self.description + ') OR (' + other_result_set.description + ')')
+
+    def __invert__(self):
+        return ResultSet.from_bitmap(self.record_count, ~self.bitmap & ((1 << self.record_count) - 1),
+                                     'NOT (' + self.description + ')')
+
+    def __len__(self):
+        return bin(self.bitmap).count('1')
+
+    def positions(self):
+        # Sorted record positions in the result set.
+        record_positions = []
+        for byte_position, bitmap_byte in enumerate(self.bitmap.to_bytes((self.record_count + 7) // 8, 'little')):
+            if bitmap_byte:
+                for bit in range(8):
+                    if bitmap_byte >> bit & 1:
+                        record_positions.append(byte_position * 8 + bit)
+        return record_positions
+
+
+def evaluate_result_set_expression(tokens, evaluate_operand):
+    # Evaluate AND, OR, NOT and parentheses over the tokens of an expression, e.g. "1 AND NOT (2 OR 3)". NOT binds
+    # tightest, then AND, then OR. evaluate_operand(tokens, token_position) returns the ResultSet of the operand
+    # starting at token_position, and the position of the token after it. Raises ValueError with a message, if the
+    # expression is invalid.
+    token_position = 0
+
+    def next_token():
+        return tokens[token_position].upper() if token_position < len(tokens) else ''
+
+    def parse_or():
+        nonlocal token_position
+        result_set = parse_and()
+        while next_token() == 'OR':
+            token_position += 1
+            result_set = result_set | parse_and()
+        return result_set
+
+    def parse_and():
+        nonlocal token_position
+        result_set = parse_not()
+        while next_token() == 'AND':
+            token_position += 1
+            result_set = result_set & parse_not()
+        return result_set
+
+    def parse_not():
+        nonlocal token_position
+        token = next_token()
+        if token == 'NOT':
+            token_position += 1
+            return ~parse_not()
+        elif token == '(':
+            token_position += 1
+            result_set = parse_or()
+            if next_token() != ')':
+                raise ValueError('Missing closing parenthesis.')
+            token_position += 1
+            return result_set
+        result_set, token_position = evaluate_operand(tokens, token_position)
+        return result_set
+
+    result_set = parse_or()
+    if token_position < len(tokens):
+        raise ValueError('Unexpected \"' + tokens[token_position] + '\".')
+    return result_set
+
+
+def combine_result_sets(expression, result_sets):
+    # Combine numbered result sets with an expression such as "1 AND NOT 2" or "(1 OR 2) AND 3". Result set numbers
+    # start at 1. NOT binds tightest, then AND, then OR. Raises ValueError with a message, if the expression is invalid.
+    def result_set_operand(tokens, token_position):
+        token = tokens[token_position] if token_position < len(tokens) else ''
+        if token.isdigit() and 1 <= int(token) <= len(result_sets):
+            return result_sets[int(token) - 1], token_position + 1
+        elif token.isdigit():
+            raise ValueError('No result set #' + token + '.')
+        raise ValueError('Expected a result set number, NOT or (, not \"' + token + '\".')
+
+    combined_result_set = evaluate_result_set_expression(re.findall(r'\d+|[A-Za-z]+|\S', expression),
+                                                         result_set_operand)
+    return ResultSet.from_bitmap(combined_result_set.record_count, combined_result_set.bitmap,
+                                 combined_result_set.description)
+
+
+# Fixed fields kept by FixedFieldColumns, and how many characters of each are kept. Longer data is cut off.
+FIXED_FIELD_WIDTHS = {'LDR': 24, '001': 20, '003': 8, '005': 16, '006': 18, '007': 23, '008': 40}
+
+
+class FixedFieldColumns:
+    # The leader and the 001-008 fields of the loaded records, for positional queries such as
+    # LDR/06 = 'a' AND 008/35-37 = 'ger'. Each field is kept as one fixed-width row per record in a bytearray, e.g.
+    # record n's 008 is field_rows['008'][n * 40:n * 40 + 40]. Shorter or missing data is filled with 0 bytes.
+    # One character position of every record, e.g. 008/35, is a slice with a step. A query compares the whole column
+    # at once with bytes.translate() and turns it straight into a ResultSet bitmap, without a Python loop over the
+    # records. Only the first 006 and 007 of a record are kept.
+    def __init__(self, record_count):
+        self.record_count = record_count
+        self.field_rows = {field_tag: bytearray(record_count * width)
+                           for field_tag, width in FIXED_FIELD_WIDTHS.items()}
+        # 1 for the records that have the field, 0 for the others.
+        self.fields_present = {field_tag: bytearray(record_count) for field_tag in FIXED_FIELD_WIDTHS}
+        # Record stores are read without parsing the records, so records pymarc can't parse are found when they first
+        # match, and are left out of the matches, as they are in other searches. See readable_bitmap().
+        self.record_store = None
+        self.records_checked = bytearray()
+        self.unreadable_bitmap = 0
+
+    def set_field(self, record_position, field_tag, field_data):
+        if self.fields_present[field_tag][record_position]:
+            return
+        width = FIXED_FIELD_WIDTHS[field_tag]
+        field_data = bytes(field_data[:width])
+        self.field_rows[field_tag][record_position * width:record_position * width + len(field_data)] = field_data
+        self.fields_present[field_tag][record_position] = 1
+
+    @classmethod
+    def from_records(cls, records_loaded):
+        # Record stores are read from the raw records. Records that can't be read are left out, as they can't match.
+        fixed_field_columns = cls(len(records_loaded))
+        if isinstance(records_loaded, MarcRecordStore):
+            fixed_field_columns.record_store = records_loaded
+            fixed_field_columns.records_checked = bytearray(len(records_loaded))
+            for record_position in range(len(records_loaded)):
+                raw_record = records_loaded.raw_record(record_position)
+                directory_entries = records_loaded.record_directory(record_position)
+                try:
+                    if directory_entries is None:
+                        directory_entries = raw_record_directory(raw_record)
+                except ValueError:
+                    continue
+                if raw_record[-1:] != b'\x1d' or len(raw_record) < 24:
+                    continue
+                fixed_field_columns.set_field(record_position, 'LDR', raw_record[:24])
+                for field_tag, field_start, field_end in directory_entries:
+                    field_tag = bytes(field_tag).decode('ascii', 'replace')
+                    if field_tag in FIXED_FIELD_WIDTHS:
+                        fixed_field_columns.set_field(record_position, field_tag, raw_record[field_start:field_end])
+        else:
+            for record_position, record in enumerate(records_loaded):
+                if record is None:
+                    continue
+                fixed_field_columns.set_field(record_position, 'LDR', str(record.leader).encode('ascii', 'replace'))
+                for field in record.fields:
+                    if field.tag in FIXED_FIELD_WIDTHS and field.is_control_field():
+                        field_data = field.data
+                        if isinstance(field_data, str):
+                            field_data = field_data.encode('utf-8')
+                        fixed_field_columns.set_field(record_position, field.tag, field_data)
+        return fixed_field_columns
+
+    def column_bitmap(self, column, character):
+        # Bitmap of the records with character in column: the matching bytes become '1', the rest '0', and the string
+        # of digits, last record first, is read as a binary number.
+        translation_table = bytearray(b'0' * 256)
+        translation_table[character] = ord('1')
+        return int(column.translate(translation_table)[::-1] or b'0', 2)
+
+    def readable_bitmap(self, bitmap):
+        # The bitmap without the records of the record store that pymarc can't parse. Each record is parsed once.
+        if self.record_store is not None:
+            for record_position in ResultSet.from_bitmap(self.record_count, bitmap, '').positions():
+                if not self.records_checked[record_position]:
+                    self.records_checked[record_position] = 1
+                    if marc_record_from_raw(self.record_store.raw_record(record_position)) is None:
+                        self.unreadable_bitmap |= 1 << record_position
+        return bitmap & ~self.unreadable_bitmap
+
+    def condition_result_set(self, field_tag, first_position, last_position, comparison, value, description):
+        # Records whose field has value at first_position to last_position. With comparison '!=', records that have
+        # the field with something else there.
+        width = FIXED_FIELD_WIDTHS[field_tag]
+        field_rows = self.field_rows[field_tag]
+        present_bitmap = self.column_bitmap(self.fields_present[field_tag], 1)
+        matching_bitmap = present_bitmap
+        for character_position, character in zip(range(first_position, last_position + 1), value):
+            matching_bitmap &= self.column_bitmap(field_rows[character_position::width], character)
+        if comparison == '!=':
+            matching_bitmap = present_bitmap & ~matching_bitmap
+        return ResultSet.from_bitmap(self.record_count, self.readable_bitmap(matching_bitmap), description)
+
+    def query(self, fixed_field_query):
+        # Records matching a query of conditions such as LDR/06 = 'a' or 008/35-37 != 'eng', combined with AND, OR,
+        # NOT and parentheses. Character positions start at 0, as in the MARC documentation. Values are quoted and as
+        # long as the positions. Raises ValueError with a message, if the query is invalid.
+        def fixed_field_operand(tokens, token_position):
+            field_position, comparison, quoted_value = (tokens[token_position:token_position + 3] + ['', '', ''])[:3]
+            field_position_match = re.fullmatch(r'(LDR|\d{3})/(\d{1,2})(?:-(\d{1,2}))?', field_position, re.IGNORECASE)
+            if field_position_match is None:
+                raise ValueError('Expected a fixed field position such as LDR/06 or 008/35-37, NOT or (, not \"'
+                                 + field_position + '\".')
+            field_tag = field_position_match.group(1).upper()
+            if field_tag not in FIXED_FIELD_WIDTHS:
+                raise ValueError('Fixed fields are LDR, ' + ', '.join(list(FIXED_FIELD_WIDTHS)[1:]) + ', not '
+                                 + field_tag + '.')
+            first_position = int(field_position_match.group(2))
+            last_position = int(field_position_match.group(3) or first_position)
+            if not first_position <= last_position < FIXED_FIELD_WIDTHS[field_tag]:
+                raise ValueError(field_position + ' isn\'t in ' + field_tag + ', which has positions 0 to '
+                                 + str(FIXED_FIELD_WIDTHS[field_tag] - 1) + '.')
+            if comparison not in ('=', '!='):
+                raise ValueError('Expected = or != after ' + field_position + '.')
+            if len(quoted_value) < 2 or quoted_value[0] not in '\'\"' or quoted_value[-1] != quoted_value[0]:
+                raise ValueError('Expected a quoted value after ' + field_position + ' ' + comparison + '.')
+            value = quoted_value[1:-1].encode('utf-8')
+            if len(value) != last_position - first_position + 1:
+                raise ValueError(field_position + ' is ' + str(last_position - first_position + 1)
+                                 + ' character(s), but ' + quoted_value + ' is ' + str(len(value)) + '.')
+            return self.condition_result_set(field_tag, first_position, last_position, comparison, value,
+                                             ' '.join([field_position, comparison, quoted_value])), token_position + 3
+
+        tokens = re.findall(r'\w+/\d+(?:-\d+)?|!=|=|\'[^\']*\'|\"[^\"]*\"|\w+|\S', fixed_field_query)
+        query_result_set = evaluate_result_set_expression(tokens, fixed_field_operand)
+        return ResultSet.from_bitmap(self.record_count, query_result_set.bitmap, 'Fixed fields: ' + fixed_field_query)
+
+
+def search_description(field_subfield_to_search, search_term_or_terms, search_by_whole_word, reg_ex_search,
+                       normalized_search=False):
+    # Short description of a search for the list of result sets, e.g. 245a contains "cat".
+    field_subfield = ''.join(field_subfield_to_search[-1]) if field_subfield_to_search else ''
+    search_terms = ' | '.join('\"' + str(search_term) + '\"' for search_term in search_term_or_terms[:3])
+    if len(search_term_or_terms) > 3:
+        search_terms += ' | ... (' + str(len(search_term_or_terms)) + ' terms)'
+    if reg_ex_search:
+        match_type = ' matches RegEx '
+    elif search_by_whole_word is True:
+        match_type = ' has whole word '
+    else:
+        match_type = ' contains '
+    if normalized_search and not reg_ex_search:
+        search_terms += ' (normalized)'
+    return (field_subfield or 'Any field') + match_type + search_terms
+
+
+class SearchLimits:
+    # Limits for exploratory searches, which only need some of the matches, e.g. to see whether anything matches.
+    # match_limit stops the search after that many matching records. 1 only tells whether any record matches.
+    # sample_size searches that many records instead of every record: 'random' picks them at random, 'stride' picks
+    # evenly spaced records.
+    def __init__(self, match_limit=None, sample_size=None, sample_mode='random'):
+        self.match_limit = match_limit
+        self.sample_size = sample_size
+        self.sample_mode = sample_mode
+        self.random_generator = random.Random()
+
+    def match_limit_reached(self, count_of_records_matched):
+        return self.match_limit is not None and count_of_records_matched >= self.match_limit
+
+    def sample_positions(self, record_count):
+        # Sorted positions of the sampled records, out of record_count records.
+        if self.sample_size is None or self.sample_size >= record_count:
+            return range(record_count)
+        if self.sample_mode == 'stride':
+            return [record_count * sample_number // self.sample_size for sample_number in range(self.sample_size)]
+        return sorted(self.random_generator.sample(range(record_count), self.sample_size))
+
+    def sample_offsets(self, file_size):
+        # Sorted byte offsets to take the sampled records from, in a file of file_size bytes, for searches that don't
+        # know how many records there are. Random offsets pick longer records a little more often than shorter ones.
+        if self.sample_mode == 'stride':
+            return [file_size * sample_number // self.sample_size for sample_number in range(self.sample_size)]
+        return sorted(self.random_generator.randrange(file_size) for sample_number in range(self.sample_size))
+
+    def description(self):
+        descriptions = []
+        if self.sample_size is not None:
+            descriptions.append(('Random' if self.sample_mode == 'random' else 'Evenly spaced') + ' sample of ' +
+                                str(self.sample_size) + ' record(s)')
+        if self.match_limit == 1:
+            descriptions.append('stop at the first match')
+        elif self.match_limit is not None:
+            descriptions.append('stop after ' + str(self.match_limit) + ' matches')
+        return ', '.join(descriptions)
+
+
+def limited_record_positions(record_count, record_positions, search_limits=None, result_set=None):
+    # The record_positions, out of record_count loaded records, that a search with search_limits and a result_set
+    # searches: the ones in the result set, and of those, the sampled ones.
+    if result_set is not None:
+        if record_positions == range(record_count):
+            record_positions = result_set.positions()
+        else:
+            result_set_positions = set(result_set.positions())
+            record_positions = [record_position for record_position in record_positions
+                                if record_position in result_set_positions]
+    if search_limits is not None:
+        sampled_record_positions = search_limits.sample_positions(record_count)
+        if record_positions == range(record_count):
+            record_positions = sampled_record_positions
+        elif isinstance(sampled_record_positions, list):
+            # Only the sampled records that the index or record store found can match.
+            record_positions_found = set(record_positions)
+            record_positions = [record_position for record_position in sampled_record_positions
+                                if record_position in record_positions_found]
+    return record_positions
+
+
+def match_loaded_record_positions(records_to_search, record_positions, search_query, decoded_record_cache=None,
+                                  match_report=None, run_metrics=None, search_limits=None, result_set=None):
+    # Test the loaded records at record_positions against the search. Returns the positions of the matching records.
+    # Records in a record store are kept as raw bytes and only parsed, if SearchQuery.raw_record_may_match() lets them
+    # through. With a decoded record cache, records are only decoded the first time they are searched.
+    # Matches go to match_report. Without one, matching data is printed to screen.
+    # The records, bytes and search counts are added to run_metrics, after the search.
+    # With search_limits, only the sampled records are searched, and the search stops at the match limit.
+    # With a result_set, only the records in the result set are searched, to refine an earlier search.
+    matching_record_positions = []
+    if match_report is None:
+        match_report = MatchReport()
+    record_positions = limited_record_positions(len(records_to_search), record_positions, search_limits, result_set)
+    count_of_records_searched = len(record_positions)
+    if decoded_record_cache is not None:
+        cache_marc8_records = decoded_record_cache.marc8_records
+    if isinstance(records_to_search, MarcRecordStore):
+        for record_position in record_positions:
+            raw_record = records_to_search.raw_record(record_position)
+            if search_query.raw_record_may_match(raw_record, records_to_search.record_directory(record_position)):
+                record = marc_record_from_raw(raw_record)
+                # Records that couldn't be parsed have nothing to search.
+                if record is not None:
+                    record_match = search_query.record_match(record)
+                    if record_match is not None:
+                        matching_record_positions.append(record_position)
+                        match_report.add_match(record_position + 1, record, record_match)
+                        if search_limits is not None and \
+                                search_limits.match_limit_reached(len(matching_record_positions)):
+                            count_of_records_searched = record_positions.index(record_position) + 1
+                            break
+    else:
+        for record_position in record_positions:
+            record = records_to_search[record_position]
+            if decoded_record_cache is None:
+                decoded_fields = None
+            elif search_query.normalized_search:
+                decoded_fields = decoded_record_cache.normalized_fields(record_position, record)
+            else:
+                decoded_fields = decoded_record_cache.decoded_fields(record_position, record)
+            record_match = search_query.record_match(record, decoded_fields)
+            if record_match is not None:
+                matching_record_positions.append(record_position)
+                match_report.add_match(record_position + 1, record, record_match)
+                if search_limits is not None and search_limits.match_limit_reached(len(matching_record_positions)):
+                    count_of_records_searched = record_positions.index(record_position) + 1
+                    break
+    if run_metrics is not None:
+        run_metrics.records += count_of_records_searched
+        if hasattr(records_to_search, 'record_byte_range'):
+            run_metrics.bytes += sum(records_to_search.record_byte_range(record_position)[1]
+                                     for record_position in record_positions[:count_of_records_searched])
+        run_metrics.add_search_counts(search_query.search_counts())
+        if decoded_record_cache is not None:
+            run_metrics.marc8_records += decoded_record_cache.marc8_records - cache_marc8_records
+        run_metrics.matches += len(matching_record_positions)
+    return matching_record_positions
+
+
+def search_loaded_record_positions(records_to_search, field_subfield_to_search, search_term_or_terms,
+                                   search_by_whole_word, term_index=None, decoded_record_cache=None, match_report=None,
+                                   run_metrics=None, search_limits=None, result_set=None, normalized_search=False):
+    if isinstance(records_to_search, MarcQueryClient):
+        return records_to_search.search(field_subfield_to_search, search_term_or_terms, search_by_whole_word, False,
+                                        match_report, run_metrics, search_limits, result_set, normalized_search)
+    # Search the loaded records. Returns the positions of the matching records. Only the records that may match are
+    # searched. See candidate_record_positions().
+    # Normalized searches ignore case, accents and punctuation. With a decoded record cache, the normalized text of a
+    # record is worked out the first time it's searched, and kept for the next searches. See SearchQuery.
+    search_query = SearchQuery(field_subfield_to_search, search_term_or_terms, search_by_whole_word,
+                               normalized_search=normalized_search)
+    return match_loaded_record_positions(records_to_search,
+                                         candidate_record_positions(records_to_search, search_query, term_index),
+                                         search_query, decoded_record_cache, match_report, run_metrics, search_limits,
+                                         result_set)
+
+
+def candidate_record_positions(records_to_search, search_query, term_index=None):
+    # Positions of the loaded records that may match the search. With a term index, whole word searches of subfields
+    # only search the records the index lists for the terms. Searches of a field in a record store that indexes
+    # fields only search the records with that field.
+    if term_index is not None and search_query.term_index_can_answer:
+        return term_index.candidate_record_positions(search_query)
+    elif isinstance(records_to_search, MarcRecordStore) and search_query.search_tags is not None \
+            and not search_query.search_leader:
+        return records_to_search.positions_with_field(search_query.search_field)
+    return range(len(records_to_search))
+
+
+def reg_ex_search_loaded_record_positions(records_to_search, field_subfield_to_search, search_term_or_terms,
+                                          decoded_record_cache=None, match_report=None, run_metrics=None,
+                                          search_limits=None, result_set=None):
+    if isinstance(records_to_search, MarcQueryClient):
+        return records_to_search.search(field_subfield_to_search, search_term_or_terms, False, True,
+                                        match_report, run_metrics, search_limits, result_set)
+    # RegEx search of the loaded records. Returns the positions of the matching records.
+    search_query = SearchQuery(field_subfield_to_search, search_term_or_terms, reg_ex_search=True)
+    return match_loaded_record_positions(records_to_search, candidate_record_positions(records_to_search, search_query),
+                                         search_query, decoded_record_cache, match_report, run_metrics, search_limits,
+                                         result_set)
+
+
+def search_loaded_records(records_to_search, field_subfield_to_search, search_term_or_terms, search_by_whole_word,
+                          term_index=None, decoded_record_cache=None):
+    # Matching records as pymarc records. See search_loaded_record_positions().
+    return [records_to_search[record_position] for record_position in search_loaded_record_positions(
+        records_to_search, field_subfield_to_search, search_term_or_terms, search_by_whole_word, term_index,
+        decoded_record_cache)]
+
+
+def reg_ex_search_loaded_records(records_to_search, field_subfield_to_search, search_term_or_terms,
+                                 decoded_record_cache=None):
+    # Matching records as pymarc records. See reg_ex_search_loaded_record_positions().
+    return [records_to_search[record_position] for record_position in reg_ex_search_loaded_record_positions(
+        records_to_search, field_subfield_to_search, search_term_or_terms, decoded_record_cache)]
+
+
+# Bytes that decode the same as MARC-8 and as UTF-8. MARC-8 drops control characters and maps escape sequences.
+PRINTABLE_ASCII = bytes(range(0x20, 0x7f))
+
+
+def decode_marc_data(marc_data, marc8=False):
+    # Decode raw field or subfield data. UTF-8 is tried first, then MARC-8.
+    # Data of MARC-8 records (see record_is_marc8()) is decoded as MARC-8 straight away, printable ASCII as is.
+    if marc8:
+        if not marc_data.translate(None, PRINTABLE_ASCII):
+            return marc_data.decode('ascii')
+        return str(pymarc.marc8_to_unicode(marc_data))
+    try:
+        return str(marc_data.decode('utf-8'))
+    except UnicodeDecodeError:
+        return str(pymarc.marc8_to_unicode(marc_data))
+
+
+def field_subfields(field):
+    # (code, data) pairs of a field's subfields. pymarc 4 keeps subfields as a flat [code, data, ...] list, and pymarc 5
+    # as a list of Subfield tuples. Reads field.subfields directly, as iterating a field moves the one position it
+    # keeps, which would cut short a loop over the same field.
+    subfields = getattr(field, 'subfields', None) or []
+    if not isinstance(subfields[0] if subfields else (), tuple):
+        return list(zip(subfields[0::2], subfields[1::2]))
+    return [(subfield[0], subfield[1]) for subfield in subfields]
+
+
+def record_is_marc8(record):
+    # Leader/09 is 'a' for UCS/Unicode records and blank for MARC-8 records. MARC-8 records that are valid UTF-8 all
+    # the way through were saved as UTF-8 without updating the leader, so they are decoded as UTF-8 like before.
+    # Checking the whole record at once costs one decode, not one failed decode for every subfield.
+    # Reads record.fields and field.subfields directly, as it may be called while the record is being iterated.
+    if str(record.leader)[9:10] == 'a':
+        return False
+    record_data = []
+    for field in record.fields:
+        if field.is_control_field():
+            record_data.append(field.data)
+        else:
+            record_data.extend(subfield_data for subfield_code, subfield_data in field_subfields(field))
+    try:
+        b'\x1f'.join(record_data).decode('utf-8')
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def raw_record_is_marc8(raw_record):
+    # record_is_marc8() for raw record bytes. Checks the data after the directory, so it may say MARC-8 when
+    # record_is_marc8() doesn't, e.g. for bad indicators. Used where MARC-8 is the safe answer.
+    if raw_record[9:10] == b'a':
+        return False
+    try:
+        raw_record[int(raw_record[12:17]):].decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return True
+    return False
+
+
+def decode_record_fields(record, marc8=None):
+    # Text of every field of a record, decoded once, by field position: the data of 001-009 fields, and a list of the
+    # subfield data for other fields. marc8 is record_is_marc8(record), if it's been worked out already.
+    if marc8 is None:
+        marc8 = record_is_marc8(record)
+    decoded_fields = []
+    for field in record:
+        if field.is_control_field():
+            decoded_fields.append(decode_marc_data(field.data, marc8))
+        else:
+            decoded_fields.append([decode_marc_data(subfield[1], marc8) for subfield in field])
+    return decoded_fields
+
+
+def normalized_match_text(text):
+    # Text for normalized searches and title match keys: accents and other marks removed, case folded, and punctuation
+    # and runs of whitespace made single spaces, e.g. 'Les Misérables : roman /' is 'les miserables roman'.
+    if not text.isascii():
+        text = ''.join(character for character in unicodedata.normalize('NFKD', text)
+                       if not unicodedata.combining(character))
+    return ' '.join(re.sub(r'[\W_]+', ' ', text.casefold()).split())
+
+
+class DecodedRecordCache:
+    # Decoded text of loaded records by record position, kept next to the loaded records. A record is decoded the first
+    # time it is searched, so repeated searches of the same records never decode again.
+    # The normalized text for normalized searches is kept the same way, from the first normalized search on.
+    def __init__(self, record_count):
+        self.decoded_records = [None] * record_count
+        self.normalized_records = None
+        # Records decoded as MARC-8, as the data didn't decode as UTF-8. See RunMetrics.
+        self.marc8_records = 0
+
+    def decoded_fields(self, record_position, record):
+        decoded_fields = self.decoded_records[record_position]
+        if decoded_fields is None:
+            marc8 = record_is_marc8(record)
+            if marc8:
+                self.marc8_records += 1
+            decoded_fields = self.decoded_records[record_position] = decode_record_fields(record, marc8)
+        return decoded_fields
+
+    def normalized_fields(self, record_position, record):
+        # decoded_fields() with every field and subfield normalized. See normalized_match_text().
+        if self.normalized_records is None:
+            self.normalized_records = [None] * len(self.decoded_records)
+        normalized_fields = self.normalized_records[record_position]
+        if normalized_fields is None:
+            normalized_fields = self.normalized_records[record_position] = [
+                normalized_match_text(field_data) if isinstance(field_data, str) else
+                [normalized_match_text(subfield_data) for subfield_data in field_data]
+                for field_data in self.decoded_fields(record_position, record)]
+        return normalized_fields
+
+
+def record_control_number(record):
+    # Decoded 001 of a record. Blank, if the record has no 001.
+    for field in record.fields:
+        if field.tag == '001' and field.is_control_field():
+            return decode_marc_data(field.data)
+    return ''
+
+
+class MatchReport:
+    # Where the matches of a search go: on screen, and to a CSV or JSONL report file.
+    # Up to console_limit matches are shown on screen (None shows all, 0 none), then a summary of how many more there
+    # were, as printing every match of a broad search takes longer than the search. The report file lists every match
+    # with its record number, 001, tag, subfield code and matching text. It's written through a 1 MB buffer.
+    REPORT_COLUMNS = ['Record Number', 'Control Number (001)', 'Field', 'Subfield', 'Matching Text']
+
+    def __init__(self, console_limit=None, report_file=None, report_format='csv'):
+        self.console_limit = console_limit
+        self.matches_shown = 0
+        self.matches_not_shown = 0
+        self.report_format = report_format
+        self.report_fh = None
+        self.report_writer = None
+        if report_file is not None:
+            self.report_fh = open(str(report_file), 'w', encoding='utf-8', newline='', buffering=1048576)
+            if report_format == 'csv':
+                self.report_writer = csv.writer(self.report_fh)
+                self.report_writer.writerow(self.REPORT_COLUMNS)
+
+    def add_match(self, record_number, record, record_match, control_number=None):
+        # record_match is a match from SearchQuery.record_match(). The 001 is taken from record, if it isn't given.
+        field_tag, subfield_code, matching_text, text_to_show = record_match
+        if text_to_show is not None:
+            if self.console_limit is None or self.matches_shown < self.console_limit:
+                print(text_to_show)
+                self.matches_shown += 1
+            else:
+                self.matches_not_shown += 1
+        if self.report_fh is not None:
+            if control_number is None:
+                control_number = record_control_number(record)
+            if self.report_writer is not None:
+                self.report_writer.writerow([record_number, control_number, field_tag, subfield_code, matching_text])
+            else:
+                self.report_fh.write(json.dumps(dict(zip(self.REPORT_COLUMNS, [record_number, control_number,
+                                                                               field_tag, subfield_code,
+                                                                               matching_text])),
+                                                ensure_ascii=False) + '\n')
+
+    def close(self):
+        if self.matches_not_shown:
+            print(str(self.matches_not_shown) + ' more match(es) not shown. See Settings to show more.')
+        if self.report_fh is not None:
+            self.report_fh.close()
+            self.report_fh = None
+
+
+class RunMetrics:
+    # Counters for one load, search or save, so a slow run shows whether the time went to reading, decoding or
+    # matching: records and bytes read or written, fields and subfields visited, records decoded as MARC-8 after UTF-8
+    # decoding failed, text tested against the search and matches. Written as one JSON object per line to a metrics
+    # file. See write().
+    # profile_mode 'cprofile' profiles the run with cProfile, and 'tracemalloc' traces memory allocation. Both are
+    # slow, so they are only used when asked for. Only the main process is profiled, not search processes.
+    def __init__(self, operation, profile_mode=None):
+        self.operation = operation
+        # Settings of the run, e.g. the file and the search.
+        self.details = {}
+        self.records = 0
+        self.bytes = 0
+        self.records_tested = 0
+        self.fields_visited = 0
+        self.subfields_visited = 0
+        self.pattern_evaluations = 0
+        self.marc8_records = 0
+        self.matches = 0
+        self.seconds = 0.0
+        self.profile_mode = profile_mode
+        self.profile = None
+        self.memory = None
+        self.profiler = None
+        self.started = datetime.datetime.now()
+        if profile_mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profile_mode == 'tracemalloc':
+            tracemalloc.start()
+        self.start_time = time.perf_counter()
+
+    def add_search_counts(self, search_counts):
+        # search_counts is from SearchQuery.search_counts().
+        self.records_tested += search_counts['records_tested']
+        self.fields_visited += search_counts['fields_visited']
+        self.subfields_visited += search_counts['subfields_visited']
+        self.pattern_evaluations += search_counts['pattern_evaluations']
+        self.marc8_records += search_counts['marc8_records']
+
+    def finish(self):
+        # Stop the clock and the profiling. The 20 functions that took the longest and the 10 lines that allocated the
+        # most memory are printed to screen and kept for the metrics file.
+        self.seconds = time.perf_counter() - self.start_time
+        if self.profiler is not None:
+            self.profiler.disable()
+            profile_stats = pstats.Stats(self.profiler)
+            profile_stats.sort_stats('cumulative').print_stats(20)
+            self.profile = []
+            for (file_name, line_number, function_name), (primitive_calls, calls, total_time, cumulative_time,
+                                                          callers) in sorted(profile_stats.stats.items(),
+                                                                             key=lambda item: -item[1][3])[:20]:
+                self.profile.append({'function': file_name + ':' + str(line_number) + '(' + function_name + ')',
+                                     'calls': calls, 'total_seconds': round(total_time, 6),
+                                     'cumulative_seconds': round(cumulative_time, 6)})
+            self.profiler = None
+        elif self.profile_mode == 'tracemalloc' and tracemalloc.is_tracing():
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            top_allocations = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            self.memory = {'current_bytes': current_bytes, 'peak_bytes': peak_bytes, 'top_allocations': [
+                {'location': str(allocation.traceback), 'bytes': allocation.size, 'count': allocation.count}
+                for allocation in top_allocations]}
+            print('Peak memory traced: ' + str(peak_bytes) + ' bytes')
+            for allocation in top_allocations:
+                print(allocation)
+
+    def as_dict(self):
+        metrics = {'operation': self.operation,
+                   'started': self.started.isoformat(timespec='seconds'),
+                   'seconds': round(self.seconds, 6),
+                   'records': self.records,
+                   'bytes': self.bytes,
+                   'records_per_second': round(self.records / self.seconds, 1) if self.seconds else None,
+                   'bytes_per_second': round(self.bytes / self.seconds, 1) if self.seconds else None,
+                   'records_tested': self.records_tested,
+                   'fields_visited': self.fields_visited,
+                   'subfields_visited': self.subfields_visited,
+                   'marc8_records': self.marc8_records,
+                   'pattern_evaluations': self.pattern_evaluations,
+                   'matches': self.matches}
+        metrics.update(self.details)
+        if self.profile is not None:
+            metrics['profile'] = self.profile
+        if self.memory is not None:
+            metrics['memory'] = self.memory
+        return metrics
+
+    def write(self, metrics_file):
+        # Add the metrics to the end of metrics_file as one line of JSON.
+        try:
+            with open(str(metrics_file), 'a', encoding='utf-8') as fh:
+                fh.write(json.dumps(self.as_dict(), ensure_ascii=False) + '\n')
+        except OSError:
+            print('ERROR: Unable to write the metrics file.')
+
+
+def search_metrics_details(marc_file, field_subfield_to_search, search_term_or_terms, search_by_whole_word,
+                           reg_ex_search, search_limits=None, normalized_search=False):
+    # Search settings for RunMetrics.details. Only the count of search terms is kept, not the search terms.
+    search_metrics = {'marc_file': str(marc_file),
+                      'field_subfield': ''.join(field_subfield_to_search[-1]) if field_subfield_to_search else '',
+                      'search_terms': len(search_term_or_terms), 'whole_word': search_by_whole_word is True,
+                      'reg_ex': reg_ex_search, 'normalized': normalized_search is True and not reg_ex_search}
+    if search_limits is not None:
+        search_metrics.update({'match_limit': search_limits.match_limit, 'sample_size': search_limits.sample_size,
+                               'sample_mode': search_limits.sample_mode})
+    return search_metrics
+
+
+def start_run_metrics(operation, metrics_file, profile_mode):
+    # RunMetrics for a run, if there's a metrics file or profiling is on. Otherwise, None, so nothing is counted.
+    if metrics_file is None and profile_mode is None:
+        return None
+    return RunMetrics(operation, profile_mode)
+
+
+def finish_run_metrics(run_metrics, metrics_file):
+    if run_metrics is not None:
+        run_metrics.finish()
+        if metrics_file is not None:
+            run_metrics.write(metrics_file)
+
+
+def record_as_text(record):
+    # Text of a record in MARCMaker format, like str(record), with the raw field data decoded.
+    record_lines = ['=LDR  ' + str(record.leader)]
+    marc8 = record_is_marc8(record)
+    for field in record:
+        if field.is_control_field():
+            record_lines.append('=' + field.tag + '  ' + decode_marc_data(field.data, marc8).replace(' ', '\\'))
+        else:
+            indicators = ''.join('\\' if indicator in (' ', '\\') else indicator for indicator in field.indicators)
+            subfields = ''.join('$' + subfield[0] + decode_marc_data(subfield[1], marc8) for subfield in field)
+            record_lines.append('=' + field.tag + '  ' + indicators + subfields)
+    return '\n'.join(record_lines)
+
+
+def find_record_position(records_to_search, control_number):
+    # Position of the first record with the given 001 value. Returns None, if no record has it.
+    if isinstance(records_to_search, MarcRecordStore) and records_to_search.control_numbers is not None:
+        return records_to_search.position_of_control_number(control_number)
+    elif isinstance(records_to_search, MarcQueryClient):
+        return records_to_search.position_of_control_number(control_number)
+    for position, record in enumerate(records_to_search):
+        if record is not None:
+            for field in record.get_fields('001'):
+                if decode_marc_data(field.data) == control_number:
+                    return position
+    return None
+
+
+def user_entry_record_to_view(records_to_view):
+    # Get position of a loaded record from a record number or a control number (001).
+    record_position = None
+    record_entry_not_acceptable = True
+    while record_entry_not_acceptable:
+        print('Enter a record number from 1 to ' + str(len(records_to_view)) + ', '
+              'or a control number (001) starting with \"=\". Example: 15 or =ocm12345678')
+        print('Enter \":q\" to quit or \":s\" to skip.')
+        record_string = input('Record Number or =Control Number: ')
+        if record_string.lower() == ':q':
+            sys.exit()
+        elif record_string == ':s':
+            record_entry_not_acceptable = False
+        elif record_string[:1] == '=' and len(record_string) > 1:
+            record_position = find_record_position(records_to_view, record_string[1:])
+            if record_position is None:
+                print('ERROR: No record with that control number.')
+            else:
+                record_entry_not_acceptable = False
+        elif record_string.isnumeric() and 0 < int(record_string) <= len(records_to_view):
+            record_position = int(record_string) - 1
+            record_entry_not_acceptable = False
+        else:
+            print('ERROR: Invalid Entry. Enter a record number or =control number.')
+    return record_position
+
+
+class FieldInventory:
+    # Counts of the fields, subfields and indicator values used in a set of records: how often each is used, and in how
+    # many records. Fields and subfields are counted by tag and by tag + subfield code, e.g. 245 and 245a.
+    # Inventories of parts of a record set add up with merge(), e.g. chunks of a file taken in separate processes.
+    def __init__(self):
+        self.record_count = 0
+        self.field_occurrences = collections.Counter()
+        self.field_records = collections.Counter()
+        self.subfield_occurrences = collections.Counter()
+        self.subfield_records = collections.Counter()
+        # Occurrences of fields without subfields, e.g. 001-009 fields.
+        self.fields_without_subfields = collections.Counter()
+        # Counted by (tag, indicator number, indicator value).
+        self.indicator_values = collections.Counter()
+
+    def add_record(self, record):
+        # Records pymarc couldn't read are None. They have nothing to count.
+        # Counts for the record are collected in lists first, as Counter.update() counts a list in one call.
+        if record is None:
+            return
+        self.record_count += 1
+        field_tags = []
+        subfield_keys = []
+        fields_without_subfields = []
+        indicator_values = []
+        for field in record.fields:
+            field_tag = str(field.tag)
+            field_tags.append(field_tag)
+            # 001-009 fields have no subfields.
+            subfield_codes = [str(subfield_code) for subfield_code, subfield_data in field_subfields(field)
+                              if str(subfield_code)]
+            if subfield_codes:
+                subfield_keys.extend([field_tag + code for code in subfield_codes])
+            else:
+                fields_without_subfields.append(field_tag)
+            if not field.is_control_field():
+                for indicator_number, indicator in enumerate(field.indicators, 1):
+                    indicator_values.append((field_tag, indicator_number, str(indicator)))
+        self.field_occurrences.update(field_tags)
+        self.field_records.update(set(field_tags))
+        self.subfield_occurrences.update(subfield_keys)
+        self.subfield_records.update(set(subfield_keys))
+        self.fields_without_subfields.update(fields_without_subfields)
+        self.indicator_values.update(indicator_values)
+
+    def merge(self, other_field_inventory):
+        self.record_count += other_field_inventory.record_count
+        self.field_occurrences.update(other_field_inventory.field_occurrences)
+        self.field_records.update(other_field_inventory.field_records)
+        self.subfield_occurrences.update(other_field_inventory.subfield_occurrences)
+        self.subfield_records.update(other_field_inventory.subfield_records)
+        self.fields_without_subfields.update(other_field_inventory.fields_without_subfields)
+        self.indicator_values.update(other_field_inventory.indicator_values)
+
+    def as_dict(self):
+        # The counts as JSON types. Indicator values are listed as [tag, indicator number, value, occurrences].
+        return {'record_count': self.record_count, 'field_occurrences': dict(self.field_occurrences),
+                'field_records': dict(self.field_records), 'subfield_occurrences': dict(self.subfield_occurrences),
+                'subfield_records': dict(self.subfield_records),
+                'fields_without_subfields': dict(self.fields_without_subfields),
+                'indicator_values': [list(indicator_value) + [occurrences]
+                                     for indicator_value, occurrences in self.indicator_values.items()]}
+
+    @classmethod
+    def from_dict(cls, inventory_counts):
+        field_inventory = cls()
+        field_inventory.record_count = inventory_counts['record_count']
+        field_inventory.field_occurrences.update(inventory_counts['field_occurrences'])
+        field_inventory.field_records.update(inventory_counts['field_records'])
+        field_inventory.subfield_occurrences.update(inventory_counts['subfield_occurrences'])
+        field_inventory.subfield_records.update(inventory_counts['subfield_records'])
+        field_inventory.fields_without_subfields.update(inventory_counts['fields_without_subfields'])
+        for field_tag, indicator_number, indicator, occurrences in inventory_counts['indicator_values']:
+            field_inventory.indicator_values[(field_tag, indicator_number, indicator)] = occurrences
+        return field_inventory
+
+    def fields_and_subfields_used(self):
+        # Sorted tag + subfield codes used, e.g. 245a, and tags of fields used without subfields, e.g. 001.
+        return sorted(list(self.subfield_occurrences) + list(self.fields_without_subfields))
+
+    def subfield_codes_by_field(self):
+        # Subfield codes used in each field, sorted case insensitively, e.g. {'245': 'abc'}.
+        subfield_codes = {field_tag: [] for field_tag in self.field_occurrences}
+        for field_subfield in self.subfield_occurrences:
+            subfield_codes[field_subfield[:3]].append(field_subfield[3:])
+        return {field_tag: ''.join(sorted(codes, key=lambda code: (code.lower(), code)))
+                for field_tag, codes in subfield_codes.items()}
+
+
+def list_used_fields_and_subfields(records_to_search):
+    field_inventory = FieldInventory()
+    for record in records_to_search:
+        field_inventory.add_record(record)
+    return field_inventory.fields_and_subfields_used()
+
+
+def user_entry_marc_file_to_save():
+    # Get name of MARC record file to save.
+    marc_file_to_save = ''
+    file_name_not_acceptable = True
+    while file_name_not_acceptable:
+        print('File extension must be \".mrc\" or \".raw\". Extension .mrc assumed, if not supplied.')
+        print('Enter \":q\" to quit or \":s\" to skip saving a file.')
+        marc_file_to_save = input('MARC record(s) file path: ')
+        if marc_file_to_save.lower() == ':q':
+            # Break out of loop, if :q entered. What about main running loop? (Bad form? Just call sys.exit() ?)
+            # running = False
+            # file_name_not_acceptable = False
+            sys.exit()
+        elif marc_file_to_save == ':s':
+            file_name_not_acceptable = False
+        else:
+            try:
+                if marc_file_to_save[-4:] != '.mrc':
+                    marc_file_to_save += '.mrc'
+                    if glob.glob(marc_file_to_save):
+                        print('ERROR: File Already Exists. Enter a new file name.')
+                    else:
+                        file_name_not_acceptable = False
+                elif (marc_file_to_save[-4:].lower() == '.mrc') or (marc_file_to_save[-4:].lower() == '.raw'):
+                    if glob.glob(marc_file_to_save):
+                        print('ERROR: File Already Exists. Enter a new file name.')
+                    else:
+                        file_name_not_acceptable = False
+                else:
+                    pass
+            except OSError:
+                pass
+    return marc_file_to_save
+
+
+def merge_record_ranges(record_ranges):
+    # Join (offset, length) byte ranges of records that follow each other in the file, so a run of matching records
+    # is copied in one go.
+    merged_record_ranges = []
+    for record_offset, record_length in record_ranges:
+        if merged_record_ranges and merged_record_ranges[-1][0] + merged_record_ranges[-1][1] == record_offset:
+            merged_record_ranges[-1][1] += record_length
+        else:
+            merged_record_ranges.append([record_offset, record_length])
+    return merged_record_ranges
+
+
+def copy_file_ranges(input_fh, output_fh, file_ranges):
+    # Copy (offset, length) byte ranges of one file to the end of another. os.copy_file_range() copies inside the
+    # operating system, where there is one (Linux). Otherwise the bytes are copied in 1 MB blocks.
+    output_fh.flush()
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    for range_offset, range_length in file_ranges:
+        copied_length = 0
+        while use_copy_file_range and copied_length < range_length:
+            try:
+                length_copied_now = os.copy_file_range(input_fh.fileno(), output_fh.fileno(),
+                                                       range_length - copied_length, range_offset + copied_length)
+            except OSError:
+                # E.g. not supported by the file system. Copy the rest in blocks.
+                use_copy_file_range = False
+                break
+            if length_copied_now == 0:
+                break
+            copied_length += length_copied_now
+        if copied_length < range_length:
+            output_fh.seek(0, os.SEEK_END)
+            input_fh.seek(range_offset + copied_length)
+            while copied_length < range_length:
+                block = input_fh.read(min(range_length - copied_length, 1048576))
+                if not block:
+                    break
+                output_fh.write(block)
+                copied_length += len(block)
+            output_fh.flush()
+
+
+def save_record_positions(records_loaded, record_positions, marc_file_to_save, run_metrics=None):
+    # Save the loaded records at record_positions to a MARC file. The records are copied byte for byte from where they
+    # were loaded from, e.g. the record store's buffer, or the loaded file, if it hasn't changed since it was loaded.
+    # Records loaded some other way are written with pymarc.MARCWriter.
+    # The records and bytes saved are added to run_metrics.
+    # Records of a MARC Crucible server are saved by the server.
+    # A file that already exists is never overwritten. Raises FileExistsError instead.
+    if isinstance(records_loaded, MarcQueryClient):
+        bytes_saved = records_loaded.save(record_positions, marc_file_to_save)
+        if run_metrics is not None:
+            run_metrics.records += len(record_positions)
+            run_metrics.bytes += bytes_saved
+        return
+    with open(str(marc_file_to_save), 'xb') as output_fh:
+        if isinstance(records_loaded, MarcRecordStore):
+            with memoryview(records_loaded.buffer) as buffer_view:
+                for record_offset, record_length in merge_record_ranges(
+                        [records_loaded.record_byte_range(record_position) for record_position in record_positions]):
+                    output_fh.write(buffer_view[record_offset:record_offset + record_length])
+        elif isinstance(records_loaded, MarcRecordList) and records_loaded.marc_file_unchanged():
+            with open(records_loaded.marc_file, 'rb') as input_fh:
+                copy_file_ranges(input_fh, output_fh, merge_record_ranges(
+                    [records_loaded.record_byte_range(record_position) for record_position in record_positions]))
+        else:
+            writer = pymarc.MARCWriter(output_fh)
+            for record_position in record_positions:
+                writer.write(records_loaded[record_position])
+        if run_metrics is not None:
+            run_metrics.records += len(record_positions)
+            run_metrics.bytes += output_fh.tell()
+
+
+def save_matches_to_file(records_loaded, matching_record_positions, metrics_file=None, profile_mode=None):
+    # Get name of MARC record file to save.
+    marc_file_to_save = user_entry_marc_file_to_save()
+    # Save matching records in new MARC record file. Skip saving, if command :s was entered.
+    if marc_file_to_save == ':s':
+        pass
+    else:
+        run_metrics = start_run_metrics('save', metrics_file, profile_mode)
+        save_start_time = datetime.datetime.now()
+        try:
+            save_record_positions(records_loaded, matching_record_positions, marc_file_to_save, run_metrics)
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            # E.g. a MARC Crucible server refused the save file.
+            print('ERROR: ' + str(error))
+        save_end_time = datetime.datetime.now()
+        if run_metrics is not None:
+            run_metrics.details['marc_file'] = str(marc_file_to_save)
+        finish_run_metrics(run_metrics, metrics_file)
+        # Print to screen the time it took to save the record file.
+        save_time = str(format((save_end_time - save_start_time).total_seconds(), '.2f'))
+        print('Time to save record(s): ' + save_time + ' seconds')
+
+
+def read_batch_query_file(batch_query_file):
+    # Read a batch of searches from a CSV file. One search per row:
+    # Field/Subfield, Search Term, RegEx (Y/N), Whole Word (Y/N), Save File
+    # Rows starting with # are skipped, e.g. a header row. Whole Word isn't used in RegEx searches.
+    # Returns a list of (SearchQuery, save file) and a list of errors, one per row that isn't a valid search.
+    batch_queries = []
+    batch_errors = []
+    save_files = set()
+    with open(batch_query_file, 'r', encoding='utf-8-sig', newline='') as fh:
+        for row_number, row in enumerate(csv.reader(fh), 1):
+            if not ''.join(row).strip() or row[0].lstrip().startswith('#'):
+                continue
+            if len(row) != 5:
+                batch_errors.append('Row ' + str(row_number) + ': Expected 5 columns.')
+                continue
+            search_term = row[1]
+            field_subfield_string, reg_ex_flag, whole_word_flag, save_file = \
+                [column.strip() for column in (row[0], row[2], row[3], row[4])]
+            field_subfield_list = parse_field_subfield(field_subfield_string)
+            if save_file[-4:].lower() != '.mrc' and save_file[-4:].lower() != '.raw':
+                save_file += '.mrc'
+            if field_subfield_list is None:
+                batch_errors.append('Row ' + str(row_number) + ': Invalid Field/Subfield.')
+            elif not 0 < len(search_term) < 256:
+                batch_errors.append('Row ' + str(row_number) + ': Must provide a search term.')
+            elif reg_ex_flag.lower() not in ('y', 'yes', 'n', 'no') \
+                    or whole_word_flag.lower() not in ('y', 'yes', 'n', 'no'):
+                batch_errors.append('Row ' + str(row_number) + ': RegEx and Whole Word must be Yes or No.')
+            elif save_file == '.mrc':
+                batch_errors.append('Row ' + str(row_number) + ': Must provide a save file.')
+            elif glob.glob(save_file):
+                batch_errors.append('Row ' + str(row_number) + ': Save File Already Exists. Enter a new file name.')
+            elif os.path.abspath(save_file) in save_files:
+                batch_errors.append('Row ' + str(row_number) + ': Save File is used by another row.')
+            else:
+                try:
+                    search_query = SearchQuery(field_subfield_list, [search_term],
+                                               whole_word_flag.lower() in ('y', 'yes'),
+                                               reg_ex_flag.lower() in ('y', 'yes'))
+                except re.error:
+                    batch_errors.append('Row ' + str(row_number) + ': Invalid RegEx.')
+                    continue
+                save_files.add(os.path.abspath(save_file))
+                batch_queries.append((search_query, save_file))
+    return batch_queries, batch_errors
+
+
+def user_entry_batch_query_file():
+    # Get name of a batch query file. Returns the searches in it as a list of (SearchQuery, save file).
+    batch_queries = []
+    batch_query_file_not_acceptable = True
+    while batch_query_file_not_acceptable:
+        print('CSV file with one search per row: Field/Subfield, Search Term, RegEx (Y/N), Whole Word (Y/N), Save File')
+        print('Example row: 245a,cat,N,Y,cat_titles.mrc')
+        print('Rows starting with # are skipped.')
+        print('Enter \":q\" to quit.')
+        batch_query_file = input('Batch query file path: ')
+        if batch_query_file.lower() == ':q':
+            sys.exit()
+        else:
+            try:
+                batch_queries, batch_errors = read_batch_query_file(batch_query_file)
+                if batch_errors:
+                    for batch_error in batch_errors:
+                        print('ERROR: ' + batch_error)
+                elif batch_queries:
+                    print(str(len(batch_queries)) + ' search(es) loaded.')
+                    batch_query_file_not_acceptable = False
+                else:
+                    print('ERROR: No searches in file.')
+            except (OSError, UnicodeDecodeError, csv.Error):
+                print('ERROR: Invalid Filename. Does the file exist? Is it a UTF-8 CSV file?')
+    return batch_queries
+
+
+# Compressed MARC record files are read with these, by file extension.
+COMPRESSED_FILE_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def compressed_file_extension(marc_file):
+    # '.gz', '.bz2' or '.xz' for a compressed file. Otherwise, ''.
+    for file_extension in COMPRESSED_FILE_OPENERS:
+        if str(marc_file).lower().endswith(file_extension):
+            return file_extension
+    return ''
+
+
+# Record formats read besides MARC (ISO 2709), by file extension. See open_marc_file().
+CONVERTED_FILE_FORMATS = {'.xml': 'marcxml', '.jsonl': 'marc_in_json', '.json': 'marc_in_json'}
+
+
+def marc_file_format(marc_file):
+    # 'marcxml' or 'marc_in_json' for a file that's converted as it's read. Otherwise, 'marc'.
+    marc_file = str(marc_file).lower()
+    marc_file = marc_file[:len(marc_file) - len(compressed_file_extension(marc_file))]
+    for file_extension, file_format in CONVERTED_FILE_FORMATS.items():
+        if marc_file.endswith(file_extension):
+            return file_format
+    return 'marc'
+
+
+def marc_file_extension_acceptable(marc_file):
+    # True for .mrc, .raw, .xml, .jsonl and .json files, compressed or not, e.g. records.mrc.gz.
+    if marc_file_format(marc_file) != 'marc':
+        return True
+    marc_file = str(marc_file).lower()
+    marc_file = marc_file[:len(marc_file) - len(compressed_file_extension(marc_file))]
+    return marc_file[-4:] == '.mrc' or marc_file[-4:] == '.raw'
+
+
+def marc_input_files(marc_input):
+    # The MARC record files to read for marc_input: the file itself, the MARC record files in a directory, or the MARC
+    # record files a pattern such as exports/*.mrc.gz matches. Sorted by name, so the parts of a split file are read
+    # in order.
+    marc_input = str(marc_input)
+    if os.path.isdir(marc_input):
+        marc_files = [os.path.join(marc_input, file_name) for file_name in os.listdir(marc_input)]
+    elif glob.has_magic(marc_input):
+        marc_files = glob.glob(marc_input)
+    else:
+        return [marc_input]
+    return sorted(marc_file for marc_file in marc_files
+                  if os.path.isfile(marc_file) and marc_file_extension_acceptable(marc_file))
+
+
+def unique_marc_input_files(marc_inputs):
+    # The MARC record files to read for all of marc_inputs, each once, in the order they are first listed. An input
+    # listed twice, or a directory and a pattern that both take in a file, would otherwise read its records twice.
+    # An input with no MARC files is kept as it is, so opening it raises FileNotFoundError.
+    marc_files = {}
+    for marc_input in marc_inputs:
+        for marc_file in marc_input_files(marc_input) or [marc_input]:
+            marc_files.setdefault(os.path.realpath(marc_file), marc_file)
+    return list(marc_files.values())
+
+
+def marc_input_is_plain_file(marc_input):
+    # True for one uncompressed MARC file, which can be memory-mapped, sought in and split into chunks.
+    return os.path.isfile(str(marc_input)) and not compressed_file_extension(marc_input) \
+        and marc_file_format(marc_input) == 'marc'
+
+
+def open_marc_file(marc_file):
+    # Open one MARC record file for reading, decompressing it on the fly, if it's compressed. MARCXML and MARC-in-JSON
+    # files are read as MARC, converted one record at a time. See ConvertedMarcInput.
+    file_extension = compressed_file_extension(marc_file)
+    if file_extension:
+        fh = COMPRESSED_FILE_OPENERS[file_extension](str(marc_file), 'rb')
+    else:
+        fh = open(str(marc_file), 'rb')
+    file_format = marc_file_format(marc_file)
+    if file_format == 'marcxml':
+        return io.BufferedReader(ConvertedMarcInput(fh, marcxml_raw_records(fh, marc_file), marc_file), 1048576)
+    elif file_format == 'marc_in_json':
+        return io.BufferedReader(ConvertedMarcInput(fh, marc_in_json_raw_records(fh, marc_file), marc_file), 1048576)
+    return fh
+
+
+def raw_marc_record(leader, fields):
+    # ISO 2709 bytes of a record converted from MARCXML or MARC-in-JSON. fields are (tag, data) with the data as UTF-8
+    # bytes: the indicators and subfields of data fields, e.g. b'10\x1faTitle'. The data is UTF-8, so leader/09 is set
+    # to 'a'. The record length and base address in the leader are worked out from the fields.
+    # Raises ValueError, if a tag isn't 3 characters, or the record doesn't fit in ISO 2709.
+    directory = []
+    field_data = []
+    field_offset = 0
+    for field_tag, data in fields:
+        tag_bytes = str(field_tag).encode('ascii')
+        if len(tag_bytes) != 3:
+            raise ValueError('Invalid tag: ' + str(field_tag))
+        if len(data) + 1 > 9999:
+            raise ValueError('Field ' + str(field_tag) + ' is longer than 9,999 bytes.')
+        directory.append(b'%s%04d%05d' % (tag_bytes, len(data) + 1, field_offset))
+        field_data.append(data + b'\x1e')
+        field_offset += len(data) + 1
+    base_address = 24 + 12 * len(directory) + 1
+    record_length = base_address + field_offset + 1
+    if record_length > 99999:
+        raise ValueError('Record is longer than 99,999 bytes.')
+    leader = (str(leader) + ' ' * 24)[:24]
+    leader = '%05d' % record_length + leader[5:9] + 'a' + leader[10:12] + '%05d' % base_address + leader[17:]
+    return leader.encode('ascii', 'replace') + b''.join(directory) + b'\x1e' + b''.join(field_data) + b'\x1d'
+
+
+def skipped_record_warning(marc_file, record_number, error):
+    # Records that can't be converted are skipped, as pymarc.MARCReader skips records it can't read.
+    sys.stderr.write('Skipped record ' + str(record_number) + ' of ' + str(marc_file) + ': ' + str(error) + '\n')
+
+
+# MARCXML elements are in this namespace, or in no namespace.
+MARCXML_NAMESPACE = '{http://www.loc.gov/MARC21/slim}'
+
+
+def marcxml_element_name(element):
+    # Name of a MARCXML element, e.g. 'record', or '' for elements that aren't MARCXML.
+    if element.tag.startswith(MARCXML_NAMESPACE):
+        return element.tag[len(MARCXML_NAMESPACE):]
+    elif element.tag.startswith('{'):
+        return ''
+    return element.tag
+
+
+def marcxml_raw_records(fh, marc_file=''):
+    # ISO 2709 bytes of each record in a MARCXML file, read with iterparse. Each record is cleared from the tree once
+    # it's converted, so memory use stays at one record, however big the file is.
+    # Raises xml.etree.ElementTree.ParseError, if the file isn't well-formed XML.
+    root_element = None
+    record_number = 0
+    for event, element in xml.etree.ElementTree.iterparse(fh, events=('start', 'end')):
+        if root_element is None:
+            root_element = element
+        if event == 'end' and marcxml_element_name(element) == 'record':
+            record_number += 1
+            leader = ''
+            fields = []
+            try:
+                for field_element in element:
+                    element_name = marcxml_element_name(field_element)
+                    if element_name == 'leader':
+                        leader = field_element.text or ''
+                    elif element_name == 'controlfield':
+                        fields.append((field_element.get('tag', ''), (field_element.text or '').encode('utf-8')))
+                    elif element_name == 'datafield':
+                        field_data = [((field_element.get('ind1') or ' ')[:1]
+                                       + (field_element.get('ind2') or ' ')[:1]).encode('utf-8')]
+                        for subfield_element in field_element:
+                            if marcxml_element_name(subfield_element) == 'subfield':
+                                field_data.append(b'\x1f' + subfield_element.get('code', '').encode('utf-8')
+                                                  + (subfield_element.text or '').encode('utf-8'))
+                        fields.append((field_element.get('tag', ''), b''.join(field_data)))
+                raw_record = raw_marc_record(leader, fields)
+            except ValueError as error:
+                skipped_record_warning(marc_file, record_number, error)
+                raw_record = None
+            # Clearing the root drops the records converted so far, which iterparse would otherwise keep.
+            element.clear()
+            root_element.clear()
+            if raw_record is not None:
+                yield raw_record
+
+
+def marc_in_json_raw_records(fh, marc_file=''):
+    # ISO 2709 bytes of each record in a MARC-in-JSON lines file: one JSON record per line, e.g.
+    # {"leader": "...", "fields": [{"001": "..."}, {"245": {"ind1": "1", "ind2": "0", "subfields": [{"a": "..."}]}}]}
+    # Blank lines are skipped.
+    record_number = 0
+    for line in fh:
+        if not line.strip():
+            continue
+        record_number += 1
+        try:
+            json_record = json.loads(line)
+            fields = []
+            for json_field in json_record.get('fields', []):
+                for field_tag, field_value in json_field.items():
+                    if isinstance(field_value, dict):
+                        field_data = [((str(field_value.get('ind1') or ' ') + ' ')[:1]
+                                       + (str(field_value.get('ind2') or ' ') + ' ')[:1]).encode('utf-8')]
+                        for json_subfield in field_value.get('subfields', []):
+                            for subfield_code, subfield_value in json_subfield.items():
+                                field_data.append(b'\x1f' + str(subfield_code).encode('utf-8')
+                                                  + str(subfield_value).encode('utf-8'))
+                        fields.append((field_tag, b''.join(field_data)))
+                    else:
+                        fields.append((field_tag, str(field_value).encode('utf-8')))
+            raw_record = raw_marc_record(json_record.get('leader', ''), fields)
+        except (ValueError, AttributeError, TypeError) as error:
+            skipped_record_warning(marc_file, record_number, error)
+            continue
+        yield raw_record
+
+
+class ConvertedMarcInput(io.RawIOBase):
+    # MARCXML or MARC-in-JSON read as a MARC record file: the ISO 2709 bytes of records converted one at a time, as they
+    # are read. Everything that reads MARC record files reads these too, and no converted file is written.
+    # Use it through open_marc_file().
+    def __init__(self, source_fh, raw_records, marc_file=''):
+        super().__init__()
+        self.source_fh = source_fh
+        self.raw_records = raw_records
+        self.marc_file = str(marc_file)
+        self.current_record = memoryview(b'')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.current_record:
+            try:
+                raw_record = next(self.raw_records, None)
+            except xml.etree.ElementTree.ParseError as error:
+                raise OSError('Invalid MARCXML in ' + self.marc_file + ': ' + str(error)) from error
+            if raw_record is None:
+                return 0
+            self.current_record = memoryview(raw_record)
+        byte_count = min(len(buffer), len(self.current_record))
+        buffer[:byte_count] = self.current_record[:byte_count]
+        self.current_record = self.current_record[byte_count:]
+        self.position += byte_count
+        return byte_count
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.source_fh.close()
+        super().close()
+
+
+class ReadAheadMarcInput(io.RawIOBase):
+    # MARC record files read one after the other as one stream of bytes, e.g. the compressed parts of a split export.
+    # A background thread reads and decompresses the files in 1 MB blocks, up to read_ahead_blocks blocks ahead of the
+    # records being parsed and searched. gzip, bzip2 and xz decompress without holding the GIL, so reading and
+    # decompressing overlap with the work on the records. Use it through open_marc_input().
+    def __init__(self, marc_files, read_ahead_blocks=8):
+        super().__init__()
+        self.blocks = queue.Queue(read_ahead_blocks)
+        self.stop_reading = threading.Event()
+        self.read_error = None
+        self.current_block = memoryview(b'')
+        self.position = 0
+        self.finished = False
+        self.reader_thread = threading.Thread(target=self.read_marc_files, args=(list(marc_files),), daemon=True)
+        self.reader_thread.start()
+
+    def read_marc_files(self, marc_files):
+        # Runs in the background thread. None after the last block marks the end of the stream.
+        try:
+            for marc_file in marc_files:
+                with open_marc_file(marc_file) as fh:
+                    while not self.stop_reading.is_set():
+                        block = fh.read(1048576)
+                        if not block:
+                            break
+                        self.put_block(block)
+        except (OSError, EOFError, lzma.LZMAError, zlib.error) as error:
+            # Errors are raised in the reading thread, when it gets to the end of the blocks that were read.
+            self.read_error = error
+        finally:
+            self.put_block(None)
+
+    def put_block(self, block):
+        # Wait for room in the queue, unless the stream is closed while waiting.
+        while not self.stop_reading.is_set():
+            try:
+                self.blocks.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.current_block:
+            if self.finished:
+                return 0
+            block = self.blocks.get()
+            if block is None:
+                self.finished = True
+                if self.read_error is not None:
+                    raise OSError('Unable to read the MARC file(s): ' + str(self.read_error)) from self.read_error
+                return 0
+            self.current_block = memoryview(block)
+        byte_count = min(len(buffer), len(self.current_block))
+        buffer[:byte_count] = self.current_block[:byte_count]
+        self.current_block = self.current_block[byte_count:]
+        self.position += byte_count
+        return byte_count
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.stop_reading.set()
+            self.reader_thread.join()
+        super().close()
+
+
+def open_marc_input(marc_input):
+    # Open marc_input for reading as one file. See marc_input_files(). One uncompressed file is opened as it is.
+    # Anything else is read through a ReadAheadMarcInput. File positions (tell()) count the bytes read, after
+    # decompressing.
+    if marc_input_is_plain_file(marc_input):
+        return open(str(marc_input), 'rb')
+    marc_files = marc_input_files(marc_input)
+    if not marc_files or not all(os.path.isfile(marc_file) for marc_file in marc_files):
+        raise FileNotFoundError('No MARC files found: ' + str(marc_input))
+    return io.BufferedReader(ReadAheadMarcInput(marc_files), 1048576)
+
+
+def read_raw_marc_records(fh):
+    # Read records from a MARC record file as raw bytes without parsing them.
+    # Records are split on the 5 digit record length, the same way pymarc.MARCReader splits them.
+    while True:
+        first5 = fh.read(5)
+        if not first5:
+            break
+        try:
+            record_length = int(first5)
+        except ValueError:
+            # Not a record length. Hand back the bytes, so the record is counted and fails to parse.
+            yield first5
+            continue
+        yield first5 + fh.read(max(record_length - 5, 0))
+
+
+def marc_record_from_raw(raw_record):
+    # Build a pymarc record from raw record bytes. Returns None for records pymarc.MARCReader would skip.
+    if raw_record[-1:] != b'\x1d':
+        return None
+    try:
+        return pymarc.Record(raw_record, to_unicode=False, force_utf8=False, hide_utf8_warnings=True,
+                             utf8_handling='strict')
+    except Exception:
+        # pymarc.MARCReader returns None for any record it can't parse. Do the same.
+        return None
+
+
+def raw_record_directory(raw_record):
+    # Read the directory of a raw record. Returns a (tag, start, end) tuple for each field, where start and end
+    # are the positions of the field data in raw_record. The field terminator is left out, like pymarc does.
+    directory_entries = []
+    base_address = int(raw_record[12:17])
+    for entry_start in range(24, base_address - 12, 12):
+        field_tag = raw_record[entry_start:entry_start + 3]
+        field_length = int(raw_record[entry_start + 3:entry_start + 7])
+        field_start = base_address + int(raw_record[entry_start + 7:entry_start + 12])
+        directory_entries.append((field_tag, field_start, field_start + field_length - 1))
+    return directory_entries
+
+
+# Record index sidecar file layout: magic, then file size, file mtime (ns), record count and whether control numbers
+# are included. Then the record offsets (8 bytes each), the record lengths (4 bytes each) and, when included, the
+# 001 values joined by field terminators.
+RECORD_INDEX_MAGIC = b'MCRIDX01'
+RECORD_INDEX_HEADER = struct.Struct('<8sQqQ?')
+
+
+def record_index_file_name(marc_file):
+    return str(marc_file) + '.mcidx'
+
+
+def build_record_index(marc_file_buffer, index_control_numbers):
+    # Find the byte offset and length of every record in a MARC record file buffer (a memory map or file handle).
+    # Records are split the same way read_raw_marc_records() splits them.
+    record_offsets = array.array('Q')
+    record_lengths = array.array('I')
+    control_numbers = [] if index_control_numbers else None
+    record_offset = 0
+    marc_file_buffer.seek(0)
+    for raw_record in read_raw_marc_records(marc_file_buffer):
+        record_offsets.append(record_offset)
+        record_lengths.append(len(raw_record))
+        record_offset += len(raw_record)
+        if index_control_numbers:
+            control_number = b''
+            try:
+                for field_tag, field_start, field_end in raw_record_directory(raw_record):
+                    if field_tag == b'001':
+                        control_number = raw_record[field_start:field_end]
+                        break
+            except ValueError:
+                pass
+            control_numbers.append(control_number)
+    return record_offsets, record_lengths, control_numbers
+
+
+def save_record_index(marc_file, file_size, file_mtime, record_offsets, record_lengths, control_numbers):
+    try:
+        with open(record_index_file_name(marc_file), 'wb') as fh:
+            fh.write(RECORD_INDEX_HEADER.pack(RECORD_INDEX_MAGIC, file_size, file_mtime, len(record_offsets),
+                                              control_numbers is not None))
+            fh.write(record_offsets.tobytes())
+            fh.write(record_lengths.tobytes())
+            if control_numbers is not None:
+                fh.write(b'\x1e'.join(control_numbers))
+    except OSError:
+        # The index only saves time. Loading works without it, e.g. when the folder is read only.
+        pass
+
+
+def open_record_index(marc_file, file_size, file_mtime, index_control_numbers):
+    # Read the record index sidecar file. Returns None, if there is no index for this version of the file.
+    try:
+        with open(record_index_file_name(marc_file), 'rb') as fh:
+            index_header = fh.read(RECORD_INDEX_HEADER.size)
+            if len(index_header) != RECORD_INDEX_HEADER.size:
+                return None
+            magic, index_file_size, index_file_mtime, record_count, has_control_numbers = \
+                RECORD_INDEX_HEADER.unpack(index_header)
+            if magic != RECORD_INDEX_MAGIC or index_file_size != file_size or index_file_mtime != file_mtime \
+                    or (index_control_numbers and not has_control_numbers):
+                return None
+            record_offsets = array.array('Q')
+            record_offsets.frombytes(fh.read(record_count * record_offsets.itemsize))
+            record_lengths = array.array('I')
+            record_lengths.frombytes(fh.read(record_count * record_lengths.itemsize))
+            control_numbers = None
+            if has_control_numbers:
+                control_numbers = fh.read().split(b'\x1e') if record_count else []
+            if len(record_offsets) != record_count or len(record_lengths) != record_count \
+                    or (control_numbers is not None and len(control_numbers) != record_count):
+                return None
+            return record_offsets, record_lengths, control_numbers
+    except (OSError, ValueError):
+        return None
+
+
+class MarcRecordList(list):
+    # Records of a MARC record file parsed with pymarc.MARCReader, with where each record is in the file, so matching
+    # records can be saved by copying their bytes. See save_record_positions().
+    def __init__(self, marc_file):
+        super().__init__()
+        self.marc_file = str(marc_file)
+        # Records read from compressed files, directories or patterns can't be copied from the file.
+        if marc_input_is_plain_file(self.marc_file):
+            file_stat = os.stat(self.marc_file)
+            self.file_size = file_stat.st_size
+            self.file_mtime = file_stat.st_mtime_ns
+        else:
+            self.file_size = None
+            self.file_mtime = None
+        self.record_offsets = array.array('Q')
+        self.record_lengths = array.array('I')
+
+    def append_record(self, record, record_offset, record_length):
+        self.append(record)
+        self.record_offsets.append(record_offset)
+        self.record_lengths.append(record_length)
+
+    def record_byte_range(self, position):
+        return self.record_offsets[position], self.record_lengths[position]
+
+    def marc_file_unchanged(self):
+        # True, if the file still is the file the records were loaded from.
+        if self.file_size is None:
+            return False
+        try:
+            file_stat = os.stat(self.marc_file)
+        except OSError:
+            return False
+        return file_stat.st_size == self.file_size and file_stat.st_mtime_ns == self.file_mtime \
+            and len(self.record_offsets) == len(self)
+
+
+class MarcRecordStore:
+    # Records of a MARC record file read through a memory map. Only the offset and length of each record are kept.
+    # Records are parsed into pymarc records when they are used, so loading and counting cost almost nothing.
+    # Works like the list of records load_records() builds: len(), indexing and iterating. Records that can't be
+    # parsed come back as None, as they do from pymarc.MARCReader.
+    def __init__(self, marc_file, index_control_numbers=False):
+        self.marc_file = str(marc_file)
+        self.file_handle = open(self.marc_file, 'rb')
+        try:
+            file_stat = os.fstat(self.file_handle.fileno())
+            self.buffer = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.file_handle.close()
+            raise
+        record_index = open_record_index(self.marc_file, file_stat.st_size, file_stat.st_mtime_ns,
+                                         index_control_numbers)
+        if record_index is None:
+            record_index = build_record_index(self.buffer, index_control_numbers)
+            save_record_index(self.marc_file, file_stat.st_size, file_stat.st_mtime_ns, *record_index)
+        self.record_offsets, self.record_lengths, self.control_numbers = record_index
+        self.control_number_positions = None
+
+    def __len__(self):
+        return len(self.record_offsets)
+
+    def __getitem__(self, position):
+        return marc_record_from_raw(self.raw_record(position))
+
+    def __iter__(self):
+        for position in range(len(self.record_offsets)):
+            yield self[position]
+
+    def raw_record(self, position):
+        record_offset = self.record_offsets[position]
+        return self.buffer[record_offset:record_offset + self.record_lengths[position]]
+
+    def record_byte_range(self, position):
+        return self.record_offsets[position], self.record_lengths[position]
+
+    def record_directory(self, position):
+        # Directory entries of a record, if the store indexes fields. See CompactMarcRecordStore.
+        return None
+
+    def positions_with_field(self, field_tag):
+        # Positions of the records that may have a field with this tag. Every record, unless the store indexes fields.
+        return range(len(self.record_offsets))
+
+    def position_of_control_number(self, control_number):
+        # Position of the first record with this 001 value. Returns None, if no record has it.
+        if self.control_numbers is None:
+            return None
+        if self.control_number_positions is None:
+            self.control_number_positions = {}
+            for position, record_control_number in enumerate(self.control_numbers):
+                self.control_number_positions.setdefault(record_control_number, position)
+        return self.control_number_positions.get(control_number.encode('utf-8'))
+
+    def close(self):
+        self.buffer.close()
+        self.file_handle.close()
+
+
+class CompactMarcRecordStore(MarcRecordStore):
+    # Records of a MARC record file kept in memory as the raw bytes of the file, with the directory of every record
+    # in arrays: the tags of all fields in one bytes buffer (3 bytes each), and where each field's data starts and
+    # ends in its record. field_starts holds the number of the first field of each record, plus the field count.
+    # That's about 11 bytes per field on top of the file size, where a pymarc record takes several hundred bytes per
+    # field. Records are parsed into pymarc records when they are used.
+    # Searching uses the directory arrays instead of reading each record's directory, and only looks at the records
+    # with the field being searched. Control numbers (001) are indexed too.
+    def __init__(self, marc_file):
+        self.marc_file = str(marc_file)
+        with open_marc_input(self.marc_file) as fh:
+            self.buffer = fh.read()
+        self.record_offsets, self.record_lengths, self.control_numbers = build_record_index(io.BytesIO(self.buffer),
+                                                                                           True)
+        self.control_number_positions = None
+        self.field_starts = array.array('Q', [0])
+        self.field_tags = bytearray()
+        self.field_data_starts = array.array('I')
+        self.field_data_ends = array.array('I')
+        # Positions of records with directories that couldn't be read. They are searched without the arrays.
+        self.positions_without_directory = set()
+        for position in range(len(self.record_offsets)):
+            try:
+                directory_entries = raw_record_directory(self.raw_record(position))
+            except ValueError:
+                directory_entries = []
+                self.positions_without_directory.add(position)
+            # Directory entries that don't fit the arrays, e.g. cut short by the base address, are left for the
+            # search to read from the record itself.
+            if any(len(field_tag) != 3 or not 0 <= field_start < 4294967296 or not 0 <= field_end < 4294967296
+                   for field_tag, field_start, field_end in directory_entries):
+                directory_entries = []
+                self.positions_without_directory.add(position)
+            for field_tag, field_start, field_end in directory_entries:
+                self.field_tags += field_tag
+                self.field_data_starts.append(field_start)
+                self.field_data_ends.append(field_end)
+            self.field_starts.append(len(self.field_data_starts))
+
+    def record_directory(self, position):
+        if position in self.positions_without_directory:
+            return None
+        first_field = self.field_starts[position]
+        field_tags = self.field_tags
+        field_data_starts = self.field_data_starts
+        field_data_ends = self.field_data_ends
+        return [(bytes(field_tags[field_number * 3:field_number * 3 + 3]), field_data_starts[field_number],
+                 field_data_ends[field_number]) for field_number in range(first_field, self.field_starts[position + 1])]
+
+    def positions_with_field(self, field_tag):
+        # Found by looking for the tag in the buffer of all tags, so records without the field cost nothing.
+        record_positions = sorted(self.positions_without_directory)
+        try:
+            search_tag = str(field_tag).encode('ascii')
+        except UnicodeEncodeError:
+            return range(len(self.record_offsets))
+        if len(search_tag) != 3:
+            return range(len(self.record_offsets))
+        tag_position = self.field_tags.find(search_tag)
+        while tag_position >= 0:
+            if tag_position % 3:
+                # Found across two tags. Look again from the next byte.
+                tag_position = self.field_tags.find(search_tag, tag_position + 1)
+                continue
+            record_position = bisect.bisect_right(self.field_starts, tag_position // 3) - 1
+            record_positions.append(record_position)
+            # Look again from the record's next field. A record is only listed once.
+            tag_position = self.field_tags.find(search_tag, self.field_starts[record_position + 1] * 3)
+        return sorted(set(record_positions))
+
+    def close(self):
+        self.buffer = b''
+
+
+# Term index sidecar file layout: magic, then a marshal dump of file size, file mtime (ns), record count, field keys
+# and postings. Postings map each word to the bytes of an array('Q') of record position * 65536 + field key number.
+TERM_INDEX_MAGIC = b'MCTIDX01'
+
+
+def term_index_file_name(marc_file):
+    return str(marc_file) + '.mcterms'
+
+
+def whole_word_index_words(subfield_data):
+    # Every word a whole word search can match in subfield_data: words split at whitespace, at whitespace and
+    # punctuation, and at whitespace, punctuation and digits.
+    index_words = set(subfield_data.split())
+    index_words.update(subfield_data.translate(WHOLE_WORD_ALPHANUMERIC_TABLE).split())
+    index_words.update(subfield_data.translate(WHOLE_WORD_ALPHABETIC_TABLE).split())
+    return index_words
+
+
+def term_index_can_answer(field_subfield_to_search, search_by_whole_word):
+    # The term index holds subfield words, so it answers whole word searches that only look at subfields.
+    return SearchQuery(field_subfield_to_search, [], search_by_whole_word).term_index_can_answer
+
+
+class TermIndex:
+    # Inverted index of the words in the subfields of loaded records for whole word searches.
+    # Records the index finds are only candidates. They are checked with SearchQuery.record_matches(), so searching with
+    # the index finds the same records as searching every record.
+    def __init__(self):
+        self.record_count = 0
+        self.field_keys = []
+        self.field_key_numbers = {}
+        self.postings = {}
+
+    def add_record(self, record_position, record):
+        self.record_count = max(self.record_count, record_position + 1)
+        if record is None:
+            return
+        record_postings = set()
+        decoded_fields = decode_record_fields(record)
+        for field_position, field in enumerate(record):
+            # 001-009 fields have no subfields.
+            for subfield_position, subfield in enumerate(field):
+                field_key = str(field.tag) + str(subfield[0])
+                field_key_number = self.field_key_numbers.get(field_key)
+                if field_key_number is None:
+                    field_key_number = len(self.field_keys)
+                    self.field_keys.append(field_key)
+                    self.field_key_numbers[field_key] = field_key_number
+                posting = record_position * 65536 + field_key_number
+                for word in whole_word_index_words(decoded_fields[field_position][subfield_position]):
+                    record_postings.add((word, posting))
+        for word, posting in record_postings:
+            word_postings = self.postings.get(word)
+            if word_postings is None:
+                word_postings = self.postings[word] = array.array('Q')
+            word_postings.append(posting)
+
+    def candidate_record_positions(self, search_query):
+        # Sorted positions of the records with one of the search terms in the field and subfield being searched.
+        matching_field_key_numbers = set()
+        for field_key_number, field_key in enumerate(self.field_keys):
+            if (search_query.search_tags is None or field_key[:3] in search_query.search_tags) \
+                    and search_query.subfield_code_matches(field_key[3:]):
+                matching_field_key_numbers.add(field_key_number)
+        record_positions = set()
+        for search_term in search_query.search_terms:
+            # Search terms with whitespace match as a phrase, so the records with every word of the phrase may match.
+            search_term_record_positions = None
+            for search_word in search_term.split():
+                search_word_record_positions = {posting // 65536 for posting in self.postings.get(search_word, ())
+                                                if posting % 65536 in matching_field_key_numbers}
+                if search_term_record_positions is None:
+                    search_term_record_positions = search_word_record_positions
+                else:
+                    search_term_record_positions &= search_word_record_positions
+            record_positions.update(search_term_record_positions or ())
+        return sorted(record_positions)
+
+    def save(self, term_index_file, file_size, file_mtime):
+        try:
+            with open(term_index_file, 'wb') as fh:
+                fh.write(TERM_INDEX_MAGIC)
+                marshal.dump((file_size, file_mtime, self.record_count, self.field_keys,
+                              {word: word_postings.tobytes() for word, word_postings in self.postings.items()}), fh)
+        except OSError:
+            # The index only saves time. Searching works without the file, e.g. when the folder is read only.
+            pass
+
+    @classmethod
+    def open(cls, term_index_file, file_size, file_mtime, record_count):
+        # Read a saved term index. Returns None, if there is no index for this version of the file.
+        try:
+            with open(term_index_file, 'rb') as fh:
+                if fh.read(len(TERM_INDEX_MAGIC)) != TERM_INDEX_MAGIC:
+                    return None
+                index_file_size, index_file_mtime, index_record_count, field_keys, postings = marshal.load(fh)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if index_file_size != file_size or index_file_mtime != file_mtime or index_record_count != record_count:
+            return None
+        term_index = cls()
+        term_index.record_count = index_record_count
+        term_index.field_keys = field_keys
+        term_index.field_key_numbers = {field_key: number for number, field_key in enumerate(field_keys)}
+        for word, word_postings_as_bytes in postings.items():
+            word_postings = term_index.postings[word] = array.array('Q')
+            word_postings.frombytes(word_postings_as_bytes)
+        return term_index
+
+
+def open_term_index(records_to_index, marc_file):
+    # Term index of the loaded records. The index saved next to the MARC file is used, if the file hasn't changed.
+    # Otherwise, the index is built and saved for next time.
+    try:
+        if not os.path.isfile(str(marc_file)):
+            # Directories and patterns have no file to keep the index next to.
+            raise FileNotFoundError(str(marc_file))
+        file_stat = os.stat(str(marc_file))
+        term_index = TermIndex.open(term_index_file_name(marc_file), file_stat.st_size, file_stat.st_mtime_ns,
+                                    len(records_to_index))
+    except OSError:
+        file_stat = None
+        term_index = None
+    if term_index is None:
+        term_index = TermIndex()
+        for record_position, record in enumerate(records_to_index):
+            term_index.add_record(record_position, record)
+        term_index.record_count = len(records_to_index)
+        if file_stat is not None:
+            term_index.save(term_index_file_name(marc_file), file_stat.st_size, file_stat.st_mtime_ns)
+    return term_index
+
+
+# Session cache sidecar file layout: the SESSION_CACHE_HEADER (magic, file size, file mtime (ns), content hash
+# (BLAKE2b), record count, field count, control numbers length and session data length), then the arrays of a
+# CompactMarcRecordStore of the file: record offsets, record lengths, field starts, field data starts and ends, and
+# field tags, then the control numbers (001) joined by 0x1E, a marshal dump of the session data (records without a
+# directory, the field inventory counts, and the result sets as descriptions and bitmap bytes), and last the raw
+# records. Record offsets are positions in the session cache file, so the file is memory-mapped and used as the
+# record store's buffer as it is. See SessionRecordStore.
+SESSION_CACHE_MAGIC = b'MCSESS02'
+SESSION_CACHE_HEADER = struct.Struct('<8sQq16sQQQQ')
+
+
+def session_cache_file_name(marc_file):
+    return str(marc_file) + '.mcsession'
+
+
+def marc_file_content_hash(marc_file):
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(str(marc_file), 'rb') as fh:
+        for block in iter(lambda: fh.read(1048576), b''):
+            content_hash.update(block)
+    return content_hash.digest()
+
+
+class SessionRecordStore(CompactMarcRecordStore):
+    # Records of a session resumed from a session cache file, read through a memory map of the file. The file holds
+    # the raw records and directory arrays of a CompactMarcRecordStore, so resuming a session only copies the arrays,
+    # and records are parsed when they are used, like in any record store. The arrays are read by SessionCache.open().
+    def __init__(self, marc_file, session_cache_file):
+        # Raises OSError or ValueError, if the session cache file can't be memory-mapped, e.g. it's empty.
+        self.marc_file = str(marc_file)
+        self.file_handle = open(str(session_cache_file), 'rb')
+        try:
+            self.buffer = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.file_handle.close()
+            raise
+        # Size, mtime and content hash of the MARC file the session was saved for.
+        self.file_size = None
+        self.file_mtime = None
+        self.content_hash = None
+        self.record_offsets = array.array('Q')
+        self.record_lengths = array.array('I')
+        self.control_numbers = []
+        self.control_number_positions = None
+        self.field_starts = array.array('Q')
+        self.field_tags = b''
+        self.field_data_starts = array.array('I')
+        self.field_data_ends = array.array('I')
+        self.positions_without_directory = set()
+
+    def marc_file_unchanged(self):
+        # True, if the MARC file still is the file the session was saved for.
+        try:
+            file_stat = os.stat(self.marc_file)
+        except OSError:
+            return False
+        return file_stat.st_size == self.file_size and file_stat.st_mtime_ns == self.file_mtime
+
+    def close(self):
+        self.buffer.close()
+        self.file_handle.close()
+
+
+class SessionCache:
+    # Records loaded in 'records' load mode, and what searching them found, saved next to the MARC file, so the next
+    # session on the same file starts where this one stopped without parsing the file again. The cache is only used,
+    # if the file's size, mtime and content are the same as when it was saved. A resumed session's records are a
+    # SessionRecordStore, which is saved again at the end of the session.
+    def __init__(self, records_loaded, field_inventory, result_sets):
+        self.records_loaded = records_loaded
+        self.field_inventory = field_inventory
+        self.result_sets = result_sets
+
+    def save(self):
+        # Returns True, if the session was saved. Records loaded in 'records' load mode are saved from a
+        # CompactMarcRecordStore of the file, which reads the file again. Other record stores, and records read from
+        # compressed files, directories or patterns, aren't saved.
+        # The session is written to a new file, which then replaces the old one, as a resumed session is still
+        # reading the old one.
+        records_loaded = self.records_loaded
+        session_cache_file = session_cache_file_name(records_loaded.marc_file)
+        try:
+            if isinstance(records_loaded, SessionRecordStore):
+                if not records_loaded.marc_file_unchanged():
+                    return False
+                session_store = records_loaded
+                content_hash = records_loaded.content_hash
+            elif isinstance(records_loaded, MarcRecordList) and records_loaded.marc_file_unchanged():
+                session_store = CompactMarcRecordStore(records_loaded.marc_file)
+                # The file is only saved, if it still splits into the records that were loaded.
+                if session_store.record_offsets != records_loaded.record_offsets \
+                        or session_store.record_lengths != records_loaded.record_lengths:
+                    return False
+                content_hash = hashlib.blake2b(session_store.buffer, digest_size=16).digest()
+            else:
+                return False
+            if self.field_inventory is None:
+                inventory_counts = None
+            else:
+                inventory_counts = {name: counts if name == 'record_count' else dict(counts)
+                                    for name, counts in vars(self.field_inventory).items()}
+            control_numbers = b'\x1e'.join(session_store.control_numbers)
+            session_data = marshal.dumps((sorted(session_store.positions_without_directory), inventory_counts,
+                                          [(result_set.description,
+                                            result_set.bitmap.to_bytes((result_set.record_count + 7) // 8, 'little'))
+                                           for result_set in self.result_sets]))
+            record_count = len(session_store.record_offsets)
+            field_count = len(session_store.field_data_starts)
+            # The records of a record store are in file order, one after the other.
+            records_start = session_store.record_offsets[0] if record_count else 0
+            records_end = session_store.record_offsets[-1] + session_store.record_lengths[-1] if record_count else 0
+            session_records_start = (SESSION_CACHE_HEADER.size + record_count * 12 + (record_count + 1) * 8
+                                     + field_count * 11 + len(control_numbers) + len(session_data))
+            record_offsets = array.array('Q', [record_offset - records_start + session_records_start
+                                               for record_offset in session_store.record_offsets])
+            with open(session_cache_file + '.tmp', 'wb') as fh:
+                fh.write(SESSION_CACHE_HEADER.pack(SESSION_CACHE_MAGIC, records_loaded.file_size,
+                                                   records_loaded.file_mtime, content_hash, record_count, field_count,
+                                                   len(control_numbers), len(session_data)))
+                fh.write(record_offsets.tobytes())
+                fh.write(session_store.record_lengths.tobytes())
+                fh.write(session_store.field_starts.tobytes())
+                fh.write(session_store.field_data_starts.tobytes())
+                fh.write(session_store.field_data_ends.tobytes())
+                fh.write(session_store.field_tags)
+                fh.write(control_numbers)
+                fh.write(session_data)
+                with memoryview(session_store.buffer) as buffer_view:
+                    fh.write(buffer_view[records_start:records_end])
+            os.replace(session_cache_file + '.tmp', session_cache_file)
+        except (OSError, ValueError):
+            # The cache only saves time. Loading works without the file, e.g. when the folder is read only.
+            # ValueError is raised for data marshal can't save. A file cut short by either is removed.
+            try:
+                os.remove(session_cache_file + '.tmp')
+            except OSError:
+                pass
+            return False
+        return True
+
+    @classmethod
+    def open(cls, marc_file):
+        # Read the session saved for a MARC file. Returns None, if there is no session for this version of the file.
+        if not marc_input_is_plain_file(marc_file):
+            return None
+        try:
+            file_stat = os.stat(str(marc_file))
+            records_loaded = SessionRecordStore(marc_file, session_cache_file_name(marc_file))
+        except (OSError, ValueError):
+            return None
+        try:
+            buffer = records_loaded.buffer
+            magic, records_loaded.file_size, records_loaded.file_mtime, records_loaded.content_hash, record_count, \
+                field_count, control_numbers_length, session_data_length = \
+                SESSION_CACHE_HEADER.unpack(buffer[:SESSION_CACHE_HEADER.size])
+            # The size and mtime are checked first, as they cost nothing. The content is only read, if they match.
+            if magic != SESSION_CACHE_MAGIC or records_loaded.file_size != file_stat.st_size \
+                    or records_loaded.file_mtime != file_stat.st_mtime_ns \
+                    or records_loaded.content_hash != marc_file_content_hash(marc_file):
+                records_loaded.close()
+                return None
+            section_start = SESSION_CACHE_HEADER.size
+            for section_array, item_count in ((records_loaded.record_offsets, record_count),
+                                              (records_loaded.record_lengths, record_count),
+                                              (records_loaded.field_starts, record_count + 1),
+                                              (records_loaded.field_data_starts, field_count),
+                                              (records_loaded.field_data_ends, field_count)):
+                section_end = section_start + item_count * section_array.itemsize
+                section_array.frombytes(buffer[section_start:section_end])
+                section_start = section_end
+            records_loaded.field_tags = buffer[section_start:section_start + field_count * 3]
+            section_start += field_count * 3
+            records_loaded.control_numbers = buffer[section_start:section_start + control_numbers_length].split(
+                b'\x1e') if record_count else []
+            section_start += control_numbers_length
+            positions_without_directory, inventory_counts, saved_result_sets = marshal.loads(
+                buffer[section_start:section_start + session_data_length])
+            records_loaded.positions_without_directory = set(positions_without_directory)
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            records_loaded.close()
+            return None
+        # A session cache file cut short leaves the arrays short.
+        if not len(records_loaded.record_offsets) == len(records_loaded.control_numbers) == record_count \
+                or len(records_loaded.field_starts) != record_count + 1 \
+                or len(records_loaded.field_tags) != field_count * 3 \
+                or len(records_loaded.field_data_ends) != field_count \
+                or (record_count and records_loaded.record_offsets[-1] + records_loaded.record_lengths[-1]
+                    > len(buffer)):
+            records_loaded.close()
+            return None
+        field_inventory = None
+        if inventory_counts is not None:
+            field_inventory = FieldInventory()
+            for name, counts in inventory_counts.items():
+                setattr(field_inventory, name, counts if name == 'record_count' else collections.Counter(counts))
+        result_sets = [ResultSet.from_bitmap(record_count, int.from_bytes(bitmap, 'little'), description)
+                       for description, bitmap in saved_result_sets]
+        return cls(records_loaded, field_inventory, result_sets)
+
+
+def search_raw_record(raw_record, search_query):
+    # Search one raw record. Returns the pymarc record and the match from SearchQuery.record_match(), if it matches the
+    # search. Otherwise, returns None.
+    if search_query.raw_record_may_match(raw_record):
+        marc_record = marc_record_from_raw(raw_record)
+        # Records that couldn't be parsed have nothing to search or save.
+        if marc_record is not None:
+            record_match = search_query.record_match(marc_record)
+            if record_match is not None:
+                return marc_record, record_match
+    return None
+
+
+def next_record_start(fh, position, file_size):
+    # Byte offset just after the next record terminator (0x1D) at or after position, where the next record starts.
+    # file_size, if there is no record terminator after position.
+    fh.seek(position)
+    while True:
+        block = fh.read(65536)
+        if not block:
+            return file_size
+        terminator_position = block.find(b'\x1d')
+        if terminator_position >= 0:
+            return position + terminator_position + 1
+        position += len(block)
+
+
+def split_marc_file_into_chunks(marc_file_to_split, chunk_count):
+    # Split a MARC record file into (start, end) byte ranges. Each range ends just after a record terminator (0x1D),
+    # so every chunk holds whole records.
+    file_size = os.path.getsize(marc_file_to_split)
+    chunk_boundaries = [0]
+    with open(str(marc_file_to_split), 'rb') as fh:
+        for chunk_number in range(1, chunk_count):
+            # Move the boundary forward to just after the next record terminator.
+            position = next_record_start(fh, max(file_size * chunk_number // chunk_count, chunk_boundaries[-1]),
+                                         file_size)
+            if chunk_boundaries[-1] < position < file_size:
+                chunk_boundaries.append(position)
+    chunk_boundaries.append(file_size)
+    return list(zip(chunk_boundaries[:-1], chunk_boundaries[1:]))
+
+
+def sample_raw_marc_records(fh, file_size, search_limits):
+    # Read the sampled records of a MARC record file as raw bytes, without reading the rest of the file.
+    # Each sampled byte offset is moved forward to the start of the next record, like the chunk boundaries in
+    # split_marc_file_into_chunks(). A record is only read once, if several offsets lead to it.
+    last_record_start = -1
+    for sample_offset in search_limits.sample_offsets(file_size):
+        record_start = 0 if sample_offset == 0 else next_record_start(fh, sample_offset - 1, file_size)
+        if record_start <= last_record_start or record_start >= file_size:
+            continue
+        last_record_start = record_start
+        fh.seek(record_start)
+        for raw_record in read_raw_marc_records(fh):
+            yield raw_record
+            break
+
+
+def sample_raw_marc_records_in_order(fh, search_limits):
+    # Random sample of the records of a stream that can't be sought in, e.g. a compressed file. The whole stream is
+    # read, but only the sampled records are kept (reservoir sampling), and they are handed back in file order.
+    sampled_records = []
+    for record_number, raw_record in enumerate(read_raw_marc_records(fh)):
+        if record_number < search_limits.sample_size:
+            sampled_records.append((record_number, raw_record))
+        else:
+            sample_number = search_limits.random_generator.randrange(record_number + 1)
+            if sample_number < search_limits.sample_size:
+                sampled_records[sample_number] = (record_number, raw_record)
+    for record_number, raw_record in sorted(sampled_records, key=lambda sampled_record: sampled_record[0]):
+        yield raw_record
+
+
+def search_marc_file_chunk(marc_file_to_load, chunk_start, chunk_end, search_query):
+    # Search the records in one chunk of a MARC record file. Runs in a worker process.
+    # Returns the count of records searched, the raw bytes of the matching records, the matches as
+    # (record number in the chunk, 001, match from SearchQuery.record_match()), and SearchQuery.search_counts().
+    # The main process writes and reports these in file order, so the results are the same as a serial search.
+    # A chunk_end of None searches the whole file, e.g. one compressed part of a split file.
+    count_of_records_searched = 0
+    matching_raw_records = []
+    chunk_matches = []
+    if chunk_end is None:
+        chunk_fh = open_marc_file(marc_file_to_load)
+    else:
+        with open(str(marc_file_to_load), 'rb') as fh:
+            fh.seek(chunk_start)
+            chunk_fh = io.BytesIO(fh.read(chunk_end - chunk_start))
+    with chunk_fh:
+        for raw_record in read_raw_marc_records(chunk_fh):
+            count_of_records_searched += 1
+            record_and_match = search_raw_record(raw_record, search_query)
+            if record_and_match is not None:
+                matching_raw_records.append(raw_record)
+                chunk_matches.append((count_of_records_searched, record_control_number(record_and_match[0]),
+                                      record_and_match[1]))
+    return count_of_records_searched, matching_raw_records, chunk_matches, search_query.search_counts()
+
+
+def stream_search_and_save(marc_file_to_load, marc_file_to_save, field_subfield_to_search, search_term_or_terms,
+                           search_by_whole_word, reg_ex_search, search_processes=1, match_report=None,
+                           run_metrics=None, search_limits=None):
+    # Search a MARC record file one record at a time and write each match straight to the save file, byte for byte.
+    # Only the record being searched is held in memory, so memory use doesn't grow with the size of the file.
+    # Each raw record is checked with SearchQuery.raw_record_may_match() first. Only records that pass are parsed.
+    # With more than one search process, the file is split into chunks that are searched in a process pool.
+    # The files of a directory or pattern are searched one file per chunk instead, and one compressed file is searched
+    # in one process. See open_marc_input().
+    # Matches go to match_report. Without one, matching data is printed to screen.
+    # The records, bytes and search counts are added to run_metrics.
+    # With search_limits, reading stops at the match limit. A sample is read straight from the sampled records, one
+    # process, and the matches' record numbers aren't known.
+    count_of_records_searched = 0
+    count_of_records_matched = 0
+    marc_input_plain_file = marc_input_is_plain_file(marc_file_to_load)
+    sample_search = search_limits is not None and search_limits.sample_size is not None
+    if sample_search:
+        search_processes = 1
+    elif not marc_input_plain_file and len(marc_input_files(marc_file_to_load)) < 2:
+        search_processes = 1
+    search_query = SearchQuery(field_subfield_to_search, search_term_or_terms, search_by_whole_word, reg_ex_search)
+    if match_report is None:
+        match_report = MatchReport()
+    try:
+        with open(str(marc_file_to_save), 'wb') as output_fh:
+            if search_processes > 1:
+                if marc_input_plain_file:
+                    # Several chunks per process keeps the processes busy, when some chunks have more matches.
+                    # Chunks are kept to roughly 16 MB or less, so the chunks being searched fit in memory.
+                    chunk_count = max(search_processes * 4, os.path.getsize(marc_file_to_load) // 16777216 + 1)
+                    chunks = [(marc_file_to_load, chunk_start, chunk_end) for chunk_start, chunk_end
+                              in split_marc_file_into_chunks(marc_file_to_load, chunk_count)]
+                else:
+                    chunks = [(marc_file, 0, None) for marc_file in marc_input_files(marc_file_to_load)]
+                with concurrent.futures.ProcessPoolExecutor(max_workers=search_processes) as executor:
+                    chunk_results = executor.map(search_marc_file_chunk,
+                                                 [chunk[0] for chunk in chunks],
+                                                 [chunk[1] for chunk in chunks],
+                                                 [chunk[2] for chunk in chunks],
+                                                 [search_query] * len(chunks))
+                    # executor.map() hands back the chunk results in file order.
+                    for (chunk_file, chunk_start, chunk_end), (chunk_records_searched, chunk_matching_raw_records,
+                                                               chunk_matches, chunk_search_counts) \
+                            in zip(chunks, chunk_results):
+                        if search_limits is not None and search_limits.match_limit is not None and \
+                                count_of_records_matched + len(chunk_matches) >= search_limits.match_limit:
+                            # Only the matches up to the match limit are kept, and the chunks not yet searched are
+                            # cancelled.
+                            chunk_matches = chunk_matches[:search_limits.match_limit - count_of_records_matched]
+                            chunk_matching_raw_records = chunk_matching_raw_records[:len(chunk_matches)]
+                            chunk_records_searched = chunk_matches[-1][0] if chunk_matches else 0
+                            executor.shutdown(cancel_futures=True)
+                        for chunk_record_number, control_number, record_match in chunk_matches:
+                            match_report.add_match(count_of_records_searched + chunk_record_number, None,
+                                                   record_match, control_number)
+                        count_of_records_searched += chunk_records_searched
+                        count_of_records_matched += len(chunk_matching_raw_records)
+                        for matching_raw_record in chunk_matching_raw_records:
+                            output_fh.write(matching_raw_record)
+                        if run_metrics is not None:
+                            run_metrics.bytes += (os.path.getsize(chunk_file) if chunk_end is None
+                                                  else chunk_end - chunk_start)
+                            run_metrics.add_search_counts(chunk_search_counts)
+                        if search_limits is not None and search_limits.match_limit_reached(count_of_records_matched):
+                            break
+            else:
+                with open_marc_input(marc_file_to_load) as input_fh:
+                    if sample_search and marc_input_plain_file:
+                        raw_records = sample_raw_marc_records(input_fh, os.path.getsize(marc_file_to_load),
+                                                              search_limits)
+                    elif sample_search:
+                        raw_records = sample_raw_marc_records_in_order(input_fh, search_limits)
+                    else:
+                        raw_records = read_raw_marc_records(input_fh)
+                    for raw_record in raw_records:
+                        count_of_records_searched += 1
+                        if run_metrics is not None:
+                            run_metrics.bytes += len(raw_record)
+                        record_and_match = search_raw_record(raw_record, search_query)
+                        if record_and_match is not None:
+                            output_fh.write(raw_record)
+                            count_of_records_matched += 1
+                            match_report.add_match(None if sample_search else count_of_records_searched,
+                                                   record_and_match[0], record_and_match[1])
+                            if search_limits is not None and \
+                                    search_limits.match_limit_reached(count_of_records_matched):
+                                break
+                    if run_metrics is not None:
+                        run_metrics.add_search_counts(search_query.search_counts())
+    except (FileNotFoundError, OSError):
+        print('ERROR: Unable to read the MARC file or write the save file.')
+    if run_metrics is not None:
+        run_metrics.records += count_of_records_searched
+        run_metrics.matches += count_of_records_matched
+    return count_of_records_searched, count_of_records_matched
+
+
+def batch_search_and_save(marc_file_to_load, batch_queries, run_metrics=None):
+    # Run a batch of searches in one pass over a MARC record file. Each search writes its matches to its own save file.
+    # A record is parsed and decoded at most once, however many searches test it. Matching data isn't shown.
+    # Returns the count of records searched and the count of records matched by each search.
+    # The records, bytes and search counts of all the searches are added to run_metrics.
+    count_of_records_searched = 0
+    counts_of_records_matched = [0] * len(batch_queries)
+    try:
+        with contextlib.ExitStack() as stack:
+            input_fh = stack.enter_context(open_marc_input(marc_file_to_load))
+            output_fhs = [stack.enter_context(open(str(marc_file_to_save), 'wb'))
+                          for search_query, marc_file_to_save in batch_queries]
+            for raw_record in read_raw_marc_records(input_fh):
+                count_of_records_searched += 1
+                marc_record = None
+                decoded_fields = None
+                for query_number, (search_query, marc_file_to_save) in enumerate(batch_queries):
+                    if not search_query.raw_record_may_match(raw_record):
+                        continue
+                    if marc_record is None:
+                        marc_record = marc_record_from_raw(raw_record)
+                        # Records that couldn't be parsed have nothing to search or save.
+                        if marc_record is None:
+                            break
+                    if decoded_fields is None and not search_query.search_leader:
+                        marc8 = record_is_marc8(marc_record)
+                        if marc8 and run_metrics is not None:
+                            run_metrics.marc8_records += 1
+                        decoded_fields = decode_record_fields(marc_record, marc8)
+                    if search_query.record_match(marc_record, decoded_fields) is not None:
+                        output_fhs[query_number].write(raw_record)
+                        counts_of_records_matched[query_number] += 1
+            if run_metrics is not None:
+                run_metrics.bytes += input_fh.tell()
+    except (FileNotFoundError, OSError):
+        print('ERROR: Unable to read the MARC file or write the save files.')
+    if run_metrics is not None:
+        run_metrics.records += count_of_records_searched
+        for search_query, marc_file_to_save in batch_queries:
+            run_metrics.add_search_counts(search_query.search_counts())
+        run_metrics.matches += sum(counts_of_records_matched)
+        run_metrics.details['matches_per_search'] = counts_of_records_matched
+    return count_of_records_searched, counts_of_records_matched
+
+
+def inventory_marc_file_chunk(marc_file_to_load, chunk_start, chunk_end):
+    # FieldInventory of the records in one chunk of a MARC record file. Runs in a worker process.
+    field_inventory = FieldInventory()
+    with open(str(marc_file_to_load), 'rb') as fh:
+        fh.seek(chunk_start)
+        chunk_fh = io.BytesIO(fh.read(chunk_end - chunk_start))
+    for raw_record in read_raw_marc_records(chunk_fh):
+        field_inventory.add_record(marc_record_from_raw(raw_record))
+    return field_inventory
+
+
+def inventory_marc_file(marc_file_to_load, inventory_processes=1):
+    # FieldInventory of a MARC record file. With more than one process, the file is split into chunks like a stream
+    # search, and the inventories of the chunks are merged.
+    field_inventory = FieldInventory()
+    if inventory_processes > 1 and marc_input_is_plain_file(marc_file_to_load):
+        chunk_count = max(inventory_processes * 4, os.path.getsize(marc_file_to_load) // 16777216 + 1)
+        chunks = split_marc_file_into_chunks(marc_file_to_load, chunk_count)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=inventory_processes) as executor:
+            for chunk_field_inventory in executor.map(inventory_marc_file_chunk,
+                                                      [marc_file_to_load] * len(chunks),
+                                                      [chunk[0] for chunk in chunks],
+                                                      [chunk[1] for chunk in chunks]):
+                field_inventory.merge(chunk_field_inventory)
+    else:
+        with open_marc_input(marc_file_to_load) as fh:
+            for raw_record in read_raw_marc_records(fh):
+                field_inventory.add_record(marc_record_from_raw(raw_record))
+    return field_inventory
+
+
+def inventory_raw_records_chunk(chunk_buffer, record_offsets, record_lengths):
+    # FieldInventory of the records at record_offsets, with record_lengths, in chunk_buffer. Runs in a worker process.
+    field_inventory = FieldInventory()
+    for record_offset, record_length in zip(record_offsets, record_lengths):
+        field_inventory.add_record(marc_record_from_raw(chunk_buffer[record_offset:record_offset + record_length]))
+    return field_inventory
+
+
+def inventory_record_store(records_loaded, inventory_processes=1):
+    # FieldInventory of the records of a record store, taken from the raw bytes the store holds, like the searches in
+    # match_loaded_record_positions(). The file isn't read again, so the inventory is of the loaded records, even if
+    # the file was moved or changed since. With more than one process, the records are split into chunks of about
+    # 16 MB or less, the bytes of each chunk are handed to a process pool, and the inventories of the chunks are
+    # merged.
+    record_count = len(records_loaded)
+    record_offsets = records_loaded.record_offsets
+    record_lengths = records_loaded.record_lengths
+    if inventory_processes < 2 or record_count < 2:
+        return inventory_raw_records_chunk(records_loaded.buffer, record_offsets, record_lengths)
+    chunk_count = min(record_count, max(inventory_processes * 4, sum(record_lengths) // 16777216 + 1))
+    chunk_boundaries = [record_count * chunk_number // chunk_count for chunk_number in range(chunk_count + 1)]
+    chunks = []
+    for first_position, end_position in zip(chunk_boundaries[:-1], chunk_boundaries[1:]):
+        # The records of a store are in file order, one after the other.
+        chunk_start = record_offsets[first_position]
+        chunk_end = record_offsets[end_position - 1] + record_lengths[end_position - 1]
+        chunks.append((records_loaded.buffer[chunk_start:chunk_end],
+                       [record_offset - chunk_start for record_offset in record_offsets[first_position:end_position]],
+                       record_lengths[first_position:end_position]))
+    field_inventory = FieldInventory()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=inventory_processes) as executor:
+        for chunk_field_inventory in executor.map(inventory_raw_records_chunk, *zip(*chunks)):
+            field_inventory.merge(chunk_field_inventory)
+    return field_inventory
+
+
+# Match keys for finding duplicate records, by tag. See record_match_keys().
+DUPLICATE_MATCH_KEYS = {'020': '020 ISBN', '035': '035 System Control Number', '010': '010 LCCN',
+                        '245': '245 Title'}
+# Match keys are spilled to files on disk, once this many are held in memory. See DuplicateKeyPartitions.
+DUPLICATE_KEY_MEMORY_LIMIT = 1000000
+DUPLICATE_KEY_PARTITIONS = 64
+
+
+def normalized_isbn(isbn_text):
+    # ISBN-13 of the ISBN at the start of 020 $a, e.g. '0-19-852663-6 (pbk.)' is '9780198526636', so ISBN-10 and
+    # ISBN-13 forms of a book match. None, if there's no ISBN.
+    isbn_match = re.match(r'\s*([0-9][0-9\- ]*[0-9Xx])', isbn_text)
+    if isbn_match is None:
+        return None
+    isbn = re.sub(r'[\- ]', '', isbn_match.group(1)).upper()
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        isbn = '978' + isbn[:9]
+        check_digit = -sum(int(digit) * (3 if digit_position % 2 else 1)
+                           for digit_position, digit in enumerate(isbn)) % 10
+        return isbn + str(check_digit)
+    elif len(isbn) == 13 and isbn.isdigit():
+        return isbn
+    return None
+
+
+def normalized_lccn(lccn_text):
+    # LCCN normalized the way the Library of Congress does it: blanks removed, anything from a slash on dropped, and the
+    # part after a hyphen padded to 6 digits, e.g. 'n 79-1234 ' is 'n79001234'. None, if nothing is left.
+    lccn = ''.join(lccn_text.split()).split('/')[0]
+    if '-' in lccn:
+        lccn_prefix, lccn_serial = lccn.split('-', 1)
+        if lccn_serial.isdigit():
+            lccn_serial = lccn_serial.zfill(6)
+        lccn = lccn_prefix + lccn_serial
+    return lccn.lower() or None
+
+
+def normalized_system_control_number(control_number_text):
+    # 035 $a without blanks and case folded. OCLC numbers are cut down to the number, so (OCoLC)ocm00012345 and
+    # (OCoLC)12345 match.
+    control_number = ''.join(control_number_text.split()).casefold()
+    oclc_match = re.match(r'\(ocolc\)\D*?0*(\d+)$', control_number)
+    if oclc_match is not None:
+        return '(ocolc)' + oclc_match.group(1)
+    return control_number or None
+
+
+def record_match_keys(record, match_key_tags):
+    # Normalized match keys of a record as (tag, key) pairs, e.g. ('020', '9780198526636'), for the match keys in
+    # match_key_tags: $a of 020, 035 and 010, and 245 $a $b $n $p without the nonfiling characters. Also returns the
+    # record's 001 and 245 $a, to report it by. Fields are decoded the way searches decode them.
+    # Reads record.fields and field.subfields directly, like record_is_marc8().
+    marc8 = record_is_marc8(record)
+    match_keys = set()
+    control_number = ''
+    title = None
+    for field in record.fields:
+        if field.is_control_field():
+            if field.tag == '001' and not control_number:
+                control_number = decode_marc_data(field.data, marc8)
+            continue
+        elif field.tag not in match_key_tags and not (field.tag == '245' and title is None):
+            continue
+        subfields = [(str(subfield_code), decode_marc_data(subfield_data, marc8))
+                     for subfield_code, subfield_data in field_subfields(field)]
+        if field.tag == '245':
+            if title is not None:
+                continue
+            title = ' '.join(subfield_data for subfield_code, subfield_data in subfields if subfield_code == 'a')
+            if '245' in match_key_tags:
+                title_text = ' '.join(subfield_data for subfield_code, subfield_data in subfields
+                                      if subfield_code in ('a', 'b', 'n', 'p'))
+                if subfields and subfields[0][0] == 'a' and str(field.indicator2).isdigit():
+                    title_text = title_text[int(field.indicator2):]
+                match_keys.add(('245', normalized_match_text(title_text)))
+            continue
+        for subfield_code, subfield_data in subfields:
+            if subfield_code != 'a':
+                continue
+            elif field.tag == '020':
+                match_keys.add(('020', normalized_isbn(subfield_data)))
+            elif field.tag == '035':
+                match_keys.add(('035', normalized_system_control_number(subfield_data)))
+            elif field.tag == '010':
+                match_keys.add(('010', normalized_lccn(subfield_data)))
+    # Empty keys match nothing.
+    return [match_key for match_key in match_keys if match_key[1]], control_number, title or ''
+
+
+class DuplicateKeyPartitions:
+    # Match keys of records, split by hash into partitions, so the records sharing a key are found one partition at a
+    # time by grouping, without comparing records in pairs. Keys are held in memory until there are memory_limit of
+    # them. Then every partition is appended to its own file in spill_directory. Only one partition is grouped in
+    # memory at a time, so memory stays bounded however many records there are.
+    def __init__(self, spill_directory, partition_count=DUPLICATE_KEY_PARTITIONS,
+                 memory_limit=DUPLICATE_KEY_MEMORY_LIMIT):
+        self.spill_directory = spill_directory
+        self.partition_count = partition_count
+        self.memory_limit = memory_limit
+        self.partitions = [[] for partition_number in range(partition_count)]
+        self.keys_in_memory = 0
+        self.keys_spilled = 0
+
+    def partition_file_name(self, partition_number):
+        return os.path.join(self.spill_directory, 'partition' + str(partition_number) + '.marshal')
+
+    def add(self, match_tag, match_key, record_entry):
+        # record_entry is (record number, 001, title) of the record with the key.
+        partition_number = zlib.crc32((match_tag + match_key).encode('utf-8')) % self.partition_count
+        self.partitions[partition_number].append((match_tag, match_key) + record_entry)
+        self.keys_in_memory += 1
+        if self.keys_in_memory >= self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        # Append the keys in memory to the partition files, in marshal chunks.
+        for partition_number, partition in enumerate(self.partitions):
+            if partition:
+                with open(self.partition_file_name(partition_number), 'ab') as fh:
+                    marshal.dump(partition, fh)
+        self.partitions = [[] for partition_number in range(self.partition_count)]
+        self.keys_spilled += self.keys_in_memory
+        self.keys_in_memory = 0
+
+    def duplicate_groups(self):
+        # Yield (tag, key, record entries) for every key that more than one record has, with the record entries in
+        # record number order. Partition files are removed once they've been read.
+        for partition_number in range(self.partition_count):
+            key_groups = {}
+            partition_file = self.partition_file_name(partition_number)
+            if os.path.isfile(partition_file):
+                with open(partition_file, 'rb') as fh:
+                    while True:
+                        try:
+                            partition_chunk = marshal.load(fh)
+                        except EOFError:
+                            break
+                        for key_entry in partition_chunk:
+                            key_groups.setdefault(key_entry[:2], []).append(key_entry[2:])
+                os.remove(partition_file)
+            for key_entry in self.partitions[partition_number]:
+                key_groups.setdefault(key_entry[:2], []).append(key_entry[2:])
+            self.partitions[partition_number] = []
+            for (match_tag, match_key), record_entries in key_groups.items():
+                if len(record_entries) > 1:
+                    yield match_tag, match_key, sorted(record_entries)
+
+
+def duplicates_file_names(duplicates_file_prefix, match_key_tags):
+    # The cluster report and the MARC file of duplicates for each match key, e.g. dups_clusters.csv and dups_020.mrc.
+    duplicates_files = {'clusters': str(duplicates_file_prefix) + '_clusters.csv'}
+    for match_key_tag in match_key_tags:
+        duplicates_files[match_key_tag] = str(duplicates_file_prefix) + '_' + match_key_tag + '.mrc'
+    return duplicates_files
+
+
+def find_duplicate_records(marc_inputs, match_key_tags, duplicates_file_prefix, run_metrics=None):
+    # Find records that share a normalized match key, across one or more MARC inputs (files, directories or patterns).
+    # The first pass reads every record once and adds its match keys to DuplicateKeyPartitions, spilling them next
+    # to the duplicate files, if there are too many to hold. Each key shared by more than one record is a cluster,
+    # written to <prefix>_clusters.csv. The second pass copies the records in clusters, as they are, to
+    # <prefix>_<tag>.mrc, one file for each match key. Records that can't be parsed have no match keys.
+    # Returns the count of records read, and the counts of clusters and of duplicate records by match key tag.
+    # The records and bytes read in the first pass are added to run_metrics.
+    # Each file is read once, however many of marc_inputs take it in, or each of its records would be a cluster.
+    marc_files = unique_marc_input_files(marc_inputs)
+    duplicates_files = duplicates_file_names(duplicates_file_prefix, match_key_tags)
+    cluster_counts = dict.fromkeys(match_key_tags, 0)
+    duplicate_record_counts = dict.fromkeys(match_key_tags, 0)
+    count_of_records_read = 0
+    # Record numbers count on from one input to the next. The first record number of each input.
+    input_record_starts = []
+    try:
+        spill_directory_parent = os.path.dirname(os.path.abspath(duplicates_files['clusters']))
+        with tempfile.TemporaryDirectory(dir=spill_directory_parent) as spill_directory:
+            duplicate_key_partitions = DuplicateKeyPartitions(spill_directory)
+            for marc_file in marc_files:
+                input_record_starts.append(count_of_records_read)
+                with open_marc_input(marc_file) as input_fh:
+                    for raw_record in read_raw_marc_records(input_fh):
+                        marc_record = marc_record_from_raw(raw_record)
+                        if marc_record is not None:
+                            match_keys, control_number, title = record_match_keys(marc_record, match_key_tags)
+                            for match_tag, match_key in match_keys:
+                                duplicate_key_partitions.add(match_tag, match_key,
+                                                             (count_of_records_read, control_number, title))
+                        count_of_records_read += 1
+                    if run_metrics is not None:
+                        run_metrics.bytes += input_fh.tell()
+            # Records in clusters, by match key tag, as one bit per record.
+            duplicate_record_bitmaps = {match_key_tag: bytearray(count_of_records_read // 8 + 1)
+                                        for match_key_tag in match_key_tags}
+            with open(duplicates_files['clusters'], 'w', newline='', encoding='utf-8') as clusters_fh:
+                clusters_writer = csv.writer(clusters_fh)
+                clusters_writer.writerow(['Cluster', 'Match Key', 'Normalized Key', 'MARC File', 'Record Number',
+                                          '001', 'Title'])
+                for cluster_number, (match_tag, match_key, record_entries) in enumerate(
+                        duplicate_key_partitions.duplicate_groups(), 1):
+                    cluster_counts[match_tag] += 1
+                    for record_number, control_number, title in record_entries:
+                        duplicate_record_bitmaps[match_tag][record_number >> 3] |= 1 << (record_number & 7)
+                        input_number = bisect.bisect_right(input_record_starts, record_number) - 1
+                        clusters_writer.writerow([cluster_number, DUPLICATE_MATCH_KEYS[match_tag], match_key,
+                                                  marc_files[input_number],
+                                                  record_number - input_record_starts[input_number] + 1,
+                                                  control_number, title])
+        # Only match keys with clusters get a MARC file.
+        match_key_tags_found = [match_key_tag for match_key_tag in match_key_tags if cluster_counts[match_key_tag]]
+        if match_key_tags_found:
+            with contextlib.ExitStack() as stack:
+                output_fhs = {match_key_tag: stack.enter_context(open(duplicates_files[match_key_tag], 'wb'))
+                              for match_key_tag in match_key_tags_found}
+                record_number = 0
+                for marc_file in marc_files:
+                    with open_marc_input(marc_file) as input_fh:
+                        for raw_record in read_raw_marc_records(input_fh):
+                            for match_key_tag, output_fh in output_fhs.items():
+                                if duplicate_record_bitmaps[match_key_tag][record_number >> 3] >> \
+                                        (record_number & 7) & 1:
+                                    output_fh.write(raw_record)
+                                    duplicate_record_counts[match_key_tag] += 1
+                            record_number += 1
+    except (FileNotFoundError, OSError):
+        print('ERROR: Unable to read the MARC files or write the duplicate files.')
+    if run_metrics is not None:
+        run_metrics.records += count_of_records_read
+        run_metrics.matches += sum(duplicate_record_counts.values())
+        run_metrics.details['clusters_per_match_key'] = cluster_counts
+    return count_of_records_read, cluster_counts, duplicate_record_counts
+
+
+def marc_query_server_url(marc_input):
+    # True for the address of a MARC Crucible server, e.g. http://127.0.0.1:8765.
+    return str(marc_input).lower().startswith('http://')
+
+
+class MatchList(MatchReport):
+    # Matches kept in a list as (record number, 001, match from SearchQuery.record_match()), to send to a client.
+    def __init__(self):
+        super().__init__(0)
+        self.matches = []
+
+    def add_match(self, record_number, record, record_match, control_number=None):
+        if control_number is None:
+            control_number = record_control_number(record)
+        self.matches.append((record_number, control_number, record_match))
+
+    def close(self):
+        pass
+
+
+# Record stores opened by search worker processes of a MarcQueryServer, by file name. A worker process opens the file at
+# its first search, and keeps it open for the next ones. See search_record_store_chunk().
+SEARCH_WORKER_RECORD_STORES = {}
+
+
+def search_record_store_chunk(marc_file, record_count, record_positions, search_query, match_limit=None):
+    # Search the records at record_positions of a MARC record file, memory-mapped as a MarcRecordStore. Runs in a search
+    # worker process of a MarcQueryServer. record_count is the number of records the server loaded, to make sure the
+    # file is still the file it loaded. With a match_limit, the search stops after that many matching records.
+    # Returns the matching record positions, the matches (see MatchList), and the records, bytes and search counts.
+    # Raises OSError, if the file can't be read or has changed.
+    records_to_search = SEARCH_WORKER_RECORD_STORES.get(marc_file)
+    if records_to_search is None:
+        try:
+            records_to_search = SEARCH_WORKER_RECORD_STORES[marc_file] = MarcRecordStore(marc_file)
+        except ValueError as error:
+            raise OSError('Unable to read ' + marc_file + ': ' + str(error)) from error
+    if len(records_to_search) != record_count:
+        raise OSError('The MARC file has changed since it was loaded: ' + marc_file)
+    match_list = MatchList()
+    run_metrics = RunMetrics('search')
+    matching_record_positions = match_loaded_record_positions(
+        records_to_search, record_positions, search_query, None, match_list, run_metrics,
+        None if match_limit is None else SearchLimits(match_limit))
+    return matching_record_positions, match_list.matches, search_metrics_counts(run_metrics)
+
+
+# The counts of a search's RunMetrics that a MarcQueryServer sends back to the client.
+SEARCH_METRIC_NAMES = ('records', 'bytes', 'records_tested', 'fields_visited', 'subfields_visited',
+                       'pattern_evaluations', 'marc8_records')
+
+
+def search_metrics_counts(run_metrics):
+    return {metric_name: getattr(run_metrics, metric_name) for metric_name in SEARCH_METRIC_NAMES}
+
+
+class MarcQueryServer:
+    # Serves searches, RegEx searches, counts, inventories, saves and records of one loaded MARC record file over HTTP,
+    # so the file is loaded once for everyone who uses it. Requests and responses are JSON. See respond().
+    # Requests are read and answered with asyncio, and handled in a pool of worker threads. Searches are split into
+    # chunks of record positions, which are searched in a pool of worker processes, so searches running at the same
+    # time don't wait for each other on Python's global interpreter lock. Each worker process memory-maps the file
+    # itself. The worker processes are shared out between the searches running: one search alone has a chunk in every
+    # worker process, and a search that comes in while others run gets worker processes of its own as soon as their
+    # chunks finish, instead of waiting for the other searches to finish.
+    # Files that can't be memory-mapped, e.g. compressed files, are searched in the worker threads.
+    # The records are a record store, which parses records from raw bytes each time they are searched, so searches
+    # running at the same time don't share any pymarc records.
+    # Saves are only written to new files in save_directory, by default the directory of the served file.
+    def __init__(self, marc_file, records_loaded, worker_count=4, save_directory=None):
+        self.marc_file = str(marc_file)
+        self.records_loaded = records_loaded
+        if save_directory is None:
+            save_directory = os.path.dirname(os.path.abspath(self.marc_file))
+        self.save_directory = os.path.realpath(str(save_directory))
+        self.worker_count = worker_count
+        self.executor = concurrent.futures.ThreadPoolExecutor(worker_count)
+        self.searches_running = 0
+        self.searches_running_lock = threading.Lock()
+        self.search_executor = None
+        if marc_input_is_plain_file(self.marc_file):
+            self.search_executor = concurrent.futures.ProcessPoolExecutor(worker_count)
+        self.field_inventory = None
+        self.field_inventory_lock = threading.Lock()
+        self.fixed_field_columns = None
+        self.fixed_field_columns_lock = threading.Lock()
+        # Built now, so worker threads never build it at the same time.
+        records_loaded.position_of_control_number('')
+
+    def close(self):
+        # Stop the worker threads and processes. Searches that haven't started are cancelled. The worker processes
+        # are waited for, as a process pool that is still stopping when Python exits fails to stop.
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.search_executor is not None:
+            self.search_executor.shutdown(wait=True, cancel_futures=True)
+
+    async def serve(self, host, port):
+        http_server = await asyncio.start_server(self.handle_connection, host, port)
+        async with http_server:
+            await http_server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        # One request per connection: the request line, headers, and a JSON body of Content-Length bytes.
+        try:
+            request_line = await reader.readline()
+            method, path = request_line.decode('latin-1').split()[:2]
+            content_length = 0
+            while True:
+                header_line = await reader.readline()
+                if header_line in (b'\r\n', b'\n', b''):
+                    break
+                header_name, header_value = header_line.decode('latin-1').split(':', 1)
+                if header_name.strip().lower() == 'content-length':
+                    content_length = int(header_value)
+            request_body = await reader.readexactly(content_length)
+            status, content_type, response_body = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.respond, method.upper(), path.split('?')[0], request_body)
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            status, content_type = 400, 'application/json'
+            response_body = json.dumps({'error': 'Invalid request: ' + str(error)}).encode('utf-8')
+        except Exception as error:
+            # Anything else respond() didn't expect still gets an answer, so the client isn't left waiting.
+            status, content_type = 500, 'application/json'
+            response_body = json.dumps({'error': 'Server error: ' + repr(error)}).encode('utf-8')
+        try:
+            writer.write(('HTTP/1.1 ' + str(status) + ' ' + http.client.responses.get(status, '') + '\r\n'
+                          'Content-Type: ' + content_type + '\r\n'
+                          'Content-Length: ' + str(len(response_body)) + '\r\n'
+                          'Connection: close\r\n\r\n').encode('latin-1') + response_body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, method, path, request_body):
+        # Runs in a worker thread. Returns the HTTP status, content type and body of the response.
+        # GET /status: the file and record count.
+        # POST /search: {"field_subfields": [["245", "a"]], "search_terms": ["..."], "whole_word": false,
+        #     "reg_ex": false, and optionally "normalized", "within": [record positions], "match_limit",
+        #     "sample_size", "sample_mode"}. Returns the matching record positions, the matches and the search metrics.
+        # GET /inventory: the FieldInventory of the file. See FieldInventory.as_dict().
+        # POST /save: {"record_positions": [...], "marc_file": "path"}. Saves the records on the server, to a new file
+        #     in the save directory. A relative path is relative to the save directory. See save_file_path().
+        # POST /fixed-field: {"query": "LDR/06 = 'a'"}. Record positions matching a fixed field query.
+        # POST /position: {"control_number": "..."}. Position of the first record with this 001, or null.
+        # GET /record/<position>: the raw bytes of one record.
+        try:
+            request_data = json.loads(request_body) if request_body else {}
+            if method == 'GET' and path == '/status':
+                response_data = {'marc_file': self.marc_file, 'records': len(self.records_loaded)}
+            elif method == 'POST' and path == '/search':
+                response_data = self.search(request_data)
+            elif method == 'GET' and path == '/inventory':
+                with self.field_inventory_lock:
+                    if self.field_inventory is None:
+                        self.field_inventory = FieldInventory()
+                        for record in self.records_loaded:
+                            self.field_inventory.add_record(record)
+                response_data = self.field_inventory.as_dict()
+            elif method == 'POST' and path == '/save':
+                record_positions = [int(record_position) for record_position in request_data['record_positions']]
+                if not all(0 <= record_position < len(self.records_loaded) for record_position in record_positions):
+                    raise ValueError('Record position out of range.')
+                marc_file_to_save = self.save_file_path(request_data['marc_file'])
+                run_metrics = RunMetrics('save')
+                try:
+                    save_record_positions(self.records_loaded, record_positions, marc_file_to_save, run_metrics)
+                except FileExistsError as error:
+                    # Saved by another request since save_file_path() looked.
+                    raise ValueError('Save File Already Exists. Enter a new file name.') from error
+                response_data = {'records': run_metrics.records, 'bytes': run_metrics.bytes}
+            elif method == 'POST' and path == '/fixed-field':
+                with self.fixed_field_columns_lock:
+                    if self.fixed_field_columns is None:
+                        self.fixed_field_columns = FixedFieldColumns.from_records(self.records_loaded)
+                response_data = {'record_positions': self.fixed_field_columns.query(
+                    str(request_data['query'])).positions()}
+            elif method == 'POST' and path == '/position':
+                response_data = {'record_position': self.records_loaded.position_of_control_number(
+                    str(request_data['control_number']))}
+            elif method == 'GET' and path.startswith('/record/'):
+                record_position = int(path[len('/record/'):])
+                if not 0 <= record_position < len(self.records_loaded):
+                    return 404, 'application/json', json.dumps({'error': 'No such record.'}).encode('utf-8')
+                return 200, 'application/marc', bytes(self.records_loaded.raw_record(record_position))
+            else:
+                return 404, 'application/json', json.dumps({'error': 'Not found: ' + path}).encode('utf-8')
+        except (ValueError, KeyError, TypeError, AttributeError, re.error) as error:
+            return 400, 'application/json', json.dumps({'error': 'Invalid request: ' + str(error)}).encode('utf-8')
+        except OSError as error:
+            return 500, 'application/json', json.dumps({'error': str(error)}).encode('utf-8')
+        return 200, 'application/json', json.dumps(response_data).encode('utf-8')
+
+    def save_file_path(self, marc_file_to_save):
+        # The path a client asked to save to, in the save directory. Raises ValueError, if the path resolves, e.g.
+        # through '..' or a symbolic link, to somewhere outside the save directory, or the file already exists.
+        marc_file_to_save = os.path.realpath(os.path.join(self.save_directory, str(marc_file_to_save)))
+        if os.path.commonpath([self.save_directory, marc_file_to_save]) != self.save_directory or \
+                marc_file_to_save == self.save_directory:
+            raise ValueError('Save File must be in the save directory ' + self.save_directory + '.')
+        if os.path.lexists(marc_file_to_save):
+            raise ValueError('Save File Already Exists. Enter a new file name.')
+        return marc_file_to_save
+
+    def search(self, request_data):
+        field_subfield_to_search = [[str(field_to_search), str(subfield_to_search)]
+                                    for field_to_search, subfield_to_search in request_data['field_subfields']]
+        search_term_or_terms = [str(search_term) for search_term in request_data['search_terms']]
+        search_limits = None
+        if request_data.get('match_limit') is not None or request_data.get('sample_size') is not None:
+            search_limits = SearchLimits(request_data.get('match_limit'), request_data.get('sample_size'),
+                                         request_data.get('sample_mode', 'random'))
+        result_set = None
+        if request_data.get('within') is not None:
+            record_positions = [int(record_position) for record_position in request_data['within']]
+            if not all(0 <= record_position < len(self.records_loaded) for record_position in record_positions):
+                raise ValueError('Record position out of range.')
+            result_set = ResultSet(len(self.records_loaded), record_positions)
+        if self.search_executor is None:
+            match_list = MatchList()
+            run_metrics = RunMetrics('search')
+            if request_data.get('reg_ex'):
+                matching_record_positions = reg_ex_search_loaded_record_positions(
+                    self.records_loaded, field_subfield_to_search, search_term_or_terms, None, match_list, run_metrics,
+                    search_limits, result_set)
+            else:
+                matching_record_positions = search_loaded_record_positions(
+                    self.records_loaded, field_subfield_to_search, search_term_or_terms,
+                    bool(request_data.get('whole_word')), None, None, match_list, run_metrics, search_limits,
+                    result_set, bool(request_data.get('normalized')))
+            return {'record_positions': matching_record_positions, 'matches': match_list.matches,
+                    'metrics': search_metrics_counts(run_metrics)}
+        if request_data.get('reg_ex'):
+            search_query = SearchQuery(field_subfield_to_search, search_term_or_terms, reg_ex_search=True)
+        else:
+            search_query = SearchQuery(field_subfield_to_search, search_term_or_terms,
+                                       bool(request_data.get('whole_word')),
+                                       normalized_search=bool(request_data.get('normalized')))
+        record_positions = limited_record_positions(
+            len(self.records_loaded), candidate_record_positions(self.records_loaded, search_query), search_limits,
+            result_set)
+        return self.search_in_processes(search_query, record_positions,
+                                        None if search_limits is None else search_limits.match_limit)
+
+    def search_in_processes(self, search_query, record_positions, match_limit=None):
+        # Search the records at record_positions in chunks, in the search worker processes, and merge the results of
+        # the chunks in record order. Returns the response to a search. See search_record_store_chunk().
+        # With a match_limit, the chunks not yet searched are cancelled, once the chunks searched have enough matches.
+        chunk_size = max(1000, -(-len(record_positions) // (self.worker_count * 4)))
+        matching_record_positions = []
+        matches = []
+        metrics = collections.Counter()
+        pending_chunks = collections.deque()
+
+        def take_chunk_result():
+            # Returns True, once the match limit is reached.
+            chunk_matching_record_positions, chunk_matches, chunk_metrics = pending_chunks.popleft().result()
+            matching_record_positions.extend(chunk_matching_record_positions)
+            matches.extend(chunk_matches)
+            metrics.update(chunk_metrics)
+            return match_limit is not None and len(matching_record_positions) >= match_limit
+
+        match_limit_reached = False
+        with self.searches_running_lock:
+            self.searches_running += 1
+        try:
+            for chunk_start in range(0, len(record_positions), chunk_size):
+                # The search's share of the worker processes, with the searches running now.
+                while not match_limit_reached and \
+                        len(pending_chunks) >= max(1, self.worker_count // self.searches_running):
+                    match_limit_reached = take_chunk_result()
+                if match_limit_reached:
+                    break
+                pending_chunks.append(self.search_executor.submit(
+                    search_record_store_chunk, self.marc_file, len(self.records_loaded),
+                    record_positions[chunk_start:chunk_start + chunk_size], search_query, match_limit))
+            while pending_chunks and not match_limit_reached:
+                match_limit_reached = take_chunk_result()
+        finally:
+            with self.searches_running_lock:
+                self.searches_running -= 1
+            for pending_chunk in pending_chunks:
+                pending_chunk.cancel()
+        if match_limit is not None:
+            del matching_record_positions[match_limit:]
+            del matches[match_limit:]
+        return {'record_positions': matching_record_positions, 'matches': matches,
+                'metrics': {metric_name: metrics[metric_name] for metric_name in SEARCH_METRIC_NAMES}}
+
+
+def serve_marc_file(marc_file, host='127.0.0.1', port=8765, worker_count=4, record_load_mode='index_001',
+                    save_directory=None):
+    # Load a MARC record file into a record store, and serve it until stopped with Ctrl+C. See MarcQueryServer.
+    # Raises ValueError, if save_directory isn't a directory.
+    if save_directory is not None and not os.path.isdir(save_directory):
+        raise ValueError('Save directory not found: ' + str(save_directory))
+    if record_load_mode == 'records':
+        record_load_mode = 'compact'
+    print('Loading ' + str(marc_file))
+    load_start_time = datetime.datetime.now()
+    records_loaded, field_inventory = read_marc_file(marc_file, record_load_mode)
+    load_time = str(format((datetime.datetime.now() - load_start_time).total_seconds(), '.2f'))
+    print('Time to load record(s): ' + load_time + ' seconds')
+    marc_query_server = MarcQueryServer(marc_file, records_loaded, worker_count, save_directory)
+    print('Serving ' + str(len(records_loaded)) + ' records of ' + str(marc_file) + ' at http://' + host + ':'
+          + str(port) + '. Press Ctrl+C to stop.')
+    print('Saved files are written to ' + marc_query_server.save_directory)
+    try:
+        asyncio.run(marc_query_server.serve(host, port))
+    except KeyboardInterrupt:
+        print('Server stopped.')
+    finally:
+        marc_query_server.close()
+
+
+class MarcQueryClient:
+    # The records of a MARC Crucible server, used like loaded records, so the menu works with a file loaded on the
+    # server: searches, counts, inventories and saves are done by the server, and only results are sent back.
+    # Records are fetched one at a time, e.g. to view them. See MarcQueryServer.
+    # Raises OSError, if the server can't be reached or the request fails.
+    def __init__(self, server_url):
+        server_address = urllib.parse.urlsplit(str(server_url))
+        self.marc_file = str(server_url)
+        self.host = server_address.hostname or '127.0.0.1'
+        self.port = server_address.port or 8765
+        try:
+            self.record_count = self.request('GET', '/status')['records']
+        except (KeyError, TypeError) as error:
+            raise OSError('Not a MARC Crucible server: ' + self.marc_file) from error
+
+    def request(self, method, path, request_data=None):
+        # Returns the JSON response, or the response bytes, if the response isn't JSON.
+        connection = http.client.HTTPConnection(self.host, self.port)
+        try:
+            request_body = None if request_data is None else json.dumps(request_data).encode('utf-8')
+            connection.request(method, path, request_body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response_body = response.read()
+            content_type = response.getheader('Content-Type', '')
+        except http.client.HTTPException as error:
+            raise OSError('MARC Crucible server error: ' + str(error)) from error
+        finally:
+            connection.close()
+        if content_type != 'application/json':
+            return response_body
+        try:
+            response_data = json.loads(response_body)
+        except ValueError as error:
+            raise OSError('MARC Crucible server error: ' + str(error)) from error
+        if response.status != 200:
+            raise OSError('MARC Crucible server error: ' + str(response_data.get('error')))
+        return response_data
+
+    def __len__(self):
+        return self.record_count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.record_count:
+            raise IndexError('record position out of range')
+        return marc_record_from_raw(self.request('GET', '/record/' + str(position)))
+
+    def __iter__(self):
+        for position in range(self.record_count):
+            yield self[position]
+
+    def search(self, field_subfield_to_search, search_term_or_terms, search_by_whole_word, reg_ex_search,
+               match_report=None, run_metrics=None, search_limits=None, result_set=None, normalized_search=False):
+        # Search on the server. Returns the matching record positions. Matches go to match_report, as if the records
+        # were searched here.
+        request_data = {'field_subfields': field_subfield_to_search, 'search_terms': list(search_term_or_terms),
+                        'whole_word': search_by_whole_word is True, 'reg_ex': reg_ex_search,
+                        'normalized': normalized_search is True}
+        if search_limits is not None:
+            request_data.update({'match_limit': search_limits.match_limit, 'sample_size': search_limits.sample_size,
+                                 'sample_mode': search_limits.sample_mode})
+        if result_set is not None:
+            request_data['within'] = result_set.positions()
+        response_data = self.request('POST', '/search', request_data)
+        if match_report is None:
+            match_report = MatchReport()
+        for record_number, control_number, record_match in response_data['matches']:
+            match_report.add_match(record_number, None, tuple(record_match), control_number)
+        if run_metrics is not None:
+            for metric_name, metric_value in response_data['metrics'].items():
+                setattr(run_metrics, metric_name, getattr(run_metrics, metric_name) + metric_value)
+            run_metrics.matches += len(response_data['record_positions'])
+        return response_data['record_positions']
+
+    def field_inventory(self):
+        return FieldInventory.from_dict(self.request('GET', '/inventory'))
+
+    def save(self, record_positions, marc_file_to_save):
+        # The server saves the file in its save directory, so a relative path is sent as it is, and is relative to
+        # the save directory. Returns the bytes saved.
+        return self.request('POST', '/save', {'record_positions': list(record_positions),
+                                              'marc_file': str(marc_file_to_save)})['bytes']
+
+    def position_of_control_number(self, control_number):
+        return self.request('POST', '/position', {'control_number': control_number})['record_position']
+
+    def fixed_field_query(self, fixed_field_query):
+        # ResultSet of a fixed field query on the server. See FixedFieldColumns.query().
+        return ResultSet(self.record_count, self.request('POST', '/fixed-field', {'query': fixed_field_query})[
+            'record_positions'], 'Fixed fields: ' + fixed_field_query)
+
+
+if __name__ == '__main__':
+    # Needed for the search process pool, when running as a compiled executable.
+    multiprocessing.freeze_support()
+    argument_parser = argparse.ArgumentParser(
+        description='MARC Crucible. Run without arguments for the menu, or with --serve to serve a MARC file.')
+    argument_parser.add_argument('--serve', metavar='MARC_FILE',
+                                 help='load a MARC file once and serve it to the menu of other users, who load the '
+                                      'server address, e.g. http://127.0.0.1:8765')
+    argument_parser.add_argument('--host', default='127.0.0.1', help='address to serve on (default: 127.0.0.1)')
+    argument_parser.add_argument('--port', type=int, default=8765, help='port to serve on (default: 8765)')
+    argument_parser.add_argument('--workers', type=int, default=4,
+                                 help='worker threads for requests, and worker processes for searches '
+                                      '(default: 4)')
+    argument_parser.add_argument('--load-mode', default='index_001', choices=['index', 'index_001', 'compact'],
+                                 help='how the served file is loaded (default: index_001)')
+    argument_parser.add_argument('--save-directory', metavar='DIRECTORY',
+                                 help='the only directory saves are written to; saves never overwrite a file '
+                                      '(default: the directory of the served file)')
+    arguments = argument_parser.parse_args()
+    if arguments.serve:
+        try:
+            serve_marc_file(arguments.serve, arguments.host, arguments.port, max(1, arguments.workers),
+                            arguments.load_mode, arguments.save_directory)
+        except (OSError, ValueError) as error:
+            print('ERROR: ' + str(error))
+            sys.exit(1)
+        sys.exit()
+    records_loaded = []
+    marc_file_loaded = ''
+    loaded_term_index = None
+    loaded_decoded_record_cache = None
+    field_subfields_to_search = []
+    list_of_search_terms = []
+    matching_record_positions = []
+    loaded_field_inventory = None
+    menu_selection = ''
+    whole_word_search = False
+    stream_search_processes = 1
+    record_load_mode = 'records'
+    use_term_index = False
+    match_echo_limit = None
+    match_report_format = None
+    metrics_file = None
+    profile_mode = None
+    search_limits = None
+    use_session_cache = False
+    normalized_search = False
+    # Built on the first fixed field search of the loaded records. See FixedFieldColumns.
+    loaded_fixed_field_columns = None
+    # Result sets of the searches of the loaded records, numbered from 1. See ResultSet.
+    result_sets = []
+    refine_result_set = None
+    running = True
+    # [1]:Load MARC File [2]:Enter Search Field(s) [3]:Enter Search Term(s) [4]:Run Search
+    # [5]:Save Matched Records to File [9]:Count Records [0]:Quit
+    while running:
+        menu_selection = main_menu()
+        if menu_selection == '1':
+            if use_session_cache and records_loaded:
+                save_session_cache(records_loaded, loaded_field_inventory, result_sets)
+            # Release the memory map and file of the records loaded before. Otherwise, every reload keeps one open, and
+            # on Windows the file can't be rewritten while it's open.
+            if isinstance(records_loaded, MarcRecordStore):
+                records_loaded.close()
+            records_loaded, marc_file_loaded, loaded_field_inventory, loaded_session_cache = load_records(
+                record_load_mode, metrics_file, profile_mode, use_session_cache)
+            # Matches are kept as positions in the loaded records, so they don't carry over to other records.
+            matching_record_positions = []
+            result_sets = []
+            refine_result_set = None
+            loaded_term_index = None
+            loaded_fixed_field_columns = None
+            if loaded_session_cache is not None:
+                result_sets = loaded_session_cache.result_sets
+                # The last result set is the last search, or the last result sets combined.
+                if result_sets:
+                    matching_record_positions = result_sets[-1].positions()
+            # Record stores keep records as raw bytes to save memory, so decoded text isn't kept for them. Resumed
+            # sessions are record stores too.
+            if isinstance(records_loaded, (MarcRecordStore, MarcQueryClient)):
+                loaded_decoded_record_cache = None
+            else:
+                loaded_decoded_record_cache = DecodedRecordCache(len(records_loaded))
+        elif menu_selection == '2':
+            field_subfields_to_search = user_entry_field_subfield()
+        elif menu_selection == '3':
+            list_of_search_terms = user_entry_search_term_or_terms()
+        elif menu_selection == '4':
+            print('----------------')
+            if use_term_index and loaded_term_index is None and not isinstance(records_loaded, MarcQueryClient) \
+                    and term_index_can_answer(field_subfields_to_search, whole_word_search) and not normalized_search:
+                index_start_time = datetime.datetime.now()
+                loaded_term_index = open_term_index(records_loaded, marc_file_loaded)
+                index_end_time = datetime.datetime.now()
+                # Print to screen the time it took to build or read the term index.
+                index_time = str(format((index_end_time - index_start_time).total_seconds(), '.2f'))
+                print('Time to build or read term index: ' + index_time + ' seconds')
+            match_report = open_match_report(match_echo_limit, match_report_format)
+            run_metrics = start_run_metrics('search', metrics_file, profile_mode)
+            search_start_time = datetime.datetime.now()
+            matching_record_positions = search_loaded_record_positions(
+                records_loaded, field_subfields_to_search, list_of_search_terms, whole_word_search,
+                loaded_term_index if use_term_index else None, loaded_decoded_record_cache, match_report, run_metrics,
+                search_limits, refine_result_set, normalized_search)
+            match_report.close()
+            search_end_time = datetime.datetime.now()
+            result_set_description = search_description(field_subfields_to_search, list_of_search_terms,
+                                                        whole_word_search, False, normalized_search)
+            if refine_result_set is not None:
+                result_set_description += ' within (' + refine_result_set.description + ')'
+            result_sets.append(ResultSet(len(records_loaded), matching_record_positions, result_set_description))
+            if run_metrics is not None:
+                run_metrics.details.update(search_metrics_details(
+                    marc_file_loaded, field_subfields_to_search, list_of_search_terms, whole_word_search, False,
+                    search_limits, normalized_search))
+            finish_run_metrics(run_metrics, metrics_file)
+            if search_limits is not None:
+                print('Search limits: ' + search_limits.description())
+            # Print to screen number of records matched.
+            count_of_records_matched = len(matching_record_positions)
+            print('----------------')
+            print(str(count_of_records_matched) + ' records matched. Saved as result set #' + str(len(result_sets))
+                  + '.')
+            # Print to screen the time it took to search the records.
+            search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
+            print('Time to search record(s): ' + search_time + ' seconds')
+            input('Press Enter to Continue')
+        elif menu_selection == '5':
+            print('----------------')
+            match_report = open_match_report(match_echo_limit, match_report_format)
+            run_metrics = start_run_metrics('search', metrics_file, profile_mode)
+            search_start_time = datetime.datetime.now()
+            matching_record_positions = reg_ex_search_loaded_record_positions(
+                records_loaded, field_subfields_to_search, list_of_search_terms, loaded_decoded_record_cache,
+                match_report, run_metrics, search_limits, refine_result_set)
+            match_report.close()
+            search_end_time = datetime.datetime.now()
+            result_set_description = search_description(field_subfields_to_search, list_of_search_terms, False,
+                                                        True)
+            if refine_result_set is not None:
+                result_set_description += ' within (' + refine_result_set.description + ')'
+            result_sets.append(ResultSet(len(records_loaded), matching_record_positions, result_set_description))
+            if run_metrics is not None:
+                run_metrics.details.update(search_metrics_details(
+                    marc_file_loaded, field_subfields_to_search, list_of_search_terms, False, True, search_limits))
+            finish_run_metrics(run_metrics, metrics_file)
+            if search_limits is not None:
+                print('Search limits: ' + search_limits.description())
+            # Print to screen number of records matched.
+            count_of_records_matched = len(matching_record_positions)
+            print('----------------')
+            print(str(count_of_records_matched) + ' records matched. Saved as result set #' + str(len(result_sets))
+                  + '.')
+            # Print to screen the time it took to search the records.
+            search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
+            print('Time to search record(s): ' + search_time + ' seconds')
+            input('Press Enter to Continue')
+        elif menu_selection == '6':
+            count_of_records = len(records_loaded)
+            print('Number of Records Loaded: ', count_of_records)
+            if matching_record_positions:
+                count_of_matched_records = len(matching_record_positions)
+                print('Number of Records Matching Search: ', count_of_matched_records)
+            input('Press Enter to Continue')
+        elif menu_selection == '7':
+            print('----------------')
+            search_start_time = datetime.datetime.now()
+            if loaded_field_inventory is None:
+                try:
+                    if isinstance(records_loaded, MarcRecordStore):
+                        loaded_field_inventory = inventory_record_store(records_loaded, stream_search_processes)
+                    elif isinstance(records_loaded, MarcQueryClient):
+                        loaded_field_inventory = records_loaded.field_inventory()
+                    else:
+                        loaded_field_inventory = FieldInventory()
+                        for record in records_loaded:
+                            loaded_field_inventory.add_record(record)
+                except OSError as error:
+                    print('ERROR: Unable to list the fields of the loaded records. ' + str(error))
+                    input('Press Enter to Continue')
+                    continue
+            search_end_time = datetime.datetime.now()
+            print('----------------')
+            record_count = str(loaded_field_inventory.record_count)
+            print('\"Field\",\"Subfields\",\"Occurrences\",\"Records\"')
+            print('\"LDR\",\"\",\"' + record_count + '\",\"' + record_count + '\"')
+            for field_tag, subfield_codes in sorted(loaded_field_inventory.subfield_codes_by_field().items()):
+                print('\"' + field_tag + '\",\"' + subfield_codes + '\",\"' +
+                      str(loaded_field_inventory.field_occurrences[field_tag]) + '\",\"' +
+                      str(loaded_field_inventory.field_records[field_tag]) + '\"')
+            print('----------------')
+            print('\"Field+Subfield\",\"Occurrences\",\"Records\"')
+            for field_subfield in sorted(loaded_field_inventory.subfield_occurrences):
+                print('\"' + field_subfield + '\",\"' +
+                      str(loaded_field_inventory.subfield_occurrences[field_subfield]) + '\",\"' +
+                      str(loaded_field_inventory.subfield_records[field_subfield]) + '\"')
+            print('----------------')
+            # Blank indicators are shown as \\, like in MARCMaker format.
+            print('\"Field\",\"Indicator\",\"Value\",\"Occurrences\"')
+            for (field_tag, indicator_number, indicator), occurrences in \
+                    sorted(loaded_field_inventory.indicator_values.items()):
+                indicator_value = '\\' if indicator == ' ' else indicator.replace('\"', '\"\"')
+                print('\"' + field_tag + '\",\"' + str(indicator_number) + '\",\"' + indicator_value + '\",\"' +
+                      str(occurrences) + '\"')
+
+            # Print to screen the time it took to search the records.
+            search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
+            print('Time to search record(s): ' + search_time + ' seconds')
+            input('Press Enter to Continue')
+        elif menu_selection == '8':
+            if matching_record_positions:
+                save_matches_to_file(records_loaded, matching_record_positions, metrics_file, profile_mode)
+            else:
+                print('Search returned no matches or You\'ve not run a search, yet.')
+                print('**Steps needed to save matching records.**')
+                print('Load MARC File')
+                print('Enter Search Field(s)')
+                print('Enter Search Term(s)')
+                print('Run Search OR Run RegEx Search')
+                input('Press Enter to Continue')
+        elif menu_selection == '9':
+            try:
+                print('Menu: Enter the number of a menu item to continue.')
+                print('[1]:About (Display MIT License)\n'
+                      '[2]:Change Whole Word Search Setting\n'
+                      '[3]:Change Number of Stream Search Processes\n'
+                      '[4]:Change Load Mode\n'
+                      '[5]:Change Term Index Setting (Whole Word Search)\n'
+                      '[6]:Change Number of Matches Shown on Screen\n'
+                      '[7]:Change Match Report File Setting\n'
+                      '[8]:Change Metrics File Setting\n'
+                      '[9]:Change Profiling Setting\n'
+                      '[0]:Change Search Limits (Match Limit, Exists, Sampling)\n'
+                      '[A]:Change Session Cache Setting (Resume Loaded Records and Result Sets)\n'
+                      '[B]:Change Normalized Search Setting (Ignore Case, Accents and Punctuation)\n')
+                setting_selector = input('Enter Selection: ').lower()
+                invalid_setting_entry = True
+                if len(setting_selector) == 1:
+                    if setting_selector in '1234567890ab':
+                        invalid_setting_entry = False
+                    else:
+                        clear_screen()
+                        error_message = 'ERROR: Invalid Entry. Enter matching number of menu entry.'
+                if invalid_setting_entry:
+                    pass
+                elif setting_selector == 'a':
+                    use_session_cache = user_entry_use_session_cache()
+                elif setting_selector == 'b':
+                    normalized_search = user_entry_normalized_search()
+                else:
+                    if int(setting_selector) == 1:
+                        print("MARC Crucible is released under \"The MIT License (MIT)\"\n"
+                              "Copyright © 2023 Joseph Alway"
+                              "\n\n"
+                              "Permission is hereby granted, free of charge, to any person obtaining a copy of this software and\n"
+                              "associated documentation files (the \"Software\"), to deal in the Software without restriction,\n"
+                              "including without limitation the rights to use, copy, modify, merge, publish, distribute,\n"
+                              "sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished\n"
+                              "to do so, subject to the following conditions:\n"
+                              "The above copyright notice and this permission notice shall be included in all copies or\n"
+                              "substantial portions of the Software."
+                              "\n\n"
+                              "THE SOFTWARE IS PROVIDED \"AS IS\", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO\n"
+                              "THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS\n"
+                              "OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR\n"
+                              "OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.")
+                        input('Press Enter to Continue')
+                        clear_screen()
+                    elif int(setting_selector) == 2:
+                        whole_word_search = user_entry_settings()
+                    elif int(setting_selector) == 3:
+                        stream_search_processes = user_entry_search_processes()
+                    elif int(setting_selector) == 4:
+                        record_load_mode = user_entry_load_mode()
+                    elif int(setting_selector) == 5:
+                        use_term_index = user_entry_use_term_index()
+                    elif int(setting_selector) == 6:
+                        match_echo_limit = user_entry_match_echo()
+                    elif int(setting_selector) == 7:
+                        match_report_format = user_entry_match_report()
+                    elif int(setting_selector) == 8:
+                        metrics_file = user_entry_metrics_file()
+                    elif int(setting_selector) == 9:
+                        profile_mode = user_entry_profile_mode()
+                    elif int(setting_selector) == 0:
+                        search_limits = user_entry_search_limits()
+            except KeyError:
+                pass
+        elif menu_selection == 'a' or menu_selection == 'b':
+            if list_of_search_terms:
+                marc_file_to_stream = user_entry_marc_file_to_load()
+                marc_file_to_save = user_entry_marc_file_to_save()
+                if marc_file_to_save != ':s':
+                    print('----------------')
+                    match_report = open_match_report(match_echo_limit, match_report_format)
+                    run_metrics = start_run_metrics('stream_search', metrics_file, profile_mode)
+                    search_start_time = datetime.datetime.now()
+                    count_of_records_searched, count_of_records_matched = stream_search_and_save(
+                        marc_file_to_stream, marc_file_to_save, field_subfields_to_search, list_of_search_terms,
+                        whole_word_search, menu_selection == 'b', stream_search_processes, match_report, run_metrics,
+                        search_limits)
+                    match_report.close()
+                    search_end_time = datetime.datetime.now()
+                    if run_metrics is not None:
+                        run_metrics.details.update(search_metrics_details(
+                            marc_file_to_stream, field_subfields_to_search, list_of_search_terms, whole_word_search,
+                            menu_selection == 'b', search_limits))
+                        run_metrics.details['search_processes'] = stream_search_processes
+                    finish_run_metrics(run_metrics, metrics_file)
+                    if search_limits is not None:
+                        print('Search limits: ' + search_limits.description())
+                    print('----------------')
+                    print(str(count_of_records_searched) + ' records searched.')
+                    print(str(count_of_records_matched) + ' records matched and saved.')
+                    # Print to screen the time it took to search the records and save the matches.
+                    search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
+                    print('Time to search and save record(s): ' + search_time + ' seconds')
+            else:
+                print('You\'ve not entered a search term, yet.')
+                print('**Steps needed to stream matching records to a file.**')
+                print('Enter Search Field(s)')
+                print('Enter Search Term(s)')
+                print('Stream Search OR Stream RegEx Search')
+            input('Press Enter to Continue')
+        elif menu_selection == 'c':
+            if records_loaded:
+                record_position_to_view = user_entry_record_to_view(records_loaded)
+                if record_position_to_view is not None:
+                    record_to_view = records_loaded[record_position_to_view]
+                    print('----------------')
+                    print('Record ' + str(record_position_to_view + 1) + ' of ' + str(len(records_loaded)))
+                    if record_to_view is None:
+                        print('ERROR: Record couldn\'t be read. Is it a valid MARC record?')
+                    else:
+                        print(record_as_text(record_to_view))
+                    print('----------------')
+            else:
+                print('No records loaded. Load MARC File first.')
+            input('Press Enter to Continue')
+        elif menu_selection == 'd':
+            batch_queries = user_entry_batch_query_file()
+            marc_file_to_stream = user_entry_marc_file_to_load()
+            print('----------------')
+            run_metrics = start_run_metrics('batch_search', metrics_file, profile_mode)
+            search_start_time = datetime.datetime.now()
+            count_of_records_searched, counts_of_records_matched = batch_search_and_save(marc_file_to_stream,
+                                                                                         batch_queries, run_metrics)
+            search_end_time = datetime.datetime.now()
+            if run_metrics is not None:
+                run_metrics.details.update({'marc_file': str(marc_file_to_stream), 'searches': len(batch_queries)})
+            finish_run_metrics(run_metrics, metrics_file)
+            print('----------------')
+            print(str(count_of_records_searched) + ' records searched.')
+            for (batch_query, marc_file_to_save), count_of_records_matched in zip(batch_queries,
+                                                                                  counts_of_records_matched):
+                print(str(count_of_records_matched) + ' records matched and saved to ' + marc_file_to_save)
+            # Print to screen the time it took to search the records and save the matches.
+            search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
+            print('Time to search and save record(s): ' + search_time + ' seconds')
+            input('Press Enter to Continue')
+        elif menu_selection == 'e':
+            if result_sets:
+                # Print to screen the result sets of the searches of the loaded records.
+                for result_set_number, result_set in enumerate(result_sets, 1):
+                    print('#' + str(result_set_number) + ': ' + str(len(result_set)) + ' records: '
+                          + result_set.description)
+                if refine_result_set is not None:
+                    print('Searches only search: ' + refine_result_set.description)
+                print('----------------')
+                result_set_action, result_set = user_entry_result_set_expression(result_sets)
+                if result_set_action == 'combine':
+                    # The combined result set becomes the matched records, to count, save or view.
+                    result_sets.append(result_set)
+                    matching_record_positions = result_set.positions()
+                    print(str(len(matching_record_positions)) + ' records matched. Saved as result set #'
+                          + str(len(result_sets)) + '.')
+                elif result_set_action == 'refine':
+                    refine_result_set = result_set
+                    if refine_result_set is None:
+                        print('Searches search all loaded records.')
+                    else:
+                        print('Searches only search the ' + str(len(refine_result_set)) + ' records of: '
+                              + refine_result_set.description)
+            else:
+                print('No search results. Search loaded records first.')
+            input('Press Enter to Continue')
+        elif menu_selection == 'f':
+            if records_loaded:
+                fixed_field_query = user_entry_fixed_field_query()
+                if fixed_field_query is not None:
+                    print('----------------')
+                    run_metrics = start_run_metrics('fixed_field_search', metrics_file, profile_mode)
+                    search_start_time = datetime.datetime.now()
+                    if isinstance(records_loaded, MarcQueryClient):
+                        result_set = records_loaded.fixed_field_query(fixed_field_query)
+                    else:
+                        if loaded_fixed_field_columns is None:
+                            loaded_fixed_field_columns = FixedFieldColumns.from_records(records_loaded)
+                            columns_end_time = datetime.datetime.now()
+                            # Print to screen the time it took to build the columns.
+                            columns_time = str(format((columns_end_time - search_start_time).total_seconds(), '.2f'))
+                            print('Time to build fixed field columns: ' + columns_time + ' seconds')
+                        result_set = loaded_fixed_field_columns.query(fixed_field_query)
+                    if refine_result_set is not None:
+                        result_set = ResultSet.from_bitmap(result_set.record_count,
+                                                           result_set.bitmap & refine_result_set.bitmap,
+                                                           result_set.description + ' within ('
+                                                           + refine_result_set.description + ')')
+                    search_end_time = datetime.datetime.now()
+                    result_sets.append(result_set)
+                    matching_record_positions = result_set.positions()
+                    if run_metrics is not None:
+                        run_metrics.records += len(records_loaded)
+                        run_metrics.matches += len(matching_record_positions)
+                        run_metrics.details.update({'marc_file': str(marc_file_loaded), 'query': fixed_field_query})
+                    finish_run_metrics(run_metrics, metrics_file)
+                    print(str(len(matching_record_positions)) + ' records matched. Saved as result set #'
+                          + str(len(result_sets)) + '.')
+                    # Print to screen the time it took to search the records.
+                    search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
+                    print('Time to search record(s): ' + search_time + ' seconds')
+            else:
+                print('No records loaded. Load MARC File first.')
+            input('Press Enter to Continue')
+        elif menu_selection == 'g':
+            match_key_tags = user_entry_match_key_tags()
+            marc_inputs_to_check = user_entry_marc_inputs_to_check()
+            duplicates_file_prefix = user_entry_duplicates_file_prefix(match_key_tags)
+            print('----------------')
+            run_metrics = start_run_metrics('duplicate_search', metrics_file, profile_mode)
+            search_start_time = datetime.datetime.now()
+            count_of_records_read, cluster_counts, duplicate_record_counts = find_duplicate_records(
+                marc_inputs_to_check, match_key_tags, duplicates_file_prefix, run_metrics)
+            search_end_time = datetime.datetime.now()
+            if run_metrics is not None:
+                run_metrics.details.update({'marc_files': [str(marc_input) for marc_input in marc_inputs_to_check],
+                                            'match_keys': match_key_tags})
+            finish_run_metrics(run_metrics, metrics_file)
+            print('----------------')
+            print(str(count_of_records_read) + ' records read.')
+            duplicates_files = duplicates_file_names(duplicates_file_prefix, match_key_tags)
+            for match_key_tag in match_key_tags:
+                if cluster_counts[match_key_tag]:
+                    print(DUPLICATE_MATCH_KEYS[match_key_tag] + ': ' + str(cluster_counts[match_key_tag])
+                          + ' clusters of ' + str(duplicate_record_counts[match_key_tag])
+                          + ' records saved to ' + duplicates_files[match_key_tag])
+                else:
+                    print(DUPLICATE_MATCH_KEYS[match_key_tag] + ': No duplicates found.')
+            if any(cluster_counts.values()):
+                print('Clusters saved to ' + duplicates_files['clusters'])
+            # Print to screen the time it took to find and save the duplicates.
+            search_time = str(format((search_end_time - search_start_time).total_seconds(), '.2f'))
+            print('Time to find and save duplicate record(s): ' + search_time + ' seconds')
+            input('Press Enter to Continue')
+        elif menu_selection == '0':
+            if use_session_cache and records_loaded:
+                save_session_cache(records_loaded, loaded_field_inventory, result_sets)
+            running = False
+            sys.exit()
+        else:
+            pass